@@ -0,0 +1,23 @@
+# Copyright (C) 2010 Devnox-IT, http://www.devnox-it.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Index the columns the admin changelists filter on.
+
+BEGIN;
+CREATE INDEX `assetmanager_device_brand` ON `assetmanager_device` (`brand`);
+CREATE INDEX `assetmanager_device_os` ON `assetmanager_device` (`os`);
+CREATE INDEX `assetmanager_device_maintainance` ON `assetmanager_device` (`maintainance`);
+CREATE INDEX `assetmanager_networkinterface_vlan` ON `assetmanager_networkinterface` (`vlan`);
+COMMIT;
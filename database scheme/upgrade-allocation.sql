@@ -0,0 +1,48 @@
+# Copyright (C) 2010 Devnox-IT, http://www.devnox-it.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Add the subnet usage bitmaps and the address reservations. The usage of
+# a subnet is built the first time it is used.
+
+BEGIN;
+CREATE TABLE `assetmanager_subnetusage` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `subnet_id` integer NOT NULL,
+    `family` smallint UNSIGNED NOT NULL,
+    `size` double precision NOT NULL,
+    `used` integer UNSIGNED NOT NULL,
+    `bitmap` longtext NOT NULL,
+    `hint` varchar(32) NOT NULL,
+    `generation` integer UNSIGNED NOT NULL,
+    `stale` bool NOT NULL,
+    UNIQUE (`subnet_id`, `family`)
+)
+;
+ALTER TABLE `assetmanager_subnetusage` ADD CONSTRAINT `subnet_id_refs_id_subnetusage` FOREIGN KEY (`subnet_id`) REFERENCES `assetmanager_subnet` (`id`);
+CREATE TABLE `assetmanager_addressreservation` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `subnet_id` integer NOT NULL,
+    `family` smallint UNSIGNED NOT NULL,
+    `packed` varchar(32) NOT NULL,
+    `address` varchar(39) NOT NULL,
+    `created` datetime NOT NULL,
+    `note` varchar(255) NOT NULL,
+    UNIQUE (`family`, `packed`)
+)
+;
+ALTER TABLE `assetmanager_addressreservation` ADD CONSTRAINT `subnet_id_refs_id_addressreservation` FOREIGN KEY (`subnet_id`) REFERENCES `assetmanager_subnet` (`id`);
+CREATE INDEX `assetmanager_subnetusage_subnet_id` ON `assetmanager_subnetusage` (`subnet_id`);
+CREATE INDEX `assetmanager_addressreservation_subnet_id` ON `assetmanager_addressreservation` (`subnet_id`);
+COMMIT;
@@ -0,0 +1,34 @@
+# Copyright (C) 2010 Devnox-IT, http://www.devnox-it.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Add the audit log table.
+
+BEGIN;
+CREATE TABLE `assetmanager_change` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `content_type_id` integer NOT NULL,
+    `object_id` integer UNSIGNED NOT NULL,
+    `action` varchar(1) NOT NULL,
+    `timestamp` datetime NOT NULL,
+    `user_id` integer UNSIGNED,
+    `rack_id` integer UNSIGNED,
+    `diff` longtext NOT NULL
+)
+;
+ALTER TABLE `assetmanager_change` ADD CONSTRAINT `content_type_id_refs_id_change` FOREIGN KEY (`content_type_id`) REFERENCES `django_content_type` (`id`);
+CREATE INDEX `assetmanager_change_timestamp` ON `assetmanager_change` (`timestamp`);
+CREATE INDEX `assetmanager_change_rack_id` ON `assetmanager_change` (`rack_id`);
+CREATE INDEX `assetmanager_change_object` ON `assetmanager_change` (`content_type_id`, `object_id`, `timestamp`);
+COMMIT;
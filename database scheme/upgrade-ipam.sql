@@ -0,0 +1,39 @@
+# Copyright (C) 2010 Devnox-IT, http://www.devnox-it.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Upgrade an existing database to the packed address columns, then run
+# `manage.py migrate_addresses` to fill them from the textual addresses.
+
+BEGIN;
+ALTER TABLE `assetmanager_subnet` MODIFY `networkaddr6` varchar(39);
+ALTER TABLE `assetmanager_subnet` MODIFY `subnetaddr6` varchar(39);
+ALTER TABLE `assetmanager_subnet` MODIFY `lastip6` varchar(39);
+ALTER TABLE `assetmanager_subnet` ADD COLUMN `first4` varchar(8);
+ALTER TABLE `assetmanager_subnet` ADD COLUMN `last4` varchar(8);
+ALTER TABLE `assetmanager_subnet` ADD COLUMN `prefixlen4` smallint UNSIGNED;
+ALTER TABLE `assetmanager_subnet` ADD COLUMN `first6` varchar(32);
+ALTER TABLE `assetmanager_subnet` ADD COLUMN `last6` varchar(32);
+ALTER TABLE `assetmanager_subnet` ADD COLUMN `prefixlen6` smallint UNSIGNED;
+CREATE INDEX `assetmanager_subnet_first4` ON `assetmanager_subnet` (`first4`);
+CREATE INDEX `assetmanager_subnet_last4` ON `assetmanager_subnet` (`last4`);
+CREATE INDEX `assetmanager_subnet_first6` ON `assetmanager_subnet` (`first6`);
+CREATE INDEX `assetmanager_subnet_last6` ON `assetmanager_subnet` (`last6`);
+ALTER TABLE `assetmanager_networkinterface` MODIFY `ip6` varchar(39);
+ALTER TABLE `assetmanager_networkinterface` MODIFY `gateway6` varchar(39);
+ALTER TABLE `assetmanager_networkinterface` ADD COLUMN `packed4` varchar(8);
+ALTER TABLE `assetmanager_networkinterface` ADD COLUMN `packed6` varchar(32);
+CREATE INDEX `assetmanager_networkinterface_packed4` ON `assetmanager_networkinterface` (`packed4`);
+CREATE INDEX `assetmanager_networkinterface_packed6` ON `assetmanager_networkinterface` (`packed6`);
+COMMIT;
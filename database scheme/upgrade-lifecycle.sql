@@ -0,0 +1,33 @@
+# Copyright (C) 2010 Devnox-IT, http://www.devnox-it.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Index end of life and warranty dates and add the lifecycle report
+# snapshots, then run `manage.py update_lifecycle --full`.
+
+BEGIN;
+CREATE INDEX `assetmanager_device_lifecycle` ON `assetmanager_device` (`enddate`, `rack_id`);
+CREATE INDEX `assetmanager_harddisk_lifecycle` ON `assetmanager_harddisk` (`enddate`, `array_id`, `parent_id`);
+CREATE TABLE `assetmanager_lifecyclereport` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `day` date NOT NULL,
+    `generated` datetime NOT NULL,
+    `horizon` integer UNSIGNED NOT NULL,
+    `last_change` integer UNSIGNED NOT NULL,
+    `state` longtext NOT NULL,
+    `report` longtext NOT NULL
+)
+;
+CREATE INDEX `assetmanager_lifecyclereport_day` ON `assetmanager_lifecyclereport` (`day`);
+COMMIT;
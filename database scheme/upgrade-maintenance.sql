@@ -0,0 +1,22 @@
+# Copyright (C) 2010 Devnox-IT, http://www.devnox-it.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Index maintenance windows by date, then run `manage.py update_maintenance`
+# to derive the maintainance flag of every device.
+
+BEGIN;
+CREATE INDEX `assetmanager_maintenance_start_date` ON `assetmanager_maintenance` (`start_date`);
+CREATE INDEX `assetmanager_maintenance_end_date` ON `assetmanager_maintenance` (`end_date`);
+COMMIT;
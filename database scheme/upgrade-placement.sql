@@ -0,0 +1,31 @@
+# Copyright (C) 2010 Devnox-IT, http://www.devnox-it.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Add the VM host loads, then run `manage.py rebuild_hostloads`.
+
+BEGIN;
+CREATE TABLE `assetmanager_hostload` (
+    `server_id` integer NOT NULL PRIMARY KEY,
+    `ram` integer UNSIGNED NOT NULL,
+    `cores` integer UNSIGNED NOT NULL,
+    `vms` integer UNSIGNED NOT NULL,
+    `vm_ram` integer UNSIGNED NOT NULL,
+    `vm_cores` integer UNSIGNED NOT NULL,
+    `free_ram` integer NOT NULL
+)
+;
+ALTER TABLE `assetmanager_hostload` ADD CONSTRAINT `server_id_refs_device_ptr_id_hostload` FOREIGN KEY (`server_id`) REFERENCES `assetmanager_server` (`device_ptr_id`);
+CREATE INDEX `assetmanager_hostload_free_ram` ON `assetmanager_hostload` (`free_ram`);
+COMMIT;
@@ -0,0 +1,42 @@
+# Copyright (C) 2010 Devnox-IT, http://www.devnox-it.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Add the nominal device draw, the power connections and the UPS and PDU
+# loads, then run `manage.py rebuild_power`.
+
+BEGIN;
+ALTER TABLE `assetmanager_device` ADD COLUMN `draw` integer UNSIGNED;
+CREATE TABLE `assetmanager_powerconnection` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `device_id` integer NOT NULL,
+    `source_id` integer NOT NULL,
+    `outlet` integer UNSIGNED,
+    UNIQUE (`source_id`, `outlet`)
+)
+;
+ALTER TABLE `assetmanager_powerconnection` ADD CONSTRAINT `device_id_refs_id_powerconnection` FOREIGN KEY (`device_id`) REFERENCES `assetmanager_device` (`id`);
+ALTER TABLE `assetmanager_powerconnection` ADD CONSTRAINT `source_id_refs_id_powerconnection` FOREIGN KEY (`source_id`) REFERENCES `assetmanager_device` (`id`);
+CREATE TABLE `assetmanager_powerload` (
+    `source_id` integer NOT NULL PRIMARY KEY,
+    `connections` integer UNSIGNED NOT NULL,
+    `load` double precision NOT NULL,
+    `capacity` double precision
+)
+;
+ALTER TABLE `assetmanager_powerload` ADD CONSTRAINT `source_id_refs_id_powerload` FOREIGN KEY (`source_id`) REFERENCES `assetmanager_device` (`id`);
+CREATE INDEX `assetmanager_powerconnection_device_id` ON `assetmanager_powerconnection` (`device_id`);
+CREATE INDEX `assetmanager_powerconnection_source_id` ON `assetmanager_powerconnection` (`source_id`);
+CREATE INDEX `assetmanager_powerload_load` ON `assetmanager_powerload` (`load`);
+COMMIT;
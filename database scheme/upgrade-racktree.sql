@@ -0,0 +1,22 @@
+# Copyright (C) 2010 Devnox-IT, http://www.devnox-it.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Upgrade an existing database to materialised rack paths, then run
+# `manage.py rebuild_rackpaths` to fill them from the parent racks.
+
+BEGIN;
+ALTER TABLE `assetmanager_rack` ADD COLUMN `path` varchar(255) NOT NULL DEFAULT '';
+CREATE INDEX `assetmanager_rack_path` ON `assetmanager_rack` (`path`);
+COMMIT;
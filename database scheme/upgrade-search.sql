@@ -0,0 +1,42 @@
+# Copyright (C) 2010 Devnox-IT, http://www.devnox-it.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Add the search index table, then run `manage.py rebuild_search` to fill
+# it. MySQL uses the in-memory index of assetmanager.search, so no full
+# text index is created here.
+
+BEGIN;
+CREATE TABLE `assetmanager_searchentry` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `kind` varchar(32) NOT NULL,
+    `object_id` integer UNSIGNED NOT NULL,
+    `label` varchar(255) NOT NULL,
+    `text` longtext NOT NULL,
+    `type` varchar(32) NOT NULL,
+    `device_id` integer UNSIGNED,
+    `rack_id` integer UNSIGNED,
+    `serverroom_id` integer UNSIGNED,
+    `datacentre_id` integer UNSIGNED,
+    `os` varchar(255) NOT NULL,
+    UNIQUE (`kind`, `object_id`)
+)
+;
+CREATE INDEX `assetmanager_searchentry_type` ON `assetmanager_searchentry` (`type`);
+CREATE INDEX `assetmanager_searchentry_device_id` ON `assetmanager_searchentry` (`device_id`);
+CREATE INDEX `assetmanager_searchentry_rack_id` ON `assetmanager_searchentry` (`rack_id`);
+CREATE INDEX `assetmanager_searchentry_serverroom_id` ON `assetmanager_searchentry` (`serverroom_id`);
+CREATE INDEX `assetmanager_searchentry_datacentre_id` ON `assetmanager_searchentry` (`datacentre_id`);
+CREATE INDEX `assetmanager_searchentry_os` ON `assetmanager_searchentry` (`os`);
+COMMIT;
@@ -0,0 +1,36 @@
+# Copyright (C) 2010 Devnox-IT, http://www.devnox-it.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Let raidType hold '10' (JBOD) and add the array capacities, then run
+# `manage.py rebuild_capacity`.
+
+BEGIN;
+ALTER TABLE `assetmanager_raidarray` MODIFY `raidType` varchar(2) NOT NULL;
+CREATE TABLE `assetmanager_arraycapacity` (
+    `array_id` integer NOT NULL PRIMARY KEY,
+    `device_id` integer,
+    `server_id` integer,
+    `disks` integer UNSIGNED NOT NULL,
+    `raw` double precision NOT NULL,
+    `usable` double precision NOT NULL,
+    `valid` bool NOT NULL
+)
+;
+ALTER TABLE `assetmanager_arraycapacity` ADD CONSTRAINT `array_id_refs_id_arraycapacity` FOREIGN KEY (`array_id`) REFERENCES `assetmanager_raidarray` (`id`);
+ALTER TABLE `assetmanager_arraycapacity` ADD CONSTRAINT `device_id_refs_id_arraycapacity` FOREIGN KEY (`device_id`) REFERENCES `assetmanager_device` (`id`);
+ALTER TABLE `assetmanager_arraycapacity` ADD CONSTRAINT `server_id_refs_device_ptr_id_arraycapacity` FOREIGN KEY (`server_id`) REFERENCES `assetmanager_server` (`device_ptr_id`);
+CREATE INDEX `assetmanager_arraycapacity_device_id` ON `assetmanager_arraycapacity` (`device_id`);
+CREATE INDEX `assetmanager_arraycapacity_server_id` ON `assetmanager_arraycapacity` (`server_id`);
+COMMIT;
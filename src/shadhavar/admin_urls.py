@@ -0,0 +1,6 @@
+# The admin, included by urls.py: models are registered the first time
+# an admin page is requested or reversed, not when the URLconf loads.
+from django.contrib import admin
+
+admin.autodiscover()
+urlpatterns = admin.site.get_urls()
@@ -1,24 +1,200 @@
 from assetmanager.models import * # import all models
+from assetmanager import counts, locations
 from django.contrib import admin
+from django.contrib.admin.filterspecs import FilterSpec
+from django.contrib.admin.views.main import ChangeList, IncorrectLookupParameters, MAX_SHOW_ALL_ALLOWED
+from django.core.paginator import Paginator, InvalidPage
+from django.utils.encoding import smart_unicode
+from django.utils.translation import ugettext as _
 
-admin.site.register(Datacentre)
-admin.site.register(Serverroom)
-admin.site.register(Rack)
-admin.site.register(Device)
-admin.site.register(Router)
-admin.site.register(Server)
-admin.site.register(Switch)
-admin.site.register(KVM)
-admin.site.register(UPS)
-admin.site.register(Other)
-admin.site.register(PDU)
-admin.site.register(Subnet)
-admin.site.register(Networkinterface)
-admin.site.register(VM)
-admin.site.register(DeviceFunction)
-admin.site.register(DiskArray)
-admin.site.register(NetworkHardInterface)
-admin.site.register(RaidArray)
-admin.site.register(Harddisk)
-admin.site.register(Partition)
-admin.site.register(Maintenance)
+class RackFilterSpec(FilterSpec):
+    """
+    Filter on a foreign key to Rack in two steps, serverroom first and
+    then the racks in it, taken from the location tree. Listing every rack
+    would be a query and a page of thousands of links.
+    """
+    def __init__(self, f, request, params, model, model_admin):
+        super(RackFilterSpec, self).__init__(f, request, params, model, model_admin)
+        self.serverroom_kwarg = '%s__serverroom__id__exact' % f.name
+        self.serverroom_val = request.GET.get(self.serverroom_kwarg, None)
+        self.rack_kwarg = '%s__id__exact' % f.name
+        self.rack_val = request.GET.get(self.rack_kwarg, None)
+        self.tree = locations.tree()
+
+    def title(self):
+        return self.field.verbose_name
+
+    def choices(self, cl):
+        yield {'selected': self.serverroom_val is None and self.rack_val is None,
+               'query_string': cl.get_query_string({}, [self.serverroom_kwarg, self.rack_kwarg]),
+               'display': _('All')}
+        try:
+            room = (locations.SERVERROOM, int(self.serverroom_val))
+        except (TypeError, ValueError):
+            room = None
+        if room is None or self.tree.node(room) is None:
+            rooms = []
+            for key, node in self.tree.nodes.iteritems():
+                if key[0] == locations.SERVERROOM:
+                    datacentre = self.tree.node(node['parent']) or {}
+                    rooms.append((datacentre.get('name', u''), node['name'], key[1]))
+            for datacentre, name, id in sorted(rooms):
+                yield {'selected': False,
+                       'query_string': cl.get_query_string({self.serverroom_kwarg: id}, [self.rack_kwarg]),
+                       'display': u'%s / %s' % (datacentre, name)}
+            return
+        yield {'selected': self.rack_val is None,
+               'query_string': cl.get_query_string({}, [self.rack_kwarg]),
+               'display': self.tree.node(room)['name']}
+        for id in self.tree.racks(room):
+            yield {'selected': self.rack_val == smart_unicode(id),
+                   'query_string': cl.get_query_string({self.rack_kwarg: id}),
+                   'display': u'- %s' % self.tree.node((locations.RACK, id))['name']}
+
+FilterSpec.filter_specs.insert(0, (lambda f: bool(f.rel) and f.rel.to is Rack, RackFilterSpec))
+
+class CountedPaginator(Paginator):
+    def _get_count(self):
+        if self._count is None:
+            self._count = counts.count(self.object_list)
+        return self._count
+    count = property(_get_count)
+
+class CountedChangeList(ChangeList):
+    """
+    ChangeList that counts through assetmanager.counts, so large tables
+    are estimated and repeated counts come from the cache.
+    """
+    def get_results(self, request):
+        paginator = CountedPaginator(self.query_set, self.list_per_page)
+        result_count = paginator.count
+        if not self.query_set.query.where:
+            full_result_count = result_count
+        else:
+            full_result_count = counts.count(self.root_query_set)
+
+        can_show_all = result_count <= MAX_SHOW_ALL_ALLOWED
+        multi_page = result_count > self.list_per_page
+
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = self.query_set._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num+1).object_list
+            except InvalidPage:
+                raise IncorrectLookupParameters
+
+        self.result_count = result_count
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+class AssetAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin whose changelist follows the relations in `related`, the
+    ones its columns print, and counts through CountedChangeList.
+    """
+    related = ()
+
+    def queryset(self, request):
+        qs = super(AssetAdmin, self).queryset(request)
+        if self.related:
+            qs = qs.select_related(*self.related)
+        return qs
+
+    def get_changelist(self, request, **kwargs):
+        return CountedChangeList
+
+    def lookup_allowed(self, lookup, value):
+        # the serverroom step of RackFilterSpec
+        for name in self.list_filter:
+            if lookup == '%s__serverroom__id__exact' % name:
+                return True
+        return super(AssetAdmin, self).lookup_allowed(lookup, value)
+
+class DatacentreAdmin(AssetAdmin):
+    list_display = ('name', 'city', 'country')
+
+class ServerroomAdmin(AssetAdmin):
+    list_display = ('name', 'datacentre', 'floor')
+    list_filter = ('datacentre',)
+    related = ('datacentre',)
+
+class RackAdmin(AssetAdmin):
+    list_display = ('__unicode__', 'name', 'kind', 'serverroom', 'row', 'column')
+    list_filter = ('serverroom',)
+    raw_id_fields = ('rack',)
+
+class DeviceAdmin(AssetAdmin):
+    list_display = ('__unicode__', 'name', 'rack', 'position', 'brand', 'os', 'maintainance')
+    list_filter = ('maintainance', 'rack', 'os', 'brand')
+    raw_id_fields = ('rack',)
+
+class KVMAdmin(DeviceAdmin):
+    raw_id_fields = ('rack', 'connections')
+
+class DiskArrayAdmin(DeviceAdmin):
+    list_display = DeviceAdmin.list_display + ('conntectTo',)
+    raw_id_fields = ('rack', 'conntectTo')
+    related = ('rack__serverroom', 'conntectTo__rack')
+
+class VMAdmin(DeviceAdmin):
+    list_display = DeviceAdmin.list_display + ('server',)
+    raw_id_fields = ('rack', 'server')
+    related = ('rack__serverroom', 'server__rack')
+
+class SubnetAdmin(AssetAdmin):
+    list_display = ('__unicode__', 'networkaddr4', 'subnetaddr4', 'networkaddr6', 'subnetaddr6')
+
+class NetworkinterfaceAdmin(AssetAdmin):
+    list_display = ('name', 'device', 'subnet', 'ip4', 'ip6', 'mac', 'vlan')
+    list_filter = ('vlan', 'kind')
+    raw_id_fields = ('device', 'subnet', 'connectedTo')
+    related = ('device__rack', 'subnet')
+
+class RaidArrayAdmin(AssetAdmin):
+    list_display = ('name', 'raidType', 'Size')
+
+class DevicePartAdmin(AssetAdmin):
+    list_display = ('__unicode__', 'parent', 'size')
+    raw_id_fields = ('parent',)
+
+class HarddiskAdmin(DevicePartAdmin):
+    list_filter = ('enddate',)
+    raw_id_fields = ('parent', 'array')
+
+class MaintenanceAdmin(AssetAdmin):
+    list_display = ('target', 'reason', 'start_date', 'end_date', 'scheduled')
+    list_filter = ('start_date',)
+    raw_id_fields = ('target',)
+    related = ('target__rack',)
+
+class PowerConnectionAdmin(AssetAdmin):
+    list_display = ('__unicode__', 'source', 'outlet', 'device')
+    raw_id_fields = ('device', 'source')
+    related = ('source__rack', 'device__rack')
+
+admin.site.register(Datacentre, DatacentreAdmin)
+admin.site.register(Serverroom, ServerroomAdmin)
+admin.site.register(Rack, RackAdmin)
+admin.site.register(Device, DeviceAdmin)
+admin.site.register(Router, DeviceAdmin)
+admin.site.register(Server, DeviceAdmin)
+admin.site.register(Switch, DeviceAdmin)
+admin.site.register(KVM, KVMAdmin)
+admin.site.register(UPS, DeviceAdmin)
+admin.site.register(Other, DeviceAdmin)
+admin.site.register(PDU, DeviceAdmin)
+admin.site.register(Subnet, SubnetAdmin)
+admin.site.register(Networkinterface, NetworkinterfaceAdmin)
+admin.site.register(VM, VMAdmin)
+admin.site.register(DeviceFunction, AssetAdmin)
+admin.site.register(DiskArray, DiskArrayAdmin)
+admin.site.register(NetworkHardInterface, AssetAdmin)
+admin.site.register(RaidArray, RaidArrayAdmin)
+admin.site.register(Harddisk, HarddiskAdmin)
+admin.site.register(Partition, DevicePartAdmin)
+admin.site.register(Maintenance, MaintenanceAdmin)
+admin.site.register(PowerConnection, PowerConnectionAdmin)
@@ -0,0 +1,400 @@
+"""
+Address allocation: handing out the free addresses of a subnet, each
+once, and how full the subnets and VLANs are.
+
+Every subnet has a SubnetUsage row per address family. An address is
+used when an interface has it or when it is reserved. A subnet of at
+most DENSE_LIMIT host addresses keeps a bitmap of the used ones, in hex
+like RackOccupancy, where bit n is its n-th host address. Larger subnets
+(IPv6 prefixes) keep only a count. Their free addresses are found by
+walking the used addresses in index order.
+
+allocate() picks the free addresses following the last one it handed
+out and reserves them as AddressReservation rows. A worker that hands
+out many single addresses uses an Allocator, which reserves them a
+block at a time and so pays one claim per block rather than per address. It writes the usage
+row with an optimistic update on its generation. If another worker
+allocated in between, the update changes nothing and the allocation
+starts over with the new bitmap. The unique index on the reserved
+addresses covers subnets that overlap.
+
+Saving or deleting an interface sets or clears its bit the same way.
+An interface saved on a reserved address takes the reservation over.
+Bulk inserts and subnet changes mark the rows stale instead. A stale
+row is rebuilt the next time it is used.
+"""
+
+import heapq
+from collections import deque
+from datetime import datetime
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from assetmanager.models import AddressReservation, Networkinterface, Subnet, SubnetUsage
+from assetmanager import ipaddr, ipam, snapshot
+from assetmanager.bulk import insert
+from assetmanager.signals import bulk_inserted
+
+DENSE_LIMIT = 2 ** 16
+RETRIES = 50
+BLOCK_SIZE = 1000
+
+_bitmaps = {} # usage pk -> (generation, bitmap)
+
+class SubnetFull(Exception):
+    pass
+
+class Contention(Exception):
+    pass
+
+def used(family, low, high):
+    """
+    The used addresses from low to high, as integers in ascending order;
+    an address both reserved and on an interface comes twice.
+    """
+    packed, width = ipam.FAMILIES[family][3:]
+    start, end = ipaddr.from_int(low, width), ipaddr.from_int(high, width)
+    interfaces = Networkinterface.objects.filter(**{packed + '__gte': start, packed + '__lte': end})
+    reserved = AddressReservation.objects.filter(family=family, packed__gte=start, packed__lte=end)
+    merged = heapq.merge(interfaces.order_by(packed).values_list(packed, flat=True).iterator(),
+                         reserved.order_by('packed').values_list('packed', flat=True).iterator())
+    return (ipaddr.to_int(value) for value in merged)
+
+def build(family, low, high):
+    """
+    (used, bitmap) of the host addresses from low to high; bitmap is
+    None above DENSE_LIMIT addresses.
+    """
+    if high - low + 1 > DENSE_LIMIT:
+        packed, width = ipam.FAMILIES[family][3:]
+        start, end = ipaddr.from_int(low, width), ipaddr.from_int(high, width)
+        interfaces = Networkinterface.objects.filter(**{packed + '__gte': start, packed + '__lte': end}).values(packed)
+        reserved = AddressReservation.objects.filter(family=family, packed__gte=start, packed__lte=end)
+        return interfaces.distinct().count() + reserved.exclude(packed__in=interfaces).count(), None
+    taken = bytearray((high - low) // 8 + 1)
+    for value in used(family, low, high):
+        taken[(value - low) >> 3] |= 1 << ((value - low) & 7)
+    bitmap = int(str(taken[::-1]).encode('hex') or '0', 16)
+    return bin(bitmap).count('1'), bitmap
+
+def load(subnet, family):
+    """
+    (pk, generation, used, hint) of the usage of subnet, which is built
+    first if it is missing or stale.
+    """
+    low, high = ipam.host_range(subnet, family)
+    for attempt in range(RETRIES):
+        rows = SubnetUsage.objects.filter(subnet=subnet.pk, family=family).values_list('pk', 'generation', 'used', 'hint', 'stale')
+        if rows and not rows[0][4]:
+            return rows[0][:4]
+        count, bitmap = build(family, low, high)
+        values = dict(size=high - low + 1, used=count, bitmap=bitmap is not None and '%x' % bitmap or '', stale=False)
+        if rows:
+            pk, generation = rows[0][:2]
+            if SubnetUsage.objects.filter(pk=pk, generation=generation).update(generation=generation + 1, **values):
+                transaction.commit_unless_managed()
+                if bitmap is not None:
+                    _bitmaps[pk] = (generation + 1, bitmap)
+        else:
+            try:
+                SubnetUsage.objects.create(subnet=subnet, family=family, generation=0, hint='', **values)
+                transaction.commit_unless_managed()
+            except IntegrityError:
+                transaction.rollback_unless_managed()
+    raise Contention('the usage of subnet %s keeps changing' % subnet.pk)
+
+def bitmap(pk, generation):
+    """
+    The bitmap of a usage row at generation, None if it has moved on.
+    """
+    cached = _bitmaps.get(pk)
+    if cached is None or cached[0] != generation:
+        rows = SubnetUsage.objects.filter(pk=pk, generation=generation).values_list('bitmap', flat=True)
+        if not rows:
+            return None
+        cached = _bitmaps[pk] = (generation, int(rows[0] or '0', 16))
+    return cached[1]
+
+def pick_dense(bits, size, start, count):
+    """
+    The offsets of the first count clear bits of bits from start on,
+    wrapping around to the first bit.
+    """
+    free = ~bits & ((1 << size) - 1)
+    picked = []
+    for part in (free >> start << start, free & ((1 << start) - 1)):
+        while part and len(picked) < count:
+            lowest = part & -part
+            picked.append(lowest.bit_length() - 1)
+            part ^= lowest
+    return picked
+
+def pick_sparse(family, low, high, start, count):
+    """
+    The first count unused addresses from start on, wrapping around to
+    low, as integers.
+    """
+    picked = []
+    for first, last in ((start, high), (low, start - 1)):
+        candidate = first
+        for value in used(family, first, last):
+            while candidate < value and len(picked) < count:
+                picked.append(candidate)
+                candidate += 1
+            if len(picked) == count:
+                return picked
+            candidate = max(candidate, value + 1)
+        while candidate <= last and len(picked) < count:
+            picked.append(candidate)
+            candidate += 1
+    return picked
+
+def claim(pk, generation, values, reservations):
+    """
+    Write the usage row if it is still at generation, with the
+    reservations, in one transaction. False if another worker changed
+    the row first, None if one of the addresses was reserved meanwhile.
+    """
+    transaction.enter_transaction_management()
+    transaction.managed(True)
+    try:
+        if not SubnetUsage.objects.filter(pk=pk, generation=generation).update(generation=generation + 1, **values):
+            transaction.rollback()
+            return False
+        try:
+            insert(connection.cursor(), AddressReservation, reservations, pk=False)
+        except IntegrityError:
+            transaction.rollback()
+            return None
+        transaction.commit()
+        return True
+    except:
+        transaction.rollback()
+        raise
+    finally:
+        transaction.leave_transaction_management()
+
+def allocate(subnet, count=1, family=4, note=''):
+    """
+    Reserve the next count free addresses of subnet and return them.
+    Raises SubnetFull if there aren't that many, and Contention if other
+    workers keep getting there first.
+    """
+    if not isinstance(subnet, Subnet):
+        subnet = Subnet.objects.get(pk=subnet)
+    if ipam.host_range(subnet, family) is None:
+        raise ValueError('subnet %s has no IPv%d range' % (subnet.pk, family))
+    low, high = ipam.host_range(subnet, family)
+    size, width = high - low + 1, ipam.FAMILIES[family][4]
+    for attempt in range(RETRIES):
+        pk, generation, count_used, hint = load(subnet, family)
+        start = hint and min(max(ipaddr.to_int(hint) + 1, low), high + 1) or low
+        if start > high:
+            start = low
+        if size <= DENSE_LIMIT:
+            bits = bitmap(pk, generation)
+            if bits is None:
+                continue
+            offsets = pick_dense(bits, size, start - low, count)
+            picked = [low + offset for offset in offsets]
+        else:
+            picked = pick_sparse(family, low, high, start, count)
+        if len(picked) < count:
+            raise SubnetFull('subnet %s has %d free addresses' % (subnet.pk, len(picked)))
+        values = dict(used=count_used + count, hint=ipaddr.from_int(picked[-1], width))
+        if size <= DENSE_LIMIT:
+            for offset in offsets:
+                bits |= 1 << offset
+            values['bitmap'] = '%x' % bits
+        now = datetime.now()
+        addresses = [ipaddr.unpack(ipaddr.from_int(value, width)) for value in picked]
+        reservations = [dict(subnet_id=subnet.pk, family=family, packed=ipaddr.from_int(value, width), address=address,
+                             created=now, note=note) for value, address in zip(picked, addresses)]
+        claimed = claim(pk, generation, values, reservations)
+        if claimed:
+            if size <= DENSE_LIMIT:
+                _bitmaps[pk] = (generation + 1, bits)
+            return addresses
+        if claimed is None:
+            # reserved through an overlapping subnet, which the bitmap doesn't know
+            mark_stale(SubnetUsage.objects.filter(pk=pk))
+    raise Contention('subnet %s is too busy' % subnet.pk)
+
+def release(address):
+    """
+    Give a reserved address back.
+    """
+    family, packed = ipam.parse(address)
+    reservations = AddressReservation.objects.filter(family=family, packed=packed)
+    found = reservations.exists()
+    reservations.delete()
+    transaction.commit_unless_managed()
+    if found:
+        sync(family, packed)
+    return found
+
+class Allocator(object):
+    """
+    Hands out the free addresses of a subnet one at a time, for a single
+    worker or thread. They are reserved block_size at a time; the ones
+    not handed out yet stay reserved until close().
+    """
+    def __init__(self, subnet, family=4, note='', block_size=BLOCK_SIZE):
+        self.subnet, self.family, self.note, self.block_size = subnet, family, note, block_size
+        self.pool = deque()
+
+    def next(self):
+        """
+        The next reserved address. Raises SubnetFull once there are none.
+        """
+        while not self.pool:
+            try:
+                self.pool.extend(allocate(self.subnet, self.block_size, self.family, self.note))
+            except SubnetFull:
+                if self.block_size == 1:
+                    raise
+                self.block_size = max(self.block_size // 2, 1)
+        return self.pool.popleft()
+
+    def close(self):
+        """
+        Give back the addresses that were reserved but not handed out.
+        """
+        if not self.pool:
+            return
+        packed = sorted(ipam.parse(address)[1] for address in self.pool)
+        self.pool.clear()
+        for i in range(0, len(packed), 500):
+            AddressReservation.objects.filter(family=self.family, packed__in=packed[i:i + 500]).delete()
+        mark_stale(containing(self.family, packed[0], packed[-1]))
+
+def mark_stale(usages):
+    usages.update(stale=True, generation=F('generation') + 1)
+    transaction.commit_unless_managed()
+
+def containing(family, start, end=None):
+    """
+    The usage rows of the subnets containing start..end.
+    """
+    first, last = ipam.FAMILIES[family][:2]
+    return SubnetUsage.objects.filter(family=family, **{'subnet__%s__lte' % first: end or start,
+                                                        'subnet__%s__gte' % last: start})
+
+def sync(family, packed):
+    """
+    Set or clear the bit of an address in the usage of every subnet
+    containing it, after an interface got or lost it.
+    """
+    field = ipam.FAMILIES[family][3]
+    taken = Networkinterface.objects.filter(**{field: packed}).exists() or \
+        AddressReservation.objects.filter(family=family, packed=packed).exists()
+    first, last = ipam.FAMILIES[family][:2]
+    value = ipaddr.to_int(packed)
+    rows = containing(family, packed).filter(stale=False).values_list('pk', 'subnet__%s' % first, 'subnet__%s' % last)
+    for pk, start, end in rows:
+        low, high = ipam.hosts(start, end, family)
+        if not low <= value <= high:
+            continue
+        if high - low + 1 > DENSE_LIMIT:
+            mark_stale(SubnetUsage.objects.filter(pk=pk))
+            continue
+        for attempt in range(RETRIES):
+            generation, count = SubnetUsage.objects.filter(pk=pk).values_list('generation', 'used')[0]
+            bits = bitmap(pk, generation)
+            if bits is None:
+                continue
+            bit = 1 << (value - low)
+            if bool(bits & bit) == taken:
+                break
+            bits ^= bit
+            if SubnetUsage.objects.filter(pk=pk, generation=generation).update(
+                    generation=generation + 1, bitmap='%x' % bits, used=count + (taken and 1 or -1)):
+                transaction.commit_unless_managed()
+                _bitmaps[pk] = (generation + 1, bits)
+                break
+        else:
+            mark_stale(SubnetUsage.objects.filter(pk=pk))
+
+def _ratio(used, size):
+    return size and float(used) / size or 0.0
+
+def utilisation(subnets=None, family=4):
+    """
+    {subnet id: {'size', 'used', 'free', 'ratio'}} of the given subnets,
+    or of all of them.
+    """
+    if subnets is None:
+        subnets = Subnet.objects.all()
+    subnets = subnets.filter(**{'%s__isnull' % ipam.FAMILIES[family][0]: False})
+    rows = dict((row[0], row[1:]) for row in SubnetUsage.objects.filter(
+        family=family, stale=False, subnet__in=subnets).values_list('subnet', 'size', 'used'))
+    result = {}
+    for subnet in subnets:
+        if subnet.pk not in rows:
+            load(subnet, family)
+            rows[subnet.pk] = SubnetUsage.objects.filter(subnet=subnet, family=family).values_list('size', 'used')[0]
+        size, count = rows[subnet.pk]
+        result[subnet.pk] = {'size': size, 'used': count, 'free': size - count, 'ratio': _ratio(count, size)}
+    return result
+
+def vlan_utilisation(family=4):
+    """
+    {vlan: {'subnets', 'interfaces', 'size', 'used', 'free', 'ratio'}}
+    over the subnets the interfaces of every VLAN are in.
+    """
+    pairs = Networkinterface.objects.exclude(vlan=None).values_list('vlan', 'subnet').distinct().order_by()
+    subnets = {}
+    for vlan, subnet in pairs:
+        subnets.setdefault(vlan, set()).add(subnet)
+    usage = utilisation(Subnet.objects.filter(pk__in=set(pk for pks in subnets.values() for pk in pks)), family)
+    counts = {}
+    for vlan, subnet in Networkinterface.objects.exclude(vlan=None).values_list('vlan', 'subnet').order_by():
+        counts[vlan] = counts.get(vlan, 0) + 1
+    result = {}
+    for vlan, pks in subnets.items():
+        size = sum(usage[pk]['size'] for pk in pks if pk in usage)
+        count = sum(usage[pk]['used'] for pk in pks if pk in usage)
+        result[vlan] = {'subnets': sorted(pks), 'interfaces': counts.get(vlan, 0), 'size': size, 'used': count,
+                        'free': size - count, 'ratio': _ratio(count, size)}
+    return result
+
+def interface_pre_save(sender, instance, raw, **kwargs):
+    instance._allocation_old = None
+    old = not raw and snapshot.stored(sender, instance)
+    if old:
+        instance._allocation_old = (old['packed4'], old['packed6'])
+
+def interface_saved(sender, instance, **kwargs):
+    old = getattr(instance, '_allocation_old', None) or (None, None)
+    for family, new, previous in ((4, instance.packed4, old[0]), (6, instance.packed6, old[1])):
+        if new and new != previous:
+            # the address was handed out for this interface, or it is taken now anyway
+            AddressReservation.objects.filter(family=family, packed=new).delete()
+        for packed in set([new, previous]):
+            if packed:
+                sync(family, packed)
+
+def interface_deleted(sender, instance, **kwargs):
+    for family, packed in ((4, instance.packed4), (6, instance.packed6)):
+        if packed:
+            sync(family, packed)
+
+def interfaces_inserted(sender, pks, **kwargs):
+    for family in (4, 6):
+        field = ipam.FAMILIES[family][3]
+        for i in range(0, len(pks), 500):
+            addresses = Networkinterface.objects.filter(pk__in=pks[i:i + 500]).exclude(**{field: None})
+            addresses = sorted(addresses.values_list(field, flat=True))
+            if addresses:
+                mark_stale(containing(family, addresses[0], addresses[-1]))
+
+def subnet_saved(sender, instance, **kwargs):
+    mark_stale(SubnetUsage.objects.filter(subnet=instance))
+
+pre_save.connect(interface_pre_save, sender=Networkinterface)
+post_save.connect(interface_saved, sender=Networkinterface)
+post_delete.connect(interface_deleted, sender=Networkinterface)
+bulk_inserted.connect(interfaces_inserted, sender=Networkinterface)
+post_save.connect(subnet_saved, sender=Subnet)
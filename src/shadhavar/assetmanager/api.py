@@ -0,0 +1,272 @@
+"""
+Read-only JSON API over the inventory.
+
+    /api/<resource>/            list, oldest first
+    /api/<resource>/<id>/       one object
+
+resource is the lower case model name: datacentre, server, networkinterface
+and so on. Parameters:
+
+    after=<id>      keyset pagination: objects after this id; every list
+                    answers the url of its next page in 'next'
+    limit=<n>       page size, 100 by default and at most 1000
+    fields=a,b      only these fields (the id is always included)
+    embed=a,a.b     replace foreign keys by the objects they point to, or
+                    add the objects pointing here (networkinterface_set),
+                    at one query per embedded relation
+    <field>=<value> only objects with this value
+
+Every model family (all device types count as one) has a token in the
+cache that its saves, deletes and bulk inserts replace. The ETag and
+Last-Modified of a response are derived from the tokens of the models it
+shows, so a request with a current If-None-Match gets a 304 without a
+single query. That takes a cache shared by every process (see
+assetmanager.caches); without one there is no ETag.
+"""
+
+import json
+from datetime import date, datetime, time
+from hashlib import md5
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.views.decorators.http import condition
+
+from assetmanager import caches
+from assetmanager.models import *
+from assetmanager.signals import bulk_inserted
+
+MODELS = [Datacentre, Serverroom, Rack, Device, DeviceFunction, Subnet, NetworkHardInterface,
+          Networkinterface, RaidArray, Harddisk, Partition, Maintenance] + Device.__subclasses__()
+RESOURCES = dict((model._meta.object_name.lower(), model) for model in MODELS)
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+CHUNK_SIZE = 500
+TOKEN_KEY = 'assetmanager.api.token.%s'
+TOKEN_TIMEOUT = 30 * 24 * 3600
+RESERVED = ('after', 'limit', 'fields', 'embed')
+
+class BadRequest(Exception):
+    pass
+
+def family(model):
+    return Device if issubclass(model, Device) else model
+
+def fields(model):
+    """
+    The names of the fields of model, without the links to parent models.
+    """
+    return [f.name for f in model._meta.fields if not (f.rel and f.rel.parent_link)]
+
+def parse_embed(value):
+    """
+    'rack.serverroom,harddisk_set' -> {'rack': {'serverroom': {}}, 'harddisk_set': {}}
+    """
+    tree = {}
+    for path in filter(None, value.split(',')):
+        node = tree
+        for name in path.split('.'):
+            node = node.setdefault(name, {})
+    return tree
+
+def relation(model, name):
+    """
+    (related model, field on the related model or None, forward) for the
+    relation name of model.
+    """
+    try:
+        field = model._meta.get_field(name, many_to_many=False)
+    except models.FieldDoesNotExist:
+        field = None
+    if field is not None and field.rel is not None and not field.rel.parent_link:
+        return field.rel.to, None, True
+    for related in model._meta.get_all_related_objects():
+        if related.get_accessor_name() == name and not related.field.rel.parent_link:
+            return related.model, related.field, False
+    raise BadRequest('%s cannot embed %s' % (model._meta.object_name.lower(), name))
+
+def embedded_models(model, tree):
+    result = set([family(model)])
+    for name, subtree in tree.items():
+        result.update(embedded_models(relation(model, name)[0], subtree))
+    return result
+
+def chunks(values):
+    values = list(values)
+    for i in range(0, len(values), CHUNK_SIZE):
+        yield values[i:i + CHUNK_SIZE]
+
+def embed(model, rows, tree):
+    """
+    Fill in the relations named in tree on rows, one query per relation
+    (per chunk of CHUNK_SIZE keys).
+    """
+    for name, subtree in tree.items():
+        related, field, forward = relation(model, name)
+        if forward:
+            ids = set(row[name] for row in rows if row[name] is not None)
+            found = {}
+            for chunk in chunks(ids):
+                objs = list(related._default_manager.filter(pk__in=chunk).values(*fields(related)))
+                embed(related, objs, subtree)
+                found.update((obj['id'], obj) for obj in objs)
+            for row in rows:
+                row[name] = found.get(row[name])
+        else:
+            children = {}
+            for chunk in chunks(row['id'] for row in rows):
+                objs = list(related._default_manager.filter(**{'%s__in' % field.name: chunk})
+                            .order_by('pk').values(*fields(related)))
+                embed(related, objs, subtree)
+                for obj in objs:
+                    children.setdefault(obj[field.name], []).append(obj)
+            for row in rows:
+                row[name] = children.get(row['id'], [])
+
+def select(model, request):
+    """
+    The field names asked for, always with the id and the foreign keys
+    that are embedded.
+    """
+    known = fields(model)
+    value = request.GET.get('fields')
+    if not value:
+        return known
+    names = ['id']
+    for name in value.split(','):
+        if name not in known:
+            raise BadRequest('%s has no field %s' % (model._meta.object_name.lower(), name))
+        if name not in names:
+            names.append(name)
+    for name in parse_embed(request.GET.get('embed', '')):
+        if name in known and name not in names:
+            names.append(name)
+    return names
+
+def filters(model, request):
+    known = fields(model)
+    result = {}
+    for key, value in request.GET.items():
+        if key in RESERVED:
+            continue
+        if key not in known:
+            raise BadRequest('unknown parameter %s' % key)
+        field = model._meta.get_field(key)
+        if field.rel:
+            field = field.rel.get_related_field()
+        try:
+            result[str(key)] = field.to_python(value)
+        except (ValueError, ValidationError):
+            raise BadRequest('%s is not a valid %s' % (value, key))
+    return result
+
+def token(model):
+    """
+    (token, time) of the last change to the family of model.
+    """
+    key = TOKEN_KEY % family(model)._meta.object_name.lower()
+    current = cache.get(key)
+    if current is None:
+        cache.add(key, (uuid4().hex, datetime.utcnow().replace(microsecond=0)), TOKEN_TIMEOUT)
+        current = cache.get(key)
+    return current
+
+def changed(sender, **kwargs):
+    key = TOKEN_KEY % family(sender)._meta.object_name.lower()
+    cache.set(key, (uuid4().hex, datetime.utcnow().replace(microsecond=0)), TOKEN_TIMEOUT)
+
+def window_changed(sender, **kwargs):
+    # a window sets Device.maintainance with an update(), without signals
+    changed(Device)
+
+def m2m_changed_handler(sender, instance, action, **kwargs):
+    if action.startswith('post_'):
+        changed(type(instance))
+
+def state(request, resource, pk=None):
+    """
+    (etag, last modified) of a request, computed once per request.
+    """
+    if not hasattr(request, '_api_state'):
+        model = RESOURCES.get(resource)
+        if model is None or not caches.shared():
+            request._api_state = (None, None)
+            return request._api_state
+        try:
+            involved = embedded_models(model, parse_embed(request.GET.get('embed', '')))
+        except BadRequest:
+            request._api_state = (None, None)
+            return request._api_state
+        tokens = sorted((m._meta.object_name, token(m)) for m in involved)
+        modified = max(t[1] for name, t in tokens)
+        parts = [request.get_full_path().encode('utf-8')] + [t[0] for name, t in tokens]
+        if Device in involved:
+            # Device.maintainance follows the calendar
+            parts.append(date.today().isoformat())
+            modified = max(modified, datetime.combine(date.today(), time()))
+        request._api_state = (md5(' '.join(parts)).hexdigest(), modified)
+    return request._api_state
+
+def etag(request, resource, pk=None):
+    return state(request, resource, pk)[0]
+
+def last_modified(request, resource, pk=None):
+    return state(request, resource, pk)[1]
+
+def respond(data):
+    return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')), mimetype='application/json')
+
+@condition(etag_func=etag, last_modified_func=last_modified)
+def collection(request, resource):
+    model = RESOURCES.get(resource)
+    if model is None:
+        raise Http404
+    try:
+        tree = parse_embed(request.GET.get('embed', ''))
+        names = select(model, request)
+        objects = model._default_manager.filter(**filters(model, request)).order_by('pk')
+        try:
+            limit = max(1, min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+            if request.GET.get('after'):
+                objects = objects.filter(pk__gt=int(request.GET['after']))
+        except ValueError:
+            raise BadRequest('after and limit must be numbers')
+        rows = list(objects.values(*names)[:limit + 1])
+        more = len(rows) > limit
+        rows = rows[:limit]
+        embed(model, rows, tree)
+    except BadRequest, e:
+        return HttpResponseBadRequest(unicode(e))
+    following = None
+    if more:
+        query = request.GET.copy()
+        query['after'] = rows[-1]['id']
+        following = '%s?%s' % (request.path, query.urlencode())
+    return respond({'objects': rows, 'next': following})
+
+@condition(etag_func=etag, last_modified_func=last_modified)
+def detail(request, resource, pk):
+    model = RESOURCES.get(resource)
+    if model is None:
+        raise Http404
+    try:
+        rows = list(model._default_manager.filter(pk=pk).values(*select(model, request)))
+        if not rows:
+            raise Http404
+        embed(model, rows, parse_embed(request.GET.get('embed', '')))
+    except BadRequest, e:
+        return HttpResponseBadRequest(unicode(e))
+    return respond(rows[0])
+
+for model in MODELS:
+    post_save.connect(changed, sender=model)
+    post_delete.connect(changed, sender=model)
+    bulk_inserted.connect(changed, sender=model)
+    for field in model._meta.local_many_to_many:
+        m2m_changed.connect(m2m_changed_handler, sender=field.rel.through)
+post_save.connect(window_changed, sender=Maintenance)
+post_delete.connect(window_changed, sender=Maintenance)
@@ -0,0 +1,262 @@
+"""
+Audit log of every change to the inventory.
+
+Each save or delete of an audited model appends one Change holding only
+what changed, as compact JSON:
+
+    created   {"field": value, ...}          every field
+    updated   {"field": [old, new], ...}     the changed fields only
+    deleted   {"field": value, ...}          every field, as it was
+
+Many-to-many fields log their lists of ids as an update. Devices of
+every type share the history of their Device row. Device.maintainance is
+set by queryset updates in assetmanager.maintenance, which log what they
+flip through updated(). During a request the
+entries are collected and written in one executemany when the response
+goes out (see assetmanager.middleware.AuditMiddleware), leaving out those
+made inside a transaction if the view raised, which rolled them back;
+anywhere else they are written straight away.
+
+Because the old values are logged, the state of an object at any moment
+is rebuilt backwards from its current row, which also works for objects
+older than the log itself.
+"""
+
+import json
+import threading
+from datetime import date, datetime, time
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+
+from assetmanager import snapshot
+from assetmanager.models import *
+from assetmanager.bulk import insert
+from assetmanager.signals import bulk_inserted
+
+AUDITED = [Datacentre, Serverroom, Rack, Device, DeviceFunction, Subnet, NetworkHardInterface,
+           Networkinterface, RaidArray, Harddisk, Partition, Maintenance] + Device.__subclasses__()
+
+# derived, but not editable fields that are part of the logged state
+DERIVED = ('maintainance',)
+
+_state = threading.local()
+
+def root(model):
+    return Device if issubclass(model, Device) else model
+
+def fields(model):
+    """
+    The attnames logged for model: its editable concrete fields and those
+    in DERIVED, which leaves out primary keys, parent links and derived
+    index columns.
+    """
+    return [f.attname for f in model._meta.fields if f.editable or f.attname in DERIVED]
+
+def encode(value):
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    return value
+
+def dumps(diff):
+    return json.dumps(diff, separators=(',', ':'), sort_keys=True)
+
+def begin(user_id=None):
+    """
+    Collect entries until end() instead of writing each one.
+    """
+    _state.batch = []
+    _state.user_id = user_id
+
+def end(failed=False):
+    """
+    Write the entries collected since begin(). If failed, those made
+    inside a transaction are dropped, it was rolled back.
+    """
+    batch = getattr(_state, 'batch', None)
+    _state.batch = None
+    _state.user_id = None
+    entries = [entry for entry, managed in batch or () if not (failed and managed)]
+    if entries:
+        write(entries)
+
+def write(entries):
+    insert(connection.cursor(), Change, entries, pk=False)
+    transaction.commit_unless_managed()
+
+def entry(model, pk, action, diff, rack_id=None):
+    return {'content_type_id': ContentType.objects.get_for_model(root(model)).pk, 'object_id': pk,
+            'action': action, 'timestamp': datetime.now(), 'user_id': getattr(_state, 'user_id', None),
+            'rack_id': rack_id, 'diff': dumps(diff)}
+
+def append(entries):
+    batch = getattr(_state, 'batch', None)
+    if batch is None:
+        write(entries)
+    else:
+        managed = transaction.is_managed()
+        batch.extend((entry, managed) for entry in entries)
+
+def record(model, pk, action, diff, rack_id=None):
+    append([entry(model, pk, action, diff, rack_id)])
+
+def updated(model, pks, field, old, new):
+    """
+    Log a queryset update that set field from old to new on the rows
+    with the given primary keys.
+    """
+    diff = {field: [encode(old), encode(new)]}
+    if pks:
+        append([entry(model, pk, 'u', diff) for pk in pks])
+
+def pre_save_handler(sender, instance, raw, **kwargs):
+    instance._audit_old = None
+    if raw:
+        return
+    old = snapshot.stored(sender, instance)
+    if old is not None:
+        instance._audit_old = dict((k, encode(old[k])) for k in fields(sender))
+
+def post_save_handler(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    new = dict((attname, encode(getattr(instance, attname))) for attname in fields(sender))
+    old = getattr(instance, '_audit_old', None)
+    if old is None:
+        record(sender, instance.pk, 'c', new)
+        return
+    diff = dict((k, [old[k], v]) for k, v in new.items() if old.get(k) != v)
+    if diff:
+        left = old['rack_id'] if issubclass(sender, Device) and 'rack_id' in diff else None
+        record(sender, instance.pk, 'u', diff, left)
+
+def post_delete_handler(sender, instance, **kwargs):
+    # deleting a typed device deletes its child row first and then the
+    # Device row, only the first of the two is logged
+    deleted = _state.__dict__.setdefault('deleted', set())
+    if sender is Device and instance.pk in deleted:
+        deleted.discard(instance.pk)
+        return
+    if sender is not Device and issubclass(sender, Device):
+        deleted.add(instance.pk)
+    old = dict((attname, encode(getattr(instance, attname))) for attname in fields(sender))
+    record(sender, instance.pk, 'd', old, old.get('rack_id') if issubclass(sender, Device) else None)
+
+def m2m_handler(sender, instance, action, reverse, **kwargs):
+    if reverse or action not in ('pre_add', 'pre_remove', 'pre_clear', 'post_add', 'post_remove', 'post_clear'):
+        return
+    for field in instance._meta.many_to_many:
+        if field.rel.through is sender:
+            break
+    else:
+        return
+    ids = sorted(getattr(instance, field.attname).values_list('pk', flat=True))
+    if action.startswith('pre_'):
+        instance._audit_m2m = ids
+    elif ids != getattr(instance, '_audit_m2m', None):
+        record(type(instance), instance.pk, 'u', {field.name: [getattr(instance, '_audit_m2m', None), ids]})
+
+def inserted(sender, pks, **kwargs):
+    """
+    Log rows that were inserted in bulk as created, in the same batches.
+    Device rows of a typed device are left to its own model, which is
+    inserted after them.
+    """
+    content_type = ContentType.objects.get_for_model(root(sender)).pk
+    now = datetime.now()
+    user_id = getattr(_state, 'user_id', None)
+    for i in range(0, len(pks), 500):
+        chunk = pks[i:i + 500]
+        if sender is Device:
+            typed = set()
+            for model in Device.__subclasses__():
+                typed.update(model._default_manager.filter(pk__in=chunk).values_list('pk', flat=True))
+            chunk = [pk for pk in chunk if pk not in typed]
+            if not chunk:
+                continue
+        rows = sender._default_manager.filter(pk__in=chunk).values('pk', *fields(sender))
+        write([{'content_type_id': content_type, 'object_id': row.pop('pk'), 'action': 'c', 'timestamp': now,
+                'user_id': user_id, 'diff': dumps(dict((k, encode(v)) for k, v in row.items()))} for row in rows])
+
+def history(obj):
+    """
+    The changes of obj, oldest first.
+    """
+    content_type = ContentType.objects.get_for_model(root(type(obj)))
+    return Change.objects.filter(content_type=content_type, object_id=obj.pk).order_by('timestamp', 'id')
+
+def states_at(model, pks, when):
+    """
+    The field values of the objects of model with the given primary keys
+    as they were at when, keyed on primary key. Objects that did not
+    exist at the time are left out.
+    """
+    content_type = ContentType.objects.get_for_model(root(model))
+    attnames = fields(model)
+    states = {}
+    pks = list(pks)
+    for i in range(0, len(pks), 500):
+        chunk = pks[i:i + 500]
+        for row in model._default_manager.filter(pk__in=chunk).values('pk', *attnames):
+            states[row.pop('pk')] = dict((k, encode(v)) for k, v in row.items())
+        later = Change.objects.filter(content_type=content_type, object_id__in=chunk, timestamp__gt=when)
+        for object_id, action, diff in later.order_by('-timestamp', '-id').values_list('object_id', 'action', 'diff'):
+            diff = json.loads(diff)
+            if action == 'c':
+                states[object_id] = None
+            elif action == 'd':
+                states[object_id] = diff
+            elif states.get(object_id) is not None:
+                states[object_id].update((k, old) for k, (old, new) in diff.items())
+    return dict((pk, state) for pk, state in states.items() if state is not None)
+
+def build(model, state):
+    """
+    An unsaved instance of model from a state of states_at.
+    """
+    values = {}
+    for field in model._meta.fields:
+        if field.attname in state:
+            values[field.attname] = field.to_python(state[field.attname])
+    return model(**values)
+
+def as_of(obj_or_model, pk=None, when=None):
+    """
+    An object as it was at when, or None if it did not exist then:
+    as_of(device, when=d) or as_of(Rack, 3, d).
+    """
+    if pk is None:
+        model, pk = type(obj_or_model), obj_or_model.pk
+    else:
+        model = obj_or_model
+    state = states_at(model, [pk], when).get(pk)
+    if state is not None:
+        obj = build(model, state)
+        obj.pk = pk
+        return obj
+
+def rack_contents(rack, when):
+    """
+    The devices that were in rack at when, as unsaved Device instances.
+    """
+    rack_id = getattr(rack, 'pk', rack)
+    content_type = ContentType.objects.get_for_model(Device)
+    candidates = set(Device.objects.filter(rack=rack_id).values_list('pk', flat=True))
+    candidates.update(Change.objects.filter(content_type=content_type, rack_id=rack_id, timestamp__gt=when)
+                      .values_list('object_id', flat=True))
+    result = []
+    for pk, state in sorted(states_at(Device, candidates, when).items()):
+        if state.get('rack_id') == rack_id:
+            device = build(Device, state)
+            device.pk = pk
+            result.append(device)
+    return result
+
+for model in AUDITED:
+    pre_save.connect(pre_save_handler, sender=model)
+    post_save.connect(post_save_handler, sender=model)
+    post_delete.connect(post_delete_handler, sender=model)
+    for field in model._meta.local_many_to_many:
+        m2m_changed.connect(m2m_handler, sender=field.rel.through)
+    bulk_inserted.connect(inserted, sender=model)
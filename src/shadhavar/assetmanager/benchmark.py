@@ -0,0 +1,593 @@
+"""
+Benchmarks of the inventory at production scale.
+
+generate() fills a database with a synthetic inventory: datacentres,
+their rooms, racks with blade enclosures nested in some of them, a mix of
+every device type, and the interfaces, RAID arrays, disks, partitions and
+VMs of those devices. It is deterministic: the same seed and sizes make
+the same rows with the same names, so runs on different checkouts are
+comparable. Devices and their parts go through the Importer, so the
+derived tables are filled the way a real import fills them. Every device
+is then plugged into two PDUs of its rack (or a UPS if it has none) and
+every PDU into a UPS of its rack.
+
+run() times scenarios through the test client and the ORM:
+
+    changelist.<model>      the admin changelist of every model
+    detail.<model>          the admin change form of one object
+    dropdown.<model>        the admin add form, which renders a select of
+                            every object each foreign key can point to
+    view.<name>             the generic views in urls.py
+    save.<model>            saving objects one at a time, with all the
+                            signal handlers behind a save
+    power.impact            what goes dark when a UPS fails
+    power.draw              changing the draw of a device, which updates
+                            the loads of the sources up its power chain
+
+Every scenario is run a number of times and reports the percentiles of
+its latency and the number of queries (and their time) per run, as a
+dict that dumps to JSON. compare() lines up two such results and flags
+the scenarios that became slower or make more queries.
+
+startup() times how long a fresh worker process takes to answer its first
+request and how much memory it holds then, for a settings module such as
+the slim worker_settings. Every run is a new interpreter that builds the
+WSGI handler and makes two requests through it: the first one loads the
+middleware, the URLconf and the views it reaches, the second shows the
+steady state.
+
+The generator and the save and power.draw scenarios write to the
+database, so they only run on SQLite, which is meant to be a scratch
+database with a generated inventory; on any other database they are
+left out.
+"""
+
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import django
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.db import connection, reset_queries, transaction
+from django.db.models import Max
+from django.test.client import Client
+
+from assetmanager.models import *
+from assetmanager import power
+from assetmanager.importer import Importer, insert
+from assetmanager.signals import bulk_inserted
+
+# device type -> weight in the mix of every rack
+MIX = (
+    ('server', 40),
+    ('switch', 6),
+    ('router', 2),
+    ('kvm', 2),
+    ('ups', 2),
+    ('pdu', 4),
+    ('diskarray', 3),
+    ('other', 3),
+)
+FUNCTIONS = ('web', 'database', 'mail', 'dns', 'backup', 'build', 'monitoring', 'storage')
+KINDS = ('1000BASE-T', '10GBASE-SR', '10GBASE-T')
+RAID_TYPES = ('1', '5', '6', '7', '10')
+OSES = ('Debian 6.0', 'Ubuntu 10.04', 'CentOS 5.6', 'FreeBSD 8.2', 'Windows Server 2008')
+CPUS = ('4 cores', '8 cores', '2x Xeon E5620 (8 cores)', '12 cores', '16 cores')
+# device type -> nominal draws in VA to pick from
+DRAWS = {
+    'server': (250, 400, 600, 800),
+    'switch': (100, 150),
+    'router': (200, 300),
+    'kvm': (40,),
+    'pdu': (10,),
+    'diskarray': (500, 800),
+    'other': (100, 200),
+}
+RACK_HEIGHT = 42
+BLADE_HEIGHT = 16
+FIRST_DATE = date(2018, 1, 1)
+
+USERNAME = 'benchmark'
+# the models saved by the save scenarios -> the free text field they change
+SAVES = ((Server, 'comments'), (VM, 'comments'), (Harddisk, 'brandType'), (Rack, 'comments'))
+PERCENTILES = (50, 90, 99)
+FORMAT = 1
+
+class Generator(object):
+    """
+    A synthetic inventory of datacentres rooms per datacentre, racks racks
+    per room with devices devices each, every blade_every-th rack holding
+    a blade enclosure of blades servers, and up to vms VMs per server.
+    Names start with prefix.
+    """
+    def __init__(self, seed=0, datacentres=1, rooms=2, racks=10, devices=20, blade_every=5,
+                 blades=8, vms=4, prefix='bench'):
+        self.seed = seed
+        self.datacentres = datacentres
+        self.rooms = rooms
+        self.racks = racks
+        self.devices = devices
+        self.blade_every = blade_every
+        self.blades = blades
+        self.vms = vms
+        self.prefix = prefix
+
+    def params(self):
+        return dict((name, getattr(self, name)) for name in
+                    ('seed', 'datacentres', 'rooms', 'racks', 'devices', 'blade_every', 'blades', 'vms', 'prefix'))
+
+    def run(self, batch_size=2000):
+        """
+        Write the inventory, returns the number of rows per type.
+        """
+        self.random = random.Random(self.seed)
+        # the draws come from their own generator, so adding them left the
+        # rest of the inventory as it was
+        self.power_random = random.Random(self.seed + 1)
+        self.arrays = []
+        self.plugs = {}
+        self.addresses = {}
+        self.last_server = None
+        racks = self.locations()
+        rows = list(self.rows(racks))
+        self.insert_arrays()
+        importer = Importer(batch_size=batch_size)
+        counts = importer.run(rows)
+        if importer.errors:
+            raise ValueError('generated rows rejected: %s' % importer.errors[:5])
+        counts = dict(counts)
+        counts['powerconnection'] = self.insert_power(importer.devices)
+        counts['raidarray'] = len(self.arrays)
+        counts['rack'] = len(racks)
+        return counts
+
+    def name(self, *parts):
+        return '-'.join([self.prefix] + [str(part) for part in parts])
+
+    @transaction.commit_on_success
+    def locations(self):
+        """
+        [(rack id, height, blade enclosure, room subnet id)], creating the
+        datacentres, rooms, racks, subnets and lookup rows.
+        """
+        for name in FUNCTIONS:
+            DeviceFunction.objects.get_or_create(name=name)
+        for kind in KINDS:
+            NetworkHardInterface.objects.get_or_create(kind=kind)
+        racks = []
+        for d in range(1, self.datacentres + 1):
+            datacentre = Datacentre.objects.create(name=self.name('dc%d' % d), city='City %d' % d)
+            for r in range(1, self.rooms + 1):
+                columns = int(math.ceil(math.sqrt(self.racks)))
+                room = Serverroom.objects.create(datacentre=datacentre, name=self.name('dc%d' % d, 'room%d' % r),
+                                                 floor=r - 1, maxrows=int(math.ceil(self.racks / float(columns))),
+                                                 maxcolumns=columns)
+                octet = ((d - 1) * self.rooms + r) % 256
+                subnet = Subnet.objects.create(networkaddr4='10.%d.0.0' % octet, subnetaddr4='255.255.0.0',
+                                               broadcast4='10.%d.255.255' % octet)
+                self.addresses[subnet.pk] = [octet, 0, 0]
+                for k in range(self.racks):
+                    rack = Rack.objects.create(name=room.name + '-rack%d' % (k + 1), height=RACK_HEIGHT, kind='0',
+                                               row=k // columns + 1, column=k % columns + 1, serverroom=room)
+                    racks.append((rack.pk, RACK_HEIGHT, False, subnet.pk))
+                    if self.blade_every and (k + 1) % self.blade_every == 0:
+                        blade = Rack.objects.create(name=rack.name + '-blade', height=BLADE_HEIGHT, kind='2',
+                                                    serverroom=room, rack=rack)
+                        racks.append((blade.pk, BLADE_HEIGHT, True, subnet.pk))
+        return racks
+
+    def address(self, subnet):
+        octets = self.addresses[subnet]
+        octets[2] += 1
+        if octets[2] > 254:
+            octets[1], octets[2] = (octets[1] + 1) % 256, 1
+        return '10.%d.%d.%d' % tuple(octets)
+
+    def day(self, years):
+        return (FIRST_DATE + timedelta(self.random.randint(0, int(365 * years)))).isoformat()
+
+    def rows(self, racks):
+        types = [kind for kind, weight in MIX for i in range(weight)]
+        n = 0
+        for rack, height, enclosure, subnet in racks:
+            position = 1
+            for i in range(self.blades if enclosure else self.devices):
+                kind = 'server' if enclosure else self.random.choice(types)
+                size = 1 if enclosure else self.random.choice((1, 1, 1, 2, 2, 4))
+                n += 1
+                name = self.name(kind, n)
+                row = {'type': kind, 'name': name, 'rack': rack, 'brand': self.random.choice(('Dell', 'HP', 'IBM', 'Cisco')),
+                       'serialnr': 'SN%08d' % n, 'os': self.random.choice(OSES), 'startdate': self.day(2),
+                       'enddate': self.day(8)}
+                if position + size - 1 <= height:
+                    row['height'], row['position'] = size, position
+                    position += size
+                self.device(kind, row)
+                if kind in DRAWS:
+                    row['draw'] = self.power_random.choice(DRAWS[kind])
+                if not enclosure:
+                    self.plugs.setdefault(rack, []).append((kind, name, row.get('ammount')))
+                yield row
+                for part in self.parts(kind, name, subnet):
+                    yield part
+                if kind == 'server':
+                    for v in range(self.random.randint(0, self.vms)):
+                        vm = self.name('vm', n, v + 1)
+                        yield {'type': 'vm', 'name': vm, 'rack': rack, 'server': name, 'os': self.random.choice(OSES),
+                               'cpu': '%d vCPU' % self.random.choice((1, 2, 4)), 'ram': self.random.choice((1024, 2048, 4096, 8192)),
+                               'hypervisor': 'KVM', 'functions': self.random.choice(FUNCTIONS)}
+                        yield self.interface(vm, subnet, 'eth0')
+                        yield {'type': 'partition', 'parent': vm, 'name': '/', 'size': 20}
+                    self.last_server = name
+
+    def device(self, kind, row):
+        if kind in ('server', 'router'):
+            row['cpu'] = self.random.choice(CPUS)
+            row['ram'] = self.random.choice((16384, 32768, 65536, 131072))
+            row['functions'] = ';'.join(sorted(set(self.random.choice(FUNCTIONS) for i in range(2))))
+        elif kind == 'switch':
+            row['kind'] = self.random.choice('01')
+            row['poe'] = self.random.choice(('0', '1'))
+        elif kind == 'kvm':
+            row['remote'] = self.random.choice('012')
+            row['maxdevices'] = 16
+        elif kind in ('ups', 'pdu'):
+            row['monitoring'] = self.random.choice('01')
+            row['management'] = self.random.choice('0123')
+            if kind == 'ups':
+                row['power'] = self.random.choice((1500, 3000, 5000))
+            else:
+                row['ammount'] = self.random.choice((8, 16, 24))
+        elif kind == 'diskarray':
+            row['maxDisks'] = 24
+            row['arrayType'] = self.random.choice('01234')
+            row['connection'] = self.random.choice('012')
+            if self.last_server:
+                row['conntectTo'] = self.last_server
+        elif kind == 'other':
+            row['functions'] = self.random.choice(FUNCTIONS)
+
+    def interface(self, device, subnet, name, management=False):
+        return {'type': 'networkinterface', 'device': device, 'subnet': str(subnet), 'kind': self.random.choice(KINDS),
+                'name': name, 'ip4': self.address(subnet), 'vlan': self.random.choice((10, 20, 30)),
+                'management': management and '1' or '0', 'mac': '02:00:%08x' % self.random.getrandbits(32)}
+
+    def parts(self, kind, name, subnet):
+        if kind not in ('pdu', 'ups'):
+            yield self.interface(name, subnet, 'eth0')
+        if kind in ('server', 'router', 'switch', 'diskarray'):
+            yield self.interface(name, subnet, 'mgmt0', management=True)
+        if kind in ('server', 'diskarray'):
+            disks = kind == 'server' and self.random.randint(2, 6) or self.random.randint(8, 24)
+            array = self.name('md', name)
+            self.arrays.append((array, disks >= 4 and self.random.choice(RAID_TYPES) or '1'))
+            size = self.random.choice((146, 300, 600, 1000, 2000))
+            for i in range(disks):
+                yield {'type': 'harddisk', 'parent': name, 'array': array, 'size': size, 'ide': self.random.choice('123'),
+                       'serialnr': 'D%08x' % self.random.getrandbits(32), 'startdate': self.day(2), 'enddate': self.day(8)}
+        if kind == 'server':
+            for mount, size in (('/', 20), ('/var', self.random.choice((50, 100, 200)))):
+                yield {'type': 'partition', 'parent': name, 'name': mount, 'size': size,
+                       'lvm': mount == '/var' and '1' or '0'}
+
+    def insert_arrays(self):
+        first = (RaidArray.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+        rows = [{'id': first + i, 'name': name, 'Size': None, 'raidType': level} for i, (name, level) in enumerate(self.arrays)]
+        insert(connection.cursor(), RaidArray, rows)
+        transaction.commit_unless_managed()
+        bulk_inserted.send(sender=RaidArray, pks=[row['id'] for row in rows])
+
+    def insert_power(self, devices):
+        """
+        Plug every device into the next two PDUs of its rack with a free
+        outlet, the A and B feeds, or into a UPS of the rack if there are
+        none, and every PDU into a UPS of its rack. devices maps names to
+        pks, returns the number of connections.
+        """
+        first = (PowerConnection.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+        rows = []
+        for rack, plugs in sorted(self.plugs.items()):
+            upses = [devices[name] for kind, name, outlets in plugs if kind == 'ups']
+            pdus = [[devices[name], outlets, 0] for kind, name, outlets in plugs if kind == 'pdu']
+            for kind, name, outlets in plugs:
+                if kind == 'ups':
+                    continue
+                pk = devices[name]
+                if kind == 'pdu':
+                    if upses:
+                        rows.append((pk, upses[len(rows) % len(upses)], None))
+                    continue
+                free = [pdu for pdu in pdus if pdu[2] < pdu[1]][:2]
+                for pdu in free:
+                    pdu[2] += 1
+                    rows.append((pk, pdu[0], pdu[2]))
+                if not free and upses:
+                    rows.append((pk, upses[0], None))
+        rows = [{'id': first + i, 'device_id': device, 'source_id': source, 'outlet': outlet}
+                for i, (device, source, outlet) in enumerate(rows)]
+        insert(connection.cursor(), PowerConnection, rows)
+        transaction.commit_unless_managed()
+        bulk_inserted.send(sender=PowerConnection, pks=[row['id'] for row in rows])
+        transaction.commit_unless_managed()
+        return len(rows)
+
+def generate(**sizes):
+    return Generator(**sizes).run()
+
+def inventory():
+    """
+    The number of rows per model.
+    """
+    return dict((model._meta.object_name.lower(), model._default_manager.count())
+                for model in [Datacentre, Serverroom, Rack, Device, Networkinterface, RaidArray, Harddisk,
+                              Partition, Subnet, PowerConnection] + Device.__subclasses__())
+
+def percentile(values, p):
+    """
+    The nearest rank percentile p of values, which are sorted.
+    """
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+def summary(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    result = dict(('p%d' % p, round(percentile(values, p), 3)) for p in PERCENTILES)
+    result.update(min=round(values[0], 3), max=round(values[-1], 3), mean=round(sum(values) / len(values), 3))
+    return result
+
+class Recorder(object):
+    """
+    Keeps connection.queries for the duration, DEBUG on and the reset at
+    the start of every request off, so the queries of a request made
+    through the test client can be counted.
+    """
+    def __enter__(self):
+        self.debug = settings.DEBUG
+        settings.DEBUG = True
+        request_started.disconnect(reset_queries)
+        return self
+
+    def __exit__(self, *exc_info):
+        request_started.connect(reset_queries)
+        settings.DEBUG = self.debug
+        connection.queries = []
+
+def measure(action, runs, warmup=1):
+    """
+    Run action (given the run number) warmup + runs times, the result of
+    the runs after the warmup as a dict.
+    """
+    latency, queries, sql, statuses, errors = [], [], [], {}, {}
+    with Recorder():
+        for i in range(-warmup, runs):
+            connection.queries = []
+            started = time.time()
+            try:
+                status = action(i)
+            except Exception, e:
+                if i >= 0:
+                    key = '%s: %s' % (type(e).__name__, unicode(e)[:200])
+                    errors[key] = errors.get(key, 0) + 1
+                continue
+            elapsed = (time.time() - started) * 1000
+            if i < 0:
+                continue
+            latency.append(elapsed)
+            queries.append(len(connection.queries))
+            sql.append(sum(float(query['time']) for query in connection.queries) * 1000)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {'runs': runs, 'latency_ms': summary(latency), 'queries': summary(queries), 'sql_ms': summary(sql),
+            'status': statuses, 'errors': errors}
+
+def spread(qs, n):
+    """
+    n pks of qs spread evenly over it, the same ones every time.
+    """
+    total = qs.count()
+    if not total:
+        return []
+    pks = []
+    for i in range(n):
+        pk = qs.order_by('pk').values_list('pk', flat=True)[i * total // n]
+        if pk not in pks:
+            pks.append(pk)
+    return pks
+
+def client():
+    user, created = User.objects.get_or_create(username=USERNAME, defaults={'is_staff': True, 'is_superuser': True})
+    password = User.objects.make_random_password()
+    user.set_password(password)
+    user.save()
+    result = Client()
+    result.login(username=USERNAME, password=password)
+    return result
+
+def get(client, url):
+    def action(i):
+        return client.get(url).status_code
+    return action
+
+def writable():
+    """
+    Whether the scenarios that write may run.
+    """
+    return settings.DATABASES['default']['ENGINE'].endswith('sqlite3')
+
+def writes(name):
+    return name == 'save' or name.startswith('save.') or name == 'power.draw'
+
+def saves(model, field, pks):
+    def action(i):
+        obj = model._default_manager.get(pk=pks[i % len(pks)])
+        setattr(obj, field, 'benchmark run %d' % i)
+        obj.save()
+        return 'saved'
+    return action
+
+def impacts(pks):
+    def action(i):
+        return len(power.impact(pks[i % len(pks)])['dark'])
+    return action
+
+def draws(pks):
+    def action(i):
+        device = Device.objects.get(pk=pks[i % len(pks)])
+        device.draw = (device.draw or 0) + (i % 2 and -1 or 1)
+        device.save()
+        return 'saved'
+    return action
+
+def scenarios(client, runs):
+    """
+    [(name, action)] of every scenario.
+    """
+    admin.autodiscover()
+    result = []
+    for model, model_admin in sorted(admin.site._registry.items(), key=lambda item: item[0]._meta.object_name):
+        if model._meta.app_label != 'assetmanager':
+            continue
+        base = '/admin/assetmanager/%s/' % model._meta.object_name.lower()
+        name = model._meta.object_name.lower()
+        result.append(('changelist.%s' % name, get(client, base)))
+        pk = spread(model._default_manager.all(), 1)
+        if pk:
+            result.append(('detail.%s' % name, get(client, '%s%d/' % (base, pk[0]))))
+        result.append(('dropdown.%s' % name, get(client, base + 'add/')))
+    for name in ('datacentre', 'serverroom'):
+        result.append(('view.%s_index' % name, get(client, '/assets/%s/' % name)))
+        pk = spread(globals()[name.capitalize()].objects.all(), 1)
+        if pk:
+            result.append(('view.%s_detail' % name, get(client, '/assets/%s/%d/' % (name, pk[0]))))
+    if writable():
+        for model, field in SAVES:
+            pks = spread(model._default_manager.all(), runs)
+            if pks:
+                result.append(('save.%s' % model._meta.object_name.lower(), saves(model, field, pks)))
+    pks = spread(UPS.objects.all(), runs)
+    if pks:
+        result.append(('power.impact', impacts(pks)))
+    pks = spread(Device.objects.filter(power_inputs__outlet__isnull=False).distinct(), runs)
+    if pks and writable():
+        result.append(('power.draw', draws(pks)))
+    return result
+
+def run(runs=10, only=None):
+    """
+    Run the scenarios named in only, or in a group named there (all of
+    them by default), runs times each; the results as a dict ready for
+    JSON.
+    """
+    started = datetime.now()
+    clock = time.time()
+    web = client()
+    results = {}
+    for name, action in scenarios(web, runs):
+        if only and not any(name == wanted or name.startswith(wanted + '.') for wanted in only):
+            continue
+        results[name] = measure(action, runs)
+        transaction.commit_unless_managed()
+    return {
+        'format': FORMAT,
+        'started': started.isoformat(),
+        'seconds': round(time.time() - clock, 3),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': {'engine': settings.DATABASES['default']['ENGINE'], 'name': settings.DATABASES['default']['NAME']},
+        'inventory': inventory(),
+        'scenarios': results,
+    }
+
+def compare(old, new, tolerance=0.2, noise=1.0):
+    """
+    [(scenario, old p50, new p50, old queries, new queries, regressed)] of
+    the scenarios in both results. A scenario regressed when its median
+    grew by more than tolerance (and noise milliseconds), or it makes more
+    queries.
+    """
+    result = []
+    for name in sorted(set(old['scenarios']) & set(new['scenarios'])):
+        a, b = old['scenarios'][name], new['scenarios'][name]
+        before, after = a['latency_ms'].get('p50'), b['latency_ms'].get('p50')
+        queries_before, queries_after = a['queries'].get('p50'), b['queries'].get('p50')
+        regressed = bool(b['errors']) and not a['errors']
+        if before is not None and after is not None:
+            regressed = regressed or (after > before * (1 + tolerance) and after - before > noise)
+        if queries_before is not None and queries_after is not None:
+            regressed = regressed or queries_after > queries_before
+        result.append((name, before, after, queries_before, queries_after, regressed))
+    return result
+
+# run by startup() in a new interpreter: argv is the path to request, the
+# session cookie comes in STARTUP_COOKIE
+STARTUP_SCRIPT = r"""
+import json, os, resource, sys, time
+started = time.time()
+from StringIO import StringIO
+from django.core.handlers.wsgi import WSGIHandler
+handler = WSGIHandler()
+
+def request(path):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+               'HTTP_COOKIE': os.environ.get('STARTUP_COOKIE', ''), 'wsgi.input': StringIO(''),
+               'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http', 'wsgi.multithread': False,
+               'wsgi.multiprocess': True, 'wsgi.run_once': False}
+    status = []
+    ''.join(handler(environ, lambda value, headers, exc_info=None: status.append(value)))
+    return int(status[0].split()[0])
+
+status = request(sys.argv[1])
+first = time.time() - started
+started = time.time()
+request(sys.argv[1])
+second = time.time() - started
+sys.stdout.write(json.dumps({'status': status, 'first': first, 'second': second,
+                             'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                             'modules': len(sys.modules)}))
+"""
+
+def cookie():
+    """
+    The session cookie of the benchmark user, for requests made outside
+    the test client.
+    """
+    return '%s=%s' % (settings.SESSION_COOKIE_NAME, client().cookies[settings.SESSION_COOKIE_NAME].value)
+
+def startup(settings_module, path, runs, session=''):
+    """
+    Start runs worker processes with settings_module that each request
+    path twice; the percentiles of the process lifetime, the time to the
+    end of the first request, the second request and the peak RSS in
+    megabytes.
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module, STARTUP_COOKIE=session,
+               PYTHONPATH=os.pathsep.join(os.path.abspath(entry) for entry in sys.path))
+    process_ms, first_ms, second_ms, rss_mb, statuses, modules = [], [], [], [], {}, []
+    for i in range(runs):
+        started = time.time()
+        process = subprocess.Popen([sys.executable, '-c', STARTUP_SCRIPT, path], env=env, stdout=subprocess.PIPE)
+        output = process.communicate()[0]
+        if process.returncode:
+            raise RuntimeError('The worker with %s exited with %d.' % (settings_module, process.returncode))
+        process_ms.append((time.time() - started) * 1000)
+        result = json.loads(output)
+        first_ms.append(result['first'] * 1000)
+        second_ms.append(result['second'] * 1000)
+        rss_mb.append(result['rss'] / 1024.0) # kilobytes on Linux
+        modules.append(result['modules'])
+        statuses[str(result['status'])] = statuses.get(str(result['status']), 0) + 1
+    return {'settings': settings_module, 'path': path, 'runs': runs, 'process_ms': summary(process_ms),
+            'first_request_ms': summary(first_ms), 'second_request_ms': summary(second_ms),
+            'rss_mb': summary(rss_mb), 'modules': summary(modules), 'status': statuses}
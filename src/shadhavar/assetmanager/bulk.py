@@ -0,0 +1,34 @@
+"""
+Multi-row inserts that bypass save() and its signals; whoever uses them
+sends bulk_inserted so the derived tables can catch up.
+
+This module imports no models, so the modules that models.py imports can
+use it without importing the importer in the middle of loading models.
+"""
+
+from django.db import connection
+
+def insert(cursor, model, rows, pk=True):
+    """
+    Insert rows (dicts keyed by attname) into the table of model in one
+    executemany call; only the local fields of model are written, and the
+    primary key only if pk is true.
+    """
+    fields = [f for f in model._meta.local_fields if not (f.primary_key and (model._meta.auto_created or not pk))]
+    qn = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        qn(model._meta.db_table),
+        ', '.join(qn(f.column) for f in fields),
+        ', '.join(['%s'] * len(fields)))
+    # rows often share values (a rack, a timestamp), each is only converted once in a run
+    last = [(None, f.get_db_prep_save(None, connection=connection)) for f in fields]
+    params = []
+    for values in rows:
+        row = []
+        for i, f in enumerate(fields):
+            value = values.get(f.attname)
+            if value is not last[i][0]:
+                last[i] = (value, f.get_db_prep_save(value, connection=connection))
+            row.append(last[i][1])
+        params.append(row)
+    cursor.executemany(sql, params)
@@ -0,0 +1,36 @@
+"""
+Whether the default cache is shared by every process.
+
+The API, the location tree, the topology and the power chain keep what
+they built until a token in the default cache changes. With a shared
+backend (memcached, see CACHE_BACKEND in settings.py) a write in one
+process replaces the token for all of them. The locmem cache Django falls
+back to lives in each process, so a write would only be seen where it was
+made: with it, what was built is only reused within a request and the API
+never answers 304. ASSETMANAGER_SHARED_CACHE overrides the guess, for a
+single process.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends import locmem
+from django.core.signals import request_started
+
+_dropped = []
+
+def shared():
+    return getattr(settings, 'ASSETMANAGER_SHARED_CACHE', not isinstance(cache, locmem.CacheClass))
+
+def per_request(drop):
+    """
+    Call drop() at the start of every request while the cache isn't
+    shared.
+    """
+    _dropped.append(drop)
+
+def request_started_handler(**kwargs):
+    if not shared():
+        for drop in _dropped:
+            drop()
+
+request_started.connect(request_started_handler)
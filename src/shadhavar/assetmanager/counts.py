@@ -0,0 +1,91 @@
+"""
+Row counts for the admin changelists, which count the filtered rows and
+the whole table on every page.
+
+An unfiltered count of a table with more than ESTIMATE_ABOVE rows comes
+from the statistics the database keeps about it (information_schema on
+MySQL, pg_class on PostgreSQL) instead of a COUNT(*), which over a
+million devices joined to their subclass table costs more than the rest
+of the page. These estimates can be off by a few percent.
+
+Every other count is cached for TIMEOUT seconds under its SQL and a
+generation token that any save, delete or bulk insert of an assetmanager
+model replaces, so paging through a long result doesn't count it again.
+The token lives in the default cache: with a shared backend (memcached,
+as settings.py has it) an edit shows up at once in every process, with
+the per-process locmem cache only in the process that made it, and the
+other workers keep serving their counts for up to TIMEOUT. Writes that bypass the signals
+(update() and raw SQL) are likewise seen after TIMEOUT at the latest.
+"""
+
+from hashlib import md5
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models.signals import post_save, post_delete
+from django.db.models.sql.datastructures import EmptyResultSet
+
+from assetmanager.signals import bulk_inserted
+
+GENERATION_KEY = 'assetmanager.counts.generation'
+COUNT_KEY = 'assetmanager.counts.%s.%s'
+TIMEOUT = getattr(settings, 'ASSETMANAGER_COUNT_TIMEOUT', 60)
+ESTIMATE_ABOVE = getattr(settings, 'ASSETMANAGER_ESTIMATE_COUNT_ABOVE', 100000)
+
+ESTIMATES = {
+    'mysql': "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+    'postgresql_psycopg2': "SELECT reltuples FROM pg_class WHERE relname = %s AND relkind = 'r'",
+}
+
+def generation():
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        cache.add(GENERATION_KEY, uuid4().hex, TIMEOUT)
+        current = cache.get(GENERATION_KEY)
+    return current
+
+def invalidate(sender, **kwargs):
+    if sender._meta.app_label == 'assetmanager':
+        cache.set(GENERATION_KEY, uuid4().hex, TIMEOUT)
+
+def estimate(queryset):
+    """
+    The number of rows the database thinks the table of an unfiltered
+    queryset has, or None if it can't tell.
+    """
+    if queryset.query.where or queryset.query.distinct or queryset.query.low_mark or queryset.query.high_mark is not None:
+        return None
+    engine = settings.DATABASES[queryset.db]['ENGINE'].split('.')[-1]
+    if engine not in ESTIMATES:
+        return None
+    cursor = connections[queryset.db].cursor()
+    cursor.execute(ESTIMATES[engine], [queryset.model._meta.db_table])
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    return int(row[0])
+
+def count(queryset):
+    """
+    The number of rows of queryset: estimated for large unfiltered tables,
+    otherwise exact and cached.
+    """
+    estimated = estimate(queryset)
+    if estimated is not None and estimated > ESTIMATE_ABOVE:
+        return estimated
+    try:
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    except EmptyResultSet:
+        return 0
+    key = COUNT_KEY % (generation(), md5(repr((queryset.db, sql, params))).hexdigest())
+    result = cache.get(key)
+    if result is None:
+        result = queryset.count()
+        cache.set(key, result, TIMEOUT)
+    return result
+
+post_save.connect(invalidate)
+post_delete.connect(invalidate)
+bulk_inserted.connect(invalidate)
@@ -0,0 +1,174 @@
+"""
+Streaming export of the whole inventory.
+
+Devices are read in primary key order, one chunk at a time (WHERE id > last
+ORDER BY id LIMIT n), so no query result grows with the inventory and
+memory use stays flat. Every chunk is resolved to the concrete Device
+subclasses, and its functions, interfaces, disks and partitions are
+fetched with one query per table.
+
+Records use the layout of the import files of assetmanager.importer, so
+an export can be imported again: one flat record per object with a 'type'
+key, devices locating their rack by datacentre/serverroom/row/column and
+everything else naming the device it belongs to.
+"""
+
+import csv
+import json
+import zlib
+from cStringIO import StringIO
+
+from assetmanager.models import *
+
+CHUNK_SIZE = 500
+
+PARTS = (
+    (Networkinterface, 'device', (('subnet', 'subnet'), ('kind', 'kind__kind'))),
+    (Harddisk, 'parent', (('array', 'array__name'),)),
+    (Partition, 'parent', ()),
+)
+
+def plain(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+def device_records(devices):
+    """
+    Yield (device_id, record) for the given typed devices.
+    """
+    by_model = {}
+    for device in devices:
+        by_model.setdefault(type(device), []).append(device.pk)
+    functions = {}
+    references = set()
+    for model, ids in by_model.items():
+        if 'functions' in [f.name for f in model._meta.many_to_many]:
+            through = model._meta.get_field('functions').rel.through
+            key = model._meta.object_name.lower()
+            rows = through._default_manager.filter(**{key + '__in': ids}).values_list(key, 'devicefunction__name')
+            for pk, name in rows:
+                functions.setdefault(pk, []).append(name)
+    for device in devices:
+        for field in device._meta.fields:
+            if field.rel and issubclass(field.rel.to, Device) and not field.rel.parent_link:
+                references.add(getattr(device, field.attname))
+    names = dict(Device.objects.filter(pk__in=references).values_list('pk', 'name')) if references else {}
+
+    for device in devices:
+        rack = device.rack
+        record = {
+            'type': device._meta.object_name.lower(),
+            'id': device.pk,
+            'rack': rack.pk,
+            'datacentre': rack.serverroom.datacentre.name,
+            'serverroom': rack.serverroom.name,
+            'row': rack.row,
+            'column': rack.column,
+        }
+        for field in device._meta.fields:
+            if field.primary_key or field.name == 'rack':
+                continue
+            value = getattr(device, field.attname)
+            if field.rel:
+                value = names.get(value)
+            record[field.name] = plain(value)
+        if device.pk in functions:
+            record['functions'] = ';'.join(functions[device.pk])
+        yield device.pk, record
+
+def part_records(model, key, related, device_ids, names):
+    """
+    Yield (device_id, record) for every object of model whose key points at
+    one of device_ids, naming the device and the related objects instead
+    of giving their ids.
+    """
+    fields = [f for f in model._meta.fields if not f.rel]
+    kind = model._meta.object_name.lower()
+    lookups = [f.attname for f in fields] + [key] + [lookup for name, lookup in related]
+    qs = model._default_manager.filter(**{key + '__in': device_ids}).order_by(key, 'pk')
+    for row in qs.values(*lookups).iterator():
+        device_id = row[key]
+        record = {'type': kind, key: names[device_id]}
+        for name, lookup in related:
+            record[name] = row[lookup]
+        for field in fields:
+            record[field.name] = plain(row[field.attname])
+        yield device_id, record
+
+def records(chunk_size=CHUNK_SIZE):
+    """
+    Yield a record for every device, each followed by the records of its
+    network interfaces, hard disks and partitions.
+    """
+    last = 0
+    while True:
+        chunk = Device.objects.select_related('rack__serverroom__datacentre')
+        chunk = list(chunk.filter(pk__gt=last).order_by('pk')[:chunk_size])
+        if not chunk:
+            break
+        last = chunk[-1].pk
+        devices = Device.objects.downcast(chunk)
+        ids = [device.pk for device in devices]
+        names = dict((device.pk, device.name) for device in devices)
+        parts = {}
+        for model, key, related in PARTS:
+            for device_id, record in part_records(model, key, related, ids, names):
+                parts.setdefault(device_id, []).append(record)
+        for device_id, record in device_records(devices):
+            yield record
+            for part in parts.get(device_id, ()):
+                yield part
+
+def columns():
+    """
+    The CSV columns, the union of the fields of all exported models.
+    """
+    names = ['type', 'id', 'datacentre', 'serverroom', 'row', 'column', 'rack', 'functions']
+    for model in [Device] + Device.__subclasses__() + [model for model, key, related in PARTS]:
+        for field in model._meta.fields:
+            if not field.primary_key and field.name not in names:
+                names.append(field.name)
+    return names
+
+def as_csv(records):
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, columns(), extrasaction='ignore')
+    writer.writerow(dict((name, name) for name in writer.fieldnames))
+    for record in records:
+        writer.writerow(dict((key, isinstance(value, unicode) and value.encode('utf-8') or value)
+                             for key, value in record.iteritems()))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def as_json(records):
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+def gzipped(chunks):
+    """
+    Gzip a stream of strings on the fly. The compressor hands out data
+    whenever its window fills up, so only that much is ever buffered.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+FORMATS = {
+    'csv': (as_csv, 'text/csv'),
+    'jsonl': (as_json, 'application/x-json-lines'),
+}
+
+def export(format, compress=False, chunk_size=CHUNK_SIZE):
+    """
+    Return (iterator of strings, content type) for the whole inventory.
+    """
+    encode, content_type = FORMATS[format]
+    stream = encode(records(chunk_size))
+    if compress:
+        return gzipped(stream), 'application/x-gzip'
+    return stream, content_type
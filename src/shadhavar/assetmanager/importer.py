@@ -0,0 +1,288 @@
+"""
+Streaming bulk import of devices, network interfaces, hard disks and
+partitions.
+
+Rows are read one at a time from CSV or JSON lines input. Every row names
+its type ('server', 'switch', ..., 'networkinterface', 'harddisk',
+'partition') and carries the model fields by name. Foreign keys are given
+by natural keys and resolved through lookup tables loaded once up front:
+
+    device rows         serverroom, row, column (and optionally datacentre)
+                        or rack (id); server / conntectTo by device name;
+                        functions as ';' separated DeviceFunction names
+    networkinterface    device (name), subnet ('10.0.0.0/24' or id),
+                        kind (NetworkHardInterface.kind)
+    harddisk            parent (device name), array (RaidArray name)
+    partition           parent (device name)
+
+Primary keys are handed out by the importer, so a row can refer to a
+device from an earlier row before anything is written, and the rows are
+written with one multi-row INSERT per table and batch, parent tables
+before child tables. Nothing else may insert into these tables while an
+import runs.
+"""
+
+import csv
+import json
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from assetmanager.models import *
+from assetmanager import ipaddr, ipam
+from assetmanager.bulk import insert
+from assetmanager.signals import bulk_inserted
+
+DEVICE_TYPES = dict((model._meta.object_name.lower(), model) for model in [Device] + Device.__subclasses__())
+PART_TYPES = {
+    'networkinterface': Networkinterface,
+    'harddisk': Harddisk,
+    'partition': Partition,
+}
+
+class RowError(Exception):
+    pass
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        yield dict((key, value.decode('utf-8')) for key, value in row.iteritems() if value not in (None, ''))
+
+def read_json(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
+
+class Importer(object):
+    """
+    Validates rows, resolves their references and writes them in batches.
+    With dry_run nothing is written, but every row is still checked.
+    """
+    def __init__(self, batch_size=1000, dry_run=False, progress=None, progress_every=10000):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.progress = progress # called with (rows, seconds) every progress_every rows
+        self.progress_every = progress_every
+        self.errors = []
+        self.counts = {}
+        self.rows = 0
+        self.pending = {}
+        self.pending_rows = 0
+        self.load_lookups()
+
+    def load_lookups(self):
+        self.racks = {}
+        self.rack_ids = set()
+        for pk, room, datacentre, row, column in Rack.objects.values_list('pk', 'serverroom__name', 'serverroom__datacentre__name', 'row', 'column'):
+            self.racks[(room, row, column)] = pk
+            self.racks[(datacentre, room, row, column)] = pk
+            self.rack_ids.add(pk)
+        self.devices = {}
+        self.servers = set(Server.objects.values_list('pk', flat=True))
+        for name, pk in Device.objects.values_list('name', 'pk'):
+            self.devices[name] = name in self.devices and None or pk # None marks an ambiguous name
+        self.subnets = {}
+        for pk, first4, prefixlen4, first6, prefixlen6 in Subnet.objects.values_list('pk', 'first4', 'prefixlen4', 'first6', 'prefixlen6'):
+            self.subnets[(first4, prefixlen4)] = pk
+            self.subnets[(first6, prefixlen6)] = pk
+        self.subnet_ids = set(Subnet.objects.values_list('pk', flat=True))
+        self.kinds = dict(NetworkHardInterface.objects.values_list('kind', 'pk'))
+        self.arrays = dict(RaidArray.objects.values_list('name', 'pk'))
+        self.functions = dict(DeviceFunction.objects.values_list('name', 'pk'))
+        self.next_id = {}
+        for model in [Device, Networkinterface, Harddisk, Partition]:
+            self.next_id[model] = (model._default_manager.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+    def allocate(self, model):
+        pk = self.next_id[model]
+        self.next_id[model] += 1
+        return pk
+
+    def run(self, rows):
+        self.started = time.time()
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            for line, row in enumerate(rows, 1):
+                self.rows += 1
+                try:
+                    self.add(row)
+                except (RowError, ValidationError), e:
+                    self.errors.append((line, u'; '.join(getattr(e, 'messages', None) or [unicode(e)])))
+                if self.pending_rows >= self.batch_size:
+                    self.flush()
+                if self.progress and self.rows % self.progress_every == 0:
+                    self.progress(self.rows, time.time() - self.started)
+            self.flush()
+            if not self.dry_run:
+                self.reset_sequences()
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        finally:
+            transaction.leave_transaction_management()
+        self.elapsed = time.time() - self.started
+        return self.counts
+
+    def add(self, row):
+        kind = unicode(row.get('type') or '').lower()
+        if kind in DEVICE_TYPES:
+            self.add_device(DEVICE_TYPES[kind], row)
+        elif kind in PART_TYPES:
+            self.add_part(PART_TYPES[kind], row)
+        else:
+            raise RowError(u'unknown type %r' % kind)
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def clean(self, model, row, resolved):
+        """
+        Return {field: value} for every concrete field of model, taking
+        resolved foreign keys from resolved and everything else from row.
+        """
+        values = {}
+        for field in model._meta.fields:
+            if field.primary_key or field.name in resolved:
+                continue
+            if field.rel:
+                values[field.attname] = None
+                continue
+            raw = row.get(field.name)
+            if raw in (None, ''):
+                value = field.null and None or field.get_default()
+                if (value is None and not field.null) or (value == '' and not field.blank):
+                    raise RowError(u'%s is required' % field.name)
+            else:
+                value = field.clean(raw, None)
+            values[field.attname] = value
+        for name, value in resolved.items():
+            values[model._meta.get_field(name).attname] = value
+        return values
+
+    def device(self, name, servers_only=False):
+        pk = self.devices.get(name)
+        if pk is None:
+            raise RowError(u'unknown or ambiguous device %r' % name)
+        if servers_only and pk not in self.servers:
+            raise RowError(u'device %r is not a server' % name)
+        return pk
+
+    def rack(self, row):
+        if row.get('rack'):
+            try:
+                pk = int(row['rack'])
+            except ValueError:
+                pk = None
+            if pk not in self.rack_ids:
+                raise RowError(u'unknown rack %r' % row['rack'])
+            return pk
+        try:
+            room, rackrow, column = row['serverroom'], int(row['row']), int(row['column'])
+        except (KeyError, ValueError):
+            raise RowError(u'rack needs serverroom, row and column')
+        key = row.get('datacentre') and (row['datacentre'], room, rackrow, column) or (room, rackrow, column)
+        try:
+            return self.racks[key]
+        except KeyError:
+            raise RowError(u'no rack at %s' % (key,))
+
+    def subnet(self, value):
+        value = unicode(value)
+        if value.isdigit() and int(value) in self.subnet_ids:
+            return int(value)
+        address, _, length = value.partition('/')
+        try:
+            version, packed = ipam.parse(address)
+            length = int(length or (version == 4 and 32 or 128))
+            key = (ipaddr.network(packed, length, version == 4 and ipaddr.WIDTH4 or ipaddr.WIDTH6)[0], length)
+            return self.subnets[key]
+        except (ValueError, KeyError):
+            raise RowError(u'unknown subnet %r' % value)
+
+    def lookup(self, table, value, what):
+        try:
+            return table[value]
+        except KeyError:
+            raise RowError(u'unknown %s %r' % (what, value))
+
+    def add_device(self, model, row):
+        resolved = {'rack': self.rack(row)}
+        if model is VM:
+            resolved['server'] = self.device(row.get('server'), servers_only=True)
+        if model is DiskArray and row.get('conntectTo'):
+            resolved['conntectTo'] = self.device(row['conntectTo'], servers_only=True)
+        functions = []
+        if row.get('functions'):
+            if 'functions' not in [field.name for field in model._meta.many_to_many]:
+                raise RowError(u'a %s has no functions' % model._meta.object_name.lower())
+            functions = [self.lookup(self.functions, name.strip(), 'function') for name in row['functions'].split(';')]
+        values = self.clean(model, row, resolved)
+        pk = self.allocate(Device)
+        for name, field in model._meta.parents.items():
+            values[field.attname] = pk
+        values['id'] = pk
+        if values['name'] in self.devices and self.devices[values['name']] != pk:
+            self.devices[values['name']] = None
+        else:
+            self.devices[values['name']] = pk
+        if model is Server:
+            self.servers.add(pk)
+        self.queue(Device, values)
+        if model is not Device:
+            self.queue(model, values)
+        for function in functions:
+            through = model._meta.get_field('functions').rel.through
+            self.queue(through, {'%s_id' % model._meta.object_name.lower(): pk, 'devicefunction_id': function})
+
+    def add_part(self, model, row):
+        if model is Networkinterface:
+            resolved = {
+                'device': self.device(row.get('device')),
+                'subnet': self.subnet(row.get('subnet', '')),
+                'kind': self.lookup(self.kinds, row.get('kind'), 'interface kind'),
+            }
+        else:
+            resolved = {'parent': self.device(row.get('parent'))}
+            if model is Harddisk and row.get('array'):
+                resolved['array'] = self.lookup(self.arrays, row['array'], 'raid array')
+        values = self.clean(model, row, resolved)
+        if model is Networkinterface:
+            values['packed4'] = ipaddr.pack4(values['ip4'])
+            values['packed6'] = ipaddr.pack6(values['ip6'])
+        values['id'] = self.allocate(model)
+        self.queue(model, values)
+
+    def queue(self, model, values):
+        self.pending.setdefault(model, []).append(values)
+        self.pending_rows += 1
+
+    def flush(self):
+        if not self.dry_run:
+            # parents before children, devices before what hangs off them
+            order = [Device] + Device.__subclasses__()
+            order += [m for m in self.pending if m not in order and m._meta.auto_created]
+            order += [Networkinterface, Harddisk, Partition]
+            cursor = connection.cursor()
+            for model in order:
+                rows = self.pending.get(model)
+                if rows:
+                    insert(cursor, model, rows)
+            transaction.commit()
+            for model in order:
+                if self.pending.get(model) and not model._meta.auto_created:
+                    bulk_inserted.send(sender=model, pks=[values[model._meta.pk.attname] for values in self.pending[model]])
+        self.pending = {}
+        self.pending_rows = 0
+
+    def reset_sequences(self):
+        cursor = connection.cursor()
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Device, Networkinterface, Harddisk, Partition]):
+            cursor.execute(sql)
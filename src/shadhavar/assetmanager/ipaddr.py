@@ -0,0 +1,81 @@
+"""
+Helpers to turn textual IPv4/IPv6 addresses into fixed width hex strings.
+
+The packed form is what the indexed address columns hold: every IPv4
+address is 8 hex digits and every IPv6 address 32, so comparing the
+strings compares the addresses and range lookups can use a plain index.
+"""
+
+import socket
+from binascii import hexlify
+
+from django.core.exceptions import ValidationError
+
+WIDTH4 = 8
+WIDTH6 = 32
+
+def pack(family, address):
+    """
+    Return the packed hex form of address, or None if it isn't a valid
+    address of the given family.
+    """
+    if not address:
+        return None
+    try:
+        return hexlify(socket.inet_pton(family, address.strip()))
+    except (socket.error, ValueError, UnicodeEncodeError):
+        return None
+
+def pack4(address):
+    return pack(socket.AF_INET, address)
+
+def pack6(address):
+    return pack(socket.AF_INET6, address)
+
+def unpack(packed):
+    """
+    Return the textual form of a packed address.
+    """
+    family = len(packed) == WIDTH4 and socket.AF_INET or socket.AF_INET6
+    return socket.inet_ntop(family, packed.decode('hex'))
+
+def to_int(packed):
+    return int(packed, 16)
+
+def from_int(value, width):
+    return '%0*x' % (width, value)
+
+def prefixlen(mask, bits):
+    """
+    Return the prefix length of a netmask ('255.255.255.0', 'ffff:ffff::')
+    or of a prefix length written as text ('24', '/64'); None if it is
+    neither.
+    """
+    if not mask:
+        return None
+    mask = mask.strip().lstrip('/')
+    if mask.isdigit():
+        length = int(mask)
+        return length if length <= bits else None
+    packed = pack(bits == 32 and socket.AF_INET or socket.AF_INET6, mask)
+    if packed is None:
+        return None
+    value = to_int(packed)
+    length = bin(value).count('1')
+    if value != ((1 << length) - 1) << (bits - length):
+        return None # not a contiguous mask
+    return length
+
+def network(packed, length, width):
+    """
+    Return the (first, last) packed addresses of the prefix of the given
+    length that contains packed.
+    """
+    bits = width * 4
+    host = (1 << (bits - length)) - 1
+    value = to_int(packed)
+    return from_int(value & ~host, width), from_int(value | host, width)
+
+def validate_ipv6(value):
+    if pack6(value) is None:
+        raise ValidationError(u'Enter a valid IPv6 address.')
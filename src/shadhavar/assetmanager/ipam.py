@@ -0,0 +1,172 @@
+"""
+Address lookups on top of the packed address columns.
+
+Subnet.first4/last4/first6/last6 and Networkinterface.packed4/packed6 hold
+fixed width hex copies of the textual addresses (see assetmanager.ipaddr),
+kept in sync on save. Every lookup here is a range condition on one of
+those indexed columns.
+"""
+
+from django.db.models.signals import pre_save
+
+from assetmanager import ipaddr
+from assetmanager.models import Subnet, Networkinterface
+
+FAMILIES = {
+    4: ('first4', 'last4', 'prefixlen4', 'packed4', ipaddr.WIDTH4),
+    6: ('first6', 'last6', 'prefixlen6', 'packed6', ipaddr.WIDTH6),
+}
+
+def parse(address):
+    """
+    Return (version, packed) for a textual IPv4 or IPv6 address.
+    """
+    packed = ipaddr.pack4(address)
+    if packed is not None:
+        return 4, packed
+    packed = ipaddr.pack6(address)
+    if packed is not None:
+        return 6, packed
+    raise ValueError('%r is not an IP address' % (address,))
+
+def subnet_range(subnet, version):
+    """
+    Compute (first, last, prefixlen) of a subnet from its textual fields.
+    """
+    if version == 4:
+        first = ipaddr.pack4(subnet.networkaddr4)
+        length = ipaddr.prefixlen(subnet.subnetaddr4, 32)
+        last = ipaddr.pack4(subnet.broadcast4)
+        width = ipaddr.WIDTH4
+    else:
+        first = ipaddr.pack6(subnet.networkaddr6)
+        length = ipaddr.prefixlen(subnet.subnetaddr6, 128)
+        last = ipaddr.pack6(subnet.lastip6)
+        width = ipaddr.WIDTH6
+    if first is None:
+        return None, None, None
+    if length is not None:
+        first, computed = ipaddr.network(first, length, width)
+        last = last or computed
+    return first, last or first, length
+
+def update_subnet(subnet):
+    subnet.first4, subnet.last4, subnet.prefixlen4 = subnet_range(subnet, 4)
+    subnet.first6, subnet.last6, subnet.prefixlen6 = subnet_range(subnet, 6)
+
+def update_interface(interface):
+    interface.packed4 = ipaddr.pack4(interface.ip4)
+    interface.packed6 = ipaddr.pack6(interface.ip6)
+
+def containing(address):
+    """
+    Subnets that contain the address, most specific first.
+    """
+    version, packed = parse(address)
+    first, last, length = FAMILIES[version][:3]
+    qs = Subnet.objects.filter(**{first + '__lte': packed, last + '__gte': packed})
+    return qs.order_by('-' + length, '-' + first)
+
+def subnet_for(address):
+    """
+    The most specific subnet containing the address, or None.
+    """
+    try:
+        return containing(address)[0]
+    except IndexError:
+        return None
+
+def overlapping(subnet, version=4):
+    """
+    Other subnets whose range overlaps the range of subnet.
+    """
+    first, last = FAMILIES[version][:2]
+    start, end = getattr(subnet, first), getattr(subnet, last)
+    if start is None:
+        return Subnet.objects.none()
+    qs = Subnet.objects.filter(**{first + '__lte': end, last + '__gte': start})
+    return qs.exclude(pk=subnet.pk)
+
+def overlaps(version=4):
+    """
+    Yield (subnet_id, subnet_id) for every pair of overlapping subnets, in
+    a single ordered pass over the range index.
+    """
+    first, last = FAMILIES[version][:2]
+    qs = Subnet.objects.filter(**{first + '__isnull': False}).order_by(first, '-' + last)
+    open_ranges = []
+    for pk, start, end in qs.values_list('pk', first, last).iterator():
+        open_ranges = [(other, other_end) for other, other_end in open_ranges if other_end >= start]
+        for other, other_end in open_ranges:
+            yield other, pk
+        open_ranges.append((pk, end))
+
+def interfaces_in(subnet, version=4):
+    """
+    Interfaces whose address lies within the range of subnet.
+    """
+    first, last, length, packed, width = FAMILIES[version]
+    start, end = getattr(subnet, first), getattr(subnet, last)
+    if start is None:
+        return Networkinterface.objects.none()
+    return Networkinterface.objects.filter(**{packed + '__gte': start, packed + '__lte': end})
+
+def hosts(start, end, version=4):
+    """
+    (low, high) of the host addresses from packed start to end, as
+    integers: without the network and broadcast address of IPv4 subnets.
+    """
+    low, high = ipaddr.to_int(start), ipaddr.to_int(end)
+    if version == 4 and high - low > 1:
+        low, high = low + 1, high - 1
+    return low, high
+
+def host_range(subnet, version=4):
+    """
+    (low, high) of the host addresses of subnet, None if it has no range
+    of that version.
+    """
+    first, last = FAMILIES[version][:2]
+    start, end = getattr(subnet, first), getattr(subnet, last)
+    if start is None:
+        return None
+    return hosts(start, end, version)
+
+def free_addresses(subnet, version=4):
+    """
+    Yield the unused host addresses of subnet in ascending order. The used
+    addresses are read in index order, so this stops reading as soon as
+    the caller stops asking.
+    """
+    packed, width = FAMILIES[version][3:]
+    if host_range(subnet, version) is None:
+        return
+    low, high = host_range(subnet, version)
+    used = interfaces_in(subnet, version).order_by(packed).values_list(packed, flat=True).distinct()
+    candidate = low
+    for address in used.iterator():
+        value = ipaddr.to_int(address)
+        while candidate < value and candidate <= high:
+            yield ipaddr.unpack(ipaddr.from_int(candidate, width))
+            candidate += 1
+        candidate = max(candidate, value + 1)
+    while candidate <= high:
+        yield ipaddr.unpack(ipaddr.from_int(candidate, width))
+        candidate += 1
+
+def next_free_address(subnet, version=4):
+    """
+    The lowest unused host address of subnet, or None if it is full.
+    """
+    for address in free_addresses(subnet, version):
+        return address
+    return None
+
+def subnet_pre_save(sender, instance, **kwargs):
+    update_subnet(instance)
+
+def interface_pre_save(sender, instance, **kwargs):
+    update_interface(instance)
+
+pre_save.connect(subnet_pre_save, sender=Subnet)
+pre_save.connect(interface_pre_save, sender=Networkinterface)
@@ -0,0 +1,226 @@
+"""
+What reaches its end date soon: devices at their end of life and hard
+disks running out of warranty.
+
+`manage.py update_lifecycle`, meant to run nightly, makes a
+LifecycleReport of everything ending within HORIZON days, counted per
+bucket of BUCKETS days, with the disks grouped by RAID array and by the
+device they are in so arrays that lose several disks at once stand out.
+
+A run starts from the state of the previous snapshot (the entries with
+their names, and the names and disk counts of the arrays and devices
+they are grouped under) and only looks at what changed since: the
+objects the audit log has changes for, the arrays and devices those
+changes moved disks between, and the days the window moved forward,
+which the (enddate, ...) indexes answer without scanning the tables.
+Updates that bypass the models (queryset.update(), raw SQL) are not in
+the audit log; --full starts over.
+
+The JSON of the latest report is cached with its id, which every read
+checks against the newest LifecycleReport, so a run in another process
+is served at once whether or not it shares the cache.
+"""
+
+import json
+from datetime import date, datetime, timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from assetmanager.models import Change, Device, Harddisk, LifecycleReport, RaidArray
+
+BUCKETS = (30, 60, 90)
+HORIZON = BUCKETS[-1]
+REPORT_KEY = 'assetmanager.lifecycle.report'
+REPORT_TIMEOUT = 24 * 3600
+CHUNK_SIZE = 500
+
+# kind -> (model, the fields kept after the end date)
+SOURCES = {
+    'device': (Device, ('rack', 'name')),
+    'harddisk': (Harddisk, ('parent', 'array', 'serialnr')),
+}
+# the disks are grouped on -> (model of the group, position in a disk entry)
+GROUPS = {
+    'array': (RaidArray, 2),
+    'parent': (Device, 1),
+}
+
+def chunks(values):
+    values = list(values)
+    for i in range(0, len(values), CHUNK_SIZE):
+        yield values[i:i + CHUNK_SIZE]
+
+def collect(kind, qs):
+    """
+    {pk: [enddate, ...]} of the objects in qs.
+    """
+    fields = SOURCES[kind][1]
+    return dict((row[0], [row[1].isoformat()] + list(row[2:]))
+                for row in qs.values_list('pk', 'enddate', *fields).iterator())
+
+def ending(kind, first, last):
+    return SOURCES[kind][0]._default_manager.filter(enddate__gte=first, enddate__lte=last)
+
+def changed(after, upto):
+    """
+    The pks of the devices, disks and arrays with a change in the audit log
+    after the change with id after, up to and including upto, keyed on
+    kind, and of the arrays and devices (keyed on group) those changes
+    added disks to or took them from.
+    """
+    models = {'device': Device, 'harddisk': Harddisk, 'array': RaidArray}
+    kinds = dict((ContentType.objects.get_for_model(model).pk, kind) for kind, model in models.items())
+    result = dict((kind, set()) for kind in models)
+    result['parent'] = set()
+    rows = Change.objects.filter(pk__gt=after, pk__lte=upto, content_type__in=kinds.keys())
+    for content_type, object_id, diff in rows.values_list('content_type', 'object_id', 'diff').iterator():
+        kind = kinds[content_type]
+        result[kind].add(object_id)
+        if kind == 'harddisk':
+            diff = json.loads(diff)
+            for group in GROUPS:
+                values = diff.get(group + '_id')
+                result[group].update(v for v in (values if isinstance(values, list) else [values]) if v is not None)
+    return result
+
+def latest():
+    snapshots = LifecycleReport.objects.order_by('-day', '-id')[:1]
+    return snapshots and snapshots[0] or None
+
+def _load(text):
+    return dict((kind, dict((row[0], row[1:]) for row in rows)) for kind, rows in json.loads(text).items())
+
+def _dump(state):
+    return json.dumps(dict((kind, [[pk] + list(entry) for pk, entry in sorted(entries.items())])
+                           for kind, entries in state.items()), separators=(',', ':'))
+
+def update(today=None, full=False):
+    """
+    Make the snapshot of today and return it.
+    """
+    today = today or date.today()
+    end = today + timedelta(HORIZON)
+    last_change = Change.objects.aggregate(last=Max('pk'))['last'] or 0
+    previous = not full and latest() or None
+    if previous is None or previous.day > today or previous.horizon != HORIZON or not previous.state:
+        state = dict((kind, collect(kind, ending(kind, today, end))) for kind in SOURCES)
+        state.update((group, {}) for group in GROUPS)
+    else:
+        state = _load(previous.state)
+        touched = changed(previous.last_change, last_change)
+        covered = previous.day + timedelta(previous.horizon)
+        for kind in SOURCES:
+            entries = state[kind]
+            for pk in [pk for pk, entry in entries.items() if entry[0] < today.isoformat()] + list(touched[kind]):
+                entries.pop(pk, None)
+            for chunk in chunks(touched[kind]):
+                entries.update(collect(kind, ending(kind, today, end).filter(pk__in=chunk)))
+            if end > covered:
+                entries.update(collect(kind, ending(kind, max(today, covered + timedelta(1)), end)))
+        # renamed devices and arrays, and those that gained or lost disks
+        for group, pks in (('array', touched['array']), ('parent', touched['parent'] | touched['device'])):
+            for pk in pks:
+                state[group].pop(pk, None)
+    fill(state, today)
+    report = json.dumps(build(state, today), separators=(',', ':'))
+    snapshot = LifecycleReport.objects.create(day=today, generated=datetime.now(), horizon=HORIZON,
+        last_change=last_change, state=_dump(state), report=report)
+    # only the latest snapshot is ever started from
+    LifecycleReport.objects.exclude(pk=snapshot.pk).exclude(state='').update(state='')
+    cache.set(REPORT_KEY, (snapshot.pk, report), REPORT_TIMEOUT)
+    return snapshot
+
+def fill(state, today):
+    """
+    Add the name and number of disks of the arrays and devices the disks
+    in state are grouped under, and drop the ones no disk refers to.
+    """
+    for group, (model, position) in GROUPS.items():
+        wanted = set(entry[position] for entry in state['harddisk'].values() if entry[position] is not None)
+        known = state[group]
+        for pk in set(known) - wanted:
+            del known[pk]
+        missing = wanted - set(known)
+        if not missing:
+            continue
+        counts = Harddisk.objects.values_list(group).annotate(disks=Count('pk')).order_by()
+        found = {}
+        if len(missing) > CHUNK_SIZE:
+            # a first run: the groups with a disk in the window, which the
+            # index answers faster than a long list of ids
+            window = ending('harddisk', today, today + timedelta(HORIZON)).values(group)
+            found.update(counts.filter(**{'%s__in' % group: window}))
+        for chunk in chunks(missing - set(found)):
+            found.update(counts.filter(**{'%s__in' % group: chunk}))
+        for chunk in chunks(missing):
+            for pk, name in model._default_manager.filter(pk__in=chunk).values_list('pk', 'name'):
+                known[pk] = [name, found.get(pk, 0)]
+
+def bucket(enddate, today):
+    days = (enddate - today).days
+    for limit in BUCKETS:
+        if days <= limit:
+            return limit
+
+def _groups(disks, group, known):
+    members = {}
+    for disk in disks:
+        if disk[group] is not None:
+            members.setdefault(disk[group], []).append(disk)
+    result = []
+    for pk, ids in members.items():
+        name, total = known.get(pk, (None, 0))
+        entry = {'id': pk, 'name': name, 'disks': total, 'expiring': len(ids),
+                 'first': ids[0]['enddate'], 'harddisks': [disk['id'] for disk in ids]}
+        if group == 'array':
+            entry['devices'] = sorted(set(disk['parent'] for disk in ids if disk['parent'] is not None))
+        result.append(entry)
+    result.sort(key=lambda entry: (-entry['expiring'], entry['first'], entry['id']))
+    return result
+
+def build(state, today):
+    """
+    The report of the entries in state, as of today.
+    """
+    def entries(kind):
+        return sorted((entry[0], pk, date(*map(int, entry[0].split('-'))), entry[1:])
+                      for pk, entry in state[kind].items())
+    devices = [{'id': pk, 'name': name, 'rack': rack, 'enddate': text, 'bucket': bucket(end, today)}
+               for text, pk, end, (rack, name) in entries('device')]
+    disks = [{'id': pk, 'serialnr': serialnr, 'parent': parent, 'array': array, 'enddate': text,
+              'bucket': bucket(end, today)}
+             for text, pk, end, (parent, array, serialnr) in entries('harddisk')]
+    counts = {}
+    for kind, objects in (('device', devices), ('harddisk', disks)):
+        counts[kind] = dict((limit, 0) for limit in BUCKETS)
+        for obj in objects:
+            counts[kind][obj['bucket']] += 1
+    return {
+        'day': today.isoformat(),
+        'horizon': HORIZON,
+        'buckets': BUCKETS,
+        'counts': counts,
+        'devices': devices,
+        'harddisks': disks,
+        'arrays': _groups(disks, 'array', state['array']),
+        'parents': _groups(disks, 'parent', state['parent']),
+    }
+
+def report(day=None):
+    """
+    The JSON of the latest snapshot, or of the last one made on day; None
+    if there is none.
+    """
+    if day is None:
+        newest = LifecycleReport.objects.order_by('-day', '-id').values_list('pk', flat=True)[:1]
+        if not newest:
+            return None
+        cached = cache.get(REPORT_KEY)
+        if cached is None or cached[0] != newest[0]:
+            cached = (newest[0], LifecycleReport.objects.filter(pk=newest[0]).values_list('report', flat=True)[0])
+            cache.set(REPORT_KEY, cached, REPORT_TIMEOUT)
+        return cached[1]
+    snapshots = LifecycleReport.objects.filter(day=day).order_by('-id')[:1]
+    return snapshots and snapshots[0].report or None
@@ -0,0 +1,239 @@
+"""
+Read-through cache of the location tree: datacentres, the serverrooms in
+them and the racks in those, including racks mounted in other racks.
+
+The tree is built from three queries and kept at two levels: in the
+shared cache, so a tree built by one process saves the others the
+queries, and per process, so repeated reads skip the unpickling too. Both
+levels are keyed on a generation token that every save or delete of a
+location replaces, so a write anywhere is seen everywhere on the next read.
+That needs a cache shared by every process; without one (see
+assetmanager.caches) a tree is only kept until the next request starts.
+
+A thread that changed locations inside a transaction keeps its trees to
+itself until the transaction is over, so a rollback can't leave locations
+that never existed in the cache. The end of the transaction is noticed by
+the first save or delete, or tree(), of the thread outside of it.
+"""
+
+import threading
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+
+from assetmanager import caches
+from assetmanager.models import Datacentre, Serverroom, Rack
+
+GENERATION_KEY = 'assetmanager.locations.generation'
+TREE_KEY = 'assetmanager.locations.tree.%s'
+TIMEOUT = 30 * 24 * 3600
+
+DATACENTRE, SERVERROOM, RACK = 'datacentre', 'serverroom', 'rack'
+KINDS = {Datacentre: DATACENTRE, Serverroom: SERVERROOM, Rack: RACK}
+
+class LocationTree(object):
+    """
+    Every location is a node keyed on (kind, id). Racks hang off the rack
+    they are mounted in, or off their serverroom when they stand on the
+    floor.
+    """
+    def __init__(self):
+        self.nodes = {}     # (kind, id) -> {'name', 'parent', ...}
+        self.children = {}  # (kind, id) -> [(kind, id)] in load order
+
+    @classmethod
+    def load(cls):
+        tree = cls()
+        for row in Datacentre.objects.values('id', 'name').order_by('name', 'id'):
+            tree.add((DATACENTRE, row['id']), None, name=row['name'])
+        for row in Serverroom.objects.values('id', 'name', 'datacentre', 'floor').order_by('floor', 'name', 'id'):
+            tree.add((SERVERROOM, row['id']), (DATACENTRE, row['datacentre']),
+                     name=row['name'], floor=row['floor'])
+        for row in Rack.objects.values('id', 'name', 'serverroom', 'rack', 'row', 'column', 'height').order_by('row', 'column', 'id'):
+            if row['rack'] is not None:
+                parent = (RACK, row['rack'])
+            else:
+                parent = (SERVERROOM, row['serverroom'])
+            tree.add((RACK, row['id']), parent, name=row['name'], serverroom=row['serverroom'],
+                     row=row['row'], column=row['column'], height=row['height'])
+        return tree
+
+    def add(self, key, parent, **attrs):
+        attrs['parent'] = parent
+        self.nodes[key] = attrs
+        if parent is not None:
+            self.children.setdefault(parent, []).append(key)
+
+    def node(self, key):
+        return self.nodes.get(key)
+
+    def ancestors(self, key):
+        """
+        The keys above key, nearest first, ending at its datacentre.
+        """
+        result = []
+        seen = set([key])
+        parent = self.nodes.get(key, {}).get('parent')
+        while parent is not None and parent not in seen:
+            result.append(parent)
+            seen.add(parent)
+            parent = self.nodes.get(parent, {}).get('parent')
+        return result
+
+    def descendants(self, key):
+        """
+        The keys below key, depth first. Racks mounted in each other in a
+        loop are only visited once.
+        """
+        result = []
+        seen = set([key])
+        stack = list(reversed(self.children.get(key, [])))
+        while stack:
+            child = stack.pop()
+            if child in seen:
+                continue
+            seen.add(child)
+            result.append(child)
+            stack.extend(reversed(self.children.get(child, [])))
+        return result
+
+    def racks(self, key):
+        """
+        The ids of every rack at or below key.
+        """
+        ids = [id for kind, id in self.descendants(key) if kind == RACK]
+        if key[0] == RACK:
+            ids.insert(0, key[1])
+        return ids
+
+    def as_list(self, key=None, _seen=None):
+        """
+        The tree below key (or every datacentre) as nested dicts, for
+        templates and serialisation.
+        """
+        seen = _seen if _seen is not None else set()
+        if key is None:
+            keys = sorted((k for k, node in self.nodes.iteritems() if node['parent'] is None),
+                          key=lambda k: (self.nodes[k]['name'], k[1]))
+        else:
+            keys = self.children.get(key, [])
+        result = []
+        for child in keys:
+            if child in seen:
+                continue
+            seen.add(child)
+            node = dict(self.nodes[child], kind=child[0], id=child[1])
+            del node['parent']
+            node['children'] = self.as_list(child, seen)
+            result.append(node)
+        return result
+
+stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+_local = {}
+_state = threading.local()
+
+def generation():
+    """
+    A token that changes whenever a location does. If it fell out of the
+    cache a new one is made, which makes every process reload.
+    """
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        cache.add(GENERATION_KEY, uuid4().hex, TIMEOUT)
+        current = cache.get(GENERATION_KEY)
+    return current
+
+def _drop():
+    cache.set(GENERATION_KEY, uuid4().hex, TIMEOUT)
+    _local.clear()
+
+def invalidate(**kwargs):
+    """
+    Drop the cached tree, in every process sharing the cache.
+    """
+    _drop()
+    _state.tree = None
+    if transaction.is_managed():
+        _state.uncommitted = True
+
+def committed(**kwargs):
+    """
+    End the private trees of this thread once its transaction is over,
+    committed or rolled back. Other threads may have cached either state
+    in the meantime, so the shared tree goes too.
+    """
+    if getattr(_state, 'uncommitted', False) and not (transaction.is_managed() and transaction.is_dirty()):
+        _state.uncommitted = False
+        _state.tree = None
+        _drop()
+
+def tree():
+    """
+    The current location tree: from this process if it has it, else from
+    the shared cache, else loaded from the database and shared.
+    """
+    committed()
+    current = generation()
+    if getattr(_state, 'uncommitted', False):
+        cached = getattr(_state, 'tree', None)
+        if cached is None or cached[0] != current:
+            stats['misses'] += 1
+            cached = _state.tree = (current, LocationTree.load())
+        else:
+            stats['local_hits'] += 1
+        return cached[1]
+    cached = _local.get('tree')
+    if cached is not None and cached[0] == current:
+        stats['local_hits'] += 1
+        return cached[1]
+    key = TREE_KEY % current
+    loaded = cache.get(key)
+    if loaded is None:
+        stats['misses'] += 1
+        loaded = LocationTree.load()
+        cache.set(key, loaded, TIMEOUT)
+    else:
+        stats['shared_hits'] += 1
+    _local['tree'] = (current, loaded)
+    return loaded
+
+def key(obj):
+    return (KINDS[type(obj)], obj.pk)
+
+def node(obj):
+    return tree().node(key(obj))
+
+def ancestors(obj):
+    return tree().ancestors(key(obj))
+
+def descendants(obj):
+    return tree().descendants(key(obj))
+
+def racks(obj):
+    return tree().racks(key(obj))
+
+def name(kind, id):
+    """
+    The name of a location, or None if it isn't in the tree.
+    """
+    found = tree().node((kind, id))
+    if found is not None:
+        return found['name']
+
+def hit_ratio():
+    hits = stats['local_hits'] + stats['shared_hits']
+    total = hits + stats['misses']
+    return float(hits) / total if total else 0.0
+
+def reset_stats():
+    for counter in stats:
+        stats[counter] = 0
+
+for model in KINDS:
+    post_save.connect(invalidate, sender=model)
+    post_delete.connect(invalidate, sender=model)
+pre_save.connect(committed)
+pre_delete.connect(committed)
+caches.per_request(_drop)
@@ -0,0 +1,188 @@
+"""
+Maintenance windows: which devices are under maintenance when, and which
+windows collide.
+
+Windows are looked up by interval on the indexed start and end dates; an
+end date of None means the window is open-ended. Device.maintainance is
+derived: it is true while a window covers today, updated whenever a
+window changes and for everything by `manage.py update_maintenance`,
+which is meant to run daily. Only the flags that flip are written, and
+each flip is logged in the audit log.
+
+Two windows conflict when they overlap in time and their devices depend
+on each other: the same device, devices linked by a cable or a KVM
+connection, a VM and its host, or two devices hanging off the same
+switch, KVM or host. The check for a datacentre loads the topology once
+and sweeps the windows in start order, keeping the open ones indexed by
+device and by neighbouring device, so each window only looks at the
+open windows on its own device and the devices next to it.
+"""
+
+import heapq
+from datetime import date
+
+from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from assetmanager import topology
+from assetmanager.models import Device, Maintenance, VM
+
+def overlapping(start, end=None, datacentre=None):
+    """
+    The windows overlapping start..end (inclusive); end None means from
+    start onwards.
+    """
+    windows = Maintenance.objects.filter(Q(end_date__isnull=True) | Q(end_date__gte=start))
+    if end is not None:
+        windows = windows.filter(start_date__lte=end)
+    if datacentre is not None:
+        windows = windows.filter(target__rack__serverroom__datacentre=datacentre)
+    return windows
+
+def under_maintenance(start, end=None, datacentre=None):
+    """
+    The devices with a window overlapping start..end.
+    """
+    return Device.objects.filter(pk__in=overlapping(start, end, datacentre).values('target'))
+
+def active_on(day, device_ids=None):
+    windows = overlapping(day, day)
+    if device_ids is not None:
+        windows = windows.filter(target__in=list(device_ids))
+    return set(windows.values_list('target', flat=True))
+
+def flip(device_ids, value):
+    """
+    Set Device.maintainance to value on the given devices, which have the
+    other value, and log it.
+    """
+    # audit imports the models, which import this module
+    from assetmanager import audit
+    device_ids = list(device_ids)
+    for i in range(0, len(device_ids), 500):
+        chunk = device_ids[i:i + 500]
+        Device.objects.filter(pk__in=chunk).update(maintainance=value)
+        audit.updated(Device, chunk, 'maintainance', not value, value)
+
+def update_flags(device_ids, today=None):
+    """
+    Set Device.maintainance of the given devices from their windows.
+    """
+    device_ids = [pk for pk in device_ids if pk is not None]
+    if not device_ids:
+        return
+    active = active_on(today or date.today(), device_ids)
+    flags = dict(Device.objects.filter(pk__in=device_ids).values_list('pk', 'maintainance'))
+    flip([pk for pk, flag in flags.items() if not flag and pk in active], True)
+    flip([pk for pk, flag in flags.items() if flag and pk not in active], False)
+
+def refresh(today=None):
+    """
+    Set Device.maintainance of every device. Returns the number of
+    devices under maintenance.
+    """
+    active = overlapping(today or date.today(), today or date.today()).values('target')
+    flip(Device.objects.filter(maintainance=True).exclude(pk__in=active).values_list('pk', flat=True), False)
+    flip(Device.objects.filter(pk__in=active, maintainance=False).values_list('pk', flat=True), True)
+    return Device.objects.filter(maintainance=True).count()
+
+class Dependencies(object):
+    """
+    The devices each device depends on or shares a dependency with, from
+    the topology graph plus the VM -> host links.
+    """
+    def __init__(self, datacentre=None):
+        self.neighbours = {}
+        graph = topology.topology(datacentre)
+        for device, edges in graph.adjacency.iteritems():
+            self.neighbours.setdefault(device, set()).update(edge[0] for edge in edges)
+        vms = VM.objects.exclude(server=None)
+        if datacentre is not None:
+            vms = vms.filter(rack__serverroom__datacentre=datacentre)
+        for vm, host in vms.values_list('pk', 'server').iterator():
+            self.neighbours.setdefault(vm, set()).add(host)
+            self.neighbours.setdefault(host, set()).add(vm)
+
+    def related(self, a, b):
+        if a == b:
+            return True
+        na = self.neighbours.get(a, ())
+        nb = self.neighbours.get(b, ())
+        if b in na:
+            return True
+        if len(na) > len(nb):
+            na, nb = nb, na
+        return any(n in nb for n in na)
+
+def _windows(windows):
+    return sorted(windows.values_list('pk', 'target', 'start_date', 'end_date'), key=lambda w: (w[2], w[0]))
+
+def _overlap(a, b):
+    return (a[3] is None or a[3] >= b[2]) and (b[3] is None or b[3] >= a[2])
+
+def conflicts(datacentre=None, dependencies=None):
+    """
+    Every pair of conflicting windows in a datacentre (or everywhere), as
+    (window id, window id) with the earlier start first.
+    """
+    dependencies = dependencies or Dependencies(datacentre)
+    windows = Maintenance.objects.all()
+    if datacentre is not None:
+        windows = windows.filter(target__rack__serverroom__datacentre=datacentre)
+    # the windows still open at the current start, by device and by the
+    # devices next to theirs, and a heap to close them by end date
+    by_target = {}
+    by_neighbour = {}
+    ending = []
+    targets = {}
+    result = []
+    for pk, target, start, end in _windows(windows):
+        while ending and ending[0][0] < start:
+            closed = heapq.heappop(ending)[1]
+            device = targets.pop(closed)
+            by_target[device].discard(closed)
+            for n in dependencies.neighbours.get(device, ()):
+                by_neighbour[n].discard(closed)
+        neighbours = dependencies.neighbours.get(target, ())
+        found = set(by_target.get(target, ()))
+        for n in neighbours:
+            found.update(by_target.get(n, ()))
+            found.update(by_neighbour.get(n, ()))
+        result.extend((other, pk) for other in sorted(found))
+        targets[pk] = target
+        by_target.setdefault(target, set()).add(pk)
+        for n in neighbours:
+            by_neighbour.setdefault(n, set()).add(pk)
+        heapq.heappush(ending, (end or date.max, pk))
+    return result
+
+def conflicts_with(target, start, end=None, datacentre=None, dependencies=None, exclude=None):
+    """
+    The windows that would conflict with a window on target from start to
+    end; exclude leaves out the window being checked itself.
+    """
+    target = getattr(target, 'pk', target)
+    dependencies = dependencies or Dependencies(datacentre)
+    windows = overlapping(start, end, datacentre)
+    if exclude is not None:
+        windows = windows.exclude(pk=getattr(exclude, 'pk', exclude))
+    candidate = (None, target, start, end)
+    found = [w[0] for w in _windows(windows) if _overlap(candidate, w) and dependencies.related(target, w[1])]
+    by_pk = Maintenance.objects.in_bulk(found)
+    return [by_pk[pk] for pk in found]
+
+def window_pre_save(sender, instance, raw, **kwargs):
+    instance._maintenance_old = None
+    if instance.pk is not None and not raw:
+        old = Maintenance.objects.filter(pk=instance.pk).values_list('target', flat=True)
+        instance._maintenance_old = old[0] if old else None
+
+def window_saved(sender, instance, **kwargs):
+    update_flags([instance.target_id, getattr(instance, '_maintenance_old', None)])
+
+def window_deleted(sender, instance, **kwargs):
+    update_flags([instance.target_id])
+
+pre_save.connect(window_pre_save, sender=Maintenance)
+post_save.connect(window_saved, sender=Maintenance)
+post_delete.connect(window_deleted, sender=Maintenance)
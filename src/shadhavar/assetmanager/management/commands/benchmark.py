@@ -0,0 +1,80 @@
+import json
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from assetmanager import benchmark
+from assetmanager.models import Datacentre
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--generate', action='store_true', dest='generate', default=False,
+                    help='First fill the SQLite database with a synthetic inventory.'),
+        make_option('--seed', dest='seed', type='int', default=0,
+                    help='Seed of the generated inventory.'),
+        make_option('--datacentres', dest='datacentres', type='int', default=1),
+        make_option('--rooms', dest='rooms', type='int', default=2,
+                    help='Server rooms per datacentre.'),
+        make_option('--racks', dest='racks', type='int', default=10,
+                    help='Racks per server room.'),
+        make_option('--devices', dest='devices', type='int', default=20,
+                    help='Devices per rack.'),
+        make_option('--blade-every', dest='blade_every', type='int', default=5,
+                    help='Put a blade enclosure in every n-th rack, 0 for none.'),
+        make_option('--vms', dest='vms', type='int', default=4,
+                    help='The most VMs per server.'),
+        make_option('--runs', dest='runs', type='int', default=10,
+                    help='Runs per scenario.'),
+        make_option('--scenario', action='append', dest='scenarios', default=[],
+                    help='Only run this scenario or group of scenarios (changelist, detail, dropdown, view, save), may be repeated.'),
+        make_option('--output', dest='output', default=None,
+                    help='Write the results as JSON to this file.'),
+        make_option('--compare', dest='compare', default=None,
+                    help='Compare with the results in this JSON file.'),
+        make_option('--tolerance', dest='tolerance', type='float', default=0.2,
+                    help='How much slower a median may get before it counts as a regression.'),
+    )
+    help = "Time admin pages, generic views and saves against a synthetic inventory."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if not benchmark.writable():
+            if options['generate']:
+                raise CommandError('--generate only writes to an SQLite database.')
+            if any(benchmark.writes(name) for name in options['scenarios']):
+                raise CommandError('The save and power.draw scenarios only write to an SQLite database.')
+            if verbosity > 0:
+                print 'Leaving out the save and power.draw scenarios, this is not an SQLite database.'
+        if options['generate']:
+            generator = benchmark.Generator(seed=options['seed'], datacentres=options['datacentres'],
+                                            rooms=options['rooms'], racks=options['racks'], devices=options['devices'],
+                                            blade_every=options['blade_every'], vms=options['vms'])
+            if Datacentre.objects.filter(name__startswith=generator.prefix + '-').exists():
+                raise CommandError('The database already has a generated inventory.')
+            counts = generator.run()
+            if verbosity > 0:
+                print 'Generated %s.' % ', '.join('%d %s' % (count, kind) for kind, count in sorted(counts.items()))
+        result = benchmark.run(options['runs'], options['scenarios'])
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                json.dump(result, stream, indent=1, sort_keys=True)
+        if verbosity > 0:
+            print '%-32s %9s %9s %9s %8s' % ('scenario', 'p50 ms', 'p90 ms', 'p99 ms', 'queries')
+            for name, scenario in sorted(result['scenarios'].items()):
+                latency = scenario['latency_ms']
+                print '%-32s %9s %9s %9s %8s%s' % (name, latency.get('p50', '-'), latency.get('p90', '-'),
+                                                  latency.get('p99', '-'), scenario['queries'].get('p50', '-'),
+                                                  scenario['errors'] and '  %d errors' % sum(scenario['errors'].values()) or '')
+        if options['compare']:
+            with open(options['compare']) as stream:
+                old = json.load(stream)
+            regressions = 0
+            for name, before, after, queries_before, queries_after, regressed in benchmark.compare(old, result, options['tolerance']):
+                regressions += regressed
+                if regressed or verbosity > 1:
+                    print '%s %-32s p50 %s -> %s ms, queries %s -> %s' % (regressed and 'REGRESSED' or 'ok       ', name,
+                                                                        before, after, queries_before, queries_after)
+            if regressions:
+                sys.stderr.write('%d scenarios regressed.\n' % regressions)
+                sys.exit(1)
@@ -0,0 +1,37 @@
+import json
+import os
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from assetmanager import benchmark
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--profile', action='append', dest='profiles', default=[],
+                    help='Settings module of the workers to start, may be repeated. Defaults to the current settings and worker_settings.'),
+        make_option('--path', dest='path', default='/api/datacentre/',
+                    help='The path every worker requests.'),
+        make_option('--runs', dest='runs', type='int', default=5,
+                    help='Workers started per settings module.'),
+        make_option('--output', dest='output', default=None,
+                    help='Write the results as JSON to this file.'),
+    )
+    help = "Time the first request of fresh worker processes and measure their memory."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        profiles = options['profiles'] or [os.environ['DJANGO_SETTINGS_MODULE'], 'worker_settings']
+        session = benchmark.cookie()
+        results = [benchmark.startup(profile, options['path'], options['runs'], session) for profile in profiles]
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                json.dump(results, stream, indent=1, sort_keys=True)
+        if verbosity > 0:
+            print '%-24s %11s %13s %13s %8s %8s %s' % ('settings', 'process ms', 'first req ms', 'second req ms',
+                                                      'RSS MB', 'modules', 'status')
+            for result in results:
+                print '%-24s %11s %13s %13s %8s %8s %s' % (result['settings'], result['process_ms']['p50'],
+                                                          result['first_request_ms']['p50'], result['second_request_ms']['p50'],
+                                                          round(result['rss_mb']['p50'], 1), result['modules']['p50'],
+                                                          ', '.join('%s x%d' % item for item in sorted(result['status'].items())))
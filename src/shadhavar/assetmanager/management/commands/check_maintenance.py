@@ -0,0 +1,23 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from assetmanager import maintenance
+from assetmanager.models import Maintenance
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--datacentre', type='int', dest='datacentre', default=None,
+                    help='Only check the windows of devices in this datacentre.'),
+    )
+    help = "List maintenance windows that overlap on devices depending on each other."
+
+    def handle_noargs(self, **options):
+        pairs = maintenance.conflicts(options.get('datacentre'))
+        windows = Maintenance.objects.in_bulk(set(pk for pair in pairs for pk in pair))
+        for a, b in pairs:
+            a, b = windows[a], windows[b]
+            print "window %d (device %d, %s..%s) conflicts with window %d (device %d, %s..%s)" % (
+                a.pk, a.target_id, a.start_date, a.end_date or '', b.pk, b.target_id, b.start_date, b.end_date or '')
+        if int(options.get('verbosity', 1)) > 0:
+            print "%d conflicts." % len(pairs)
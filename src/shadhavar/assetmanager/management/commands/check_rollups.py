@@ -0,0 +1,17 @@
+import sys
+
+from django.core.management.base import NoArgsCommand
+
+from assetmanager import rollups
+
+class Command(NoArgsCommand):
+    help = "Compare the stored capacity rollups with a fresh computation."
+
+    def handle_noargs(self, **options):
+        problems = rollups.check()
+        for scope, scope_id, metric, stored, computed in problems:
+            print '%s %s %s: stored %s, computed %s' % (scope, scope_id, metric, stored, computed)
+        if int(options.get('verbosity', 1)) > 0:
+            print "%d inconsistent rollups." % len(problems)
+        if problems:
+            sys.exit(1)
@@ -0,0 +1,31 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from assetmanager import exporter
+
+class Command(BaseCommand):
+    help = "Write the whole inventory as CSV or JSON lines, without loading it into memory."
+    args = '[file]'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='jsonl',
+            help='Output format, csv or jsonl.'),
+        make_option('--gzip', action='store_true', dest='gzip', default=False,
+            help='Gzip the output.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=exporter.CHUNK_SIZE,
+            help='Number of devices read per query.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['format'] not in exporter.FORMATS:
+            raise CommandError('Unknown format %r.' % options['format'])
+        stream, content_type = exporter.export(options['format'], options['gzip'], options['chunk_size'])
+        out = args and args[0] != '-' and open(args[0], 'wb') or sys.stdout
+        try:
+            for data in stream:
+                out.write(data)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,51 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from assetmanager.importer import Importer, READERS
+
+class Command(BaseCommand):
+    help = "Import devices, network interfaces, hard disks and partitions from CSV or JSON lines files."
+    args = '<file file ...>'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None,
+            help='Input format, csv or json. Guessed from the file extension by default.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+            help='Number of rows written per transaction.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only validate the input, write nothing.'),
+        make_option('--progress', dest='progress', type='int', default=10000,
+            help='Report progress every N rows, 0 to stay quiet.'),
+    )
+
+    def handle(self, *files, **options):
+        if not files:
+            raise CommandError('Give at least one file to import, - reads stdin.')
+        verbosity = int(options.get('verbosity', 1))
+
+        def progress(rows, elapsed):
+            sys.stderr.write('%d rows, %.0f rows/s\n' % (rows, rows / max(elapsed, 0.001)))
+
+        for name in files:
+            format = options['format'] or (name.endswith('.csv') and 'csv' or 'json')
+            if format not in READERS:
+                raise CommandError('Unknown format %r.' % format)
+            stream = name == '-' and sys.stdin or open(name, 'rb')
+            importer = Importer(batch_size=options['batch_size'], dry_run=options['dry_run'],
+                                progress=verbosity > 0 and options['progress'] and progress or None,
+                                progress_every=options['progress'] or 1)
+            try:
+                counts = importer.run(READERS[format](stream))
+            finally:
+                if stream is not sys.stdin:
+                    stream.close()
+            for line, message in importer.errors:
+                sys.stderr.write((u'%s:%d: %s\n' % (name, line, message)).encode('utf-8'))
+            if verbosity > 0:
+                print '%s%s: %d rows in %.1fs (%.0f rows/s), %d rejected' % (
+                    options['dry_run'] and 'dry run of ' or '', name, importer.rows, importer.elapsed,
+                    importer.rows / max(importer.elapsed, 0.001), len(importer.errors))
+                for kind, count in sorted(counts.items()):
+                    print '    %s: %d' % (kind, count)
@@ -0,0 +1,27 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from assetmanager.models import Subnet, Networkinterface
+from assetmanager import ipam
+
+class Command(NoArgsCommand):
+    help = "Fill the packed address columns of subnets and network interfaces from their textual addresses."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        subnets = 0
+        for subnet in Subnet.objects.all().iterator():
+            ipam.update_subnet(subnet)
+            Subnet.objects.filter(pk=subnet.pk).update(
+                first4=subnet.first4, last4=subnet.last4, prefixlen4=subnet.prefixlen4,
+                first6=subnet.first6, last6=subnet.last6, prefixlen6=subnet.prefixlen6)
+            subnets += 1
+        interfaces = 0
+        for pk, ip4, ip6 in Networkinterface.objects.values_list('pk', 'ip4', 'ip6').iterator():
+            interface = Networkinterface(pk=pk, ip4=ip4, ip6=ip6)
+            ipam.update_interface(interface)
+            Networkinterface.objects.filter(pk=pk).update(packed4=interface.packed4, packed6=interface.packed6)
+            interfaces += 1
+        if verbosity > 0:
+            print "Migrated %d subnets and %d network interfaces." % (subnets, interfaces)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from assetmanager import power
+from assetmanager.models import Device
+
+class Command(BaseCommand):
+    args = '<source id> [<source id> ...]'
+    help = "Show what goes dark when the given UPSes or PDUs fail."
+
+    def handle(self, *args, **options):
+        try:
+            failed = [int(arg) for arg in args]
+        except ValueError:
+            failed = []
+        if not failed:
+            raise CommandError('Give the ids of the failing UPSes or PDUs.')
+        result = power.impact(failed)
+        names = dict(Device.objects.filter(pk__in=result['dark'] + result['degraded'] + result['overloaded'])
+                     .values_list('pk', 'name'))
+        for title, key in (('Dark', 'dark'), ('On fewer feeds', 'degraded'), ('Overloaded', 'overloaded')):
+            print '%s: %d' % (title, len(result[key]))
+            for pk in result[key]:
+                print '  %6d %s' % (pk, names.get(pk, ''))
+        for pk, (before, after) in sorted(result['loads'].items()):
+            print 'load %6d: %.0f -> %.0f VA' % (pk, before, after)
@@ -0,0 +1,13 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from assetmanager import storage
+
+class Command(NoArgsCommand):
+    help = "Recompute the raw and usable capacity of every RAID array."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        count = storage.rebuild()
+        if int(options.get('verbosity', 1)) > 0:
+            print "Rebuilt the capacity of %d arrays." % count
@@ -0,0 +1,14 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from assetmanager import placement
+
+class Command(NoArgsCommand):
+    help = "Recompute what the VMs on every server take of its RAM and cores."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        count = placement.rebuild()
+        overcommitted = placement.overcommitted().count()
+        if int(options.get('verbosity', 1)) > 0:
+            print "Rebuilt the load of %d servers, %d have more VM RAM than RAM." % (count, overcommitted)
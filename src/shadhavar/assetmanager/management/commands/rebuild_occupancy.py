@@ -0,0 +1,13 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from assetmanager import occupancy
+
+class Command(NoArgsCommand):
+    help = "Recompute the occupancy index of every rack."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        count = occupancy.rebuild()
+        if int(options.get('verbosity', 1)) > 0:
+            print "Rebuilt occupancy of %d racks." % count
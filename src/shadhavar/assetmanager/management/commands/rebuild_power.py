@@ -0,0 +1,14 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from assetmanager import power
+
+class Command(NoArgsCommand):
+    help = "Recompute the load on every UPS and PDU."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        count = power.rebuild()
+        overloaded = power.overloaded().count()
+        if int(options.get('verbosity', 1)) > 0:
+            print "Rebuilt the load of %d UPSes and PDUs, %d UPSes are overloaded." % (count, overloaded)
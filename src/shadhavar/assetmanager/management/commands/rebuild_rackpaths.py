@@ -0,0 +1,15 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from assetmanager import racktree
+
+class Command(NoArgsCommand):
+    help = "Fill the materialised path of every rack from the rack it is mounted in."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        updated, cycles = racktree.rebuild()
+        if int(options.get('verbosity', 1)) > 0:
+            print "Updated the path of %d racks." % updated
+            if cycles:
+                print "Racks mounted in a loop: %s" % ', '.join(str(pk) for pk in sorted(cycles))
@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+
+from assetmanager import rollups
+
+class Command(NoArgsCommand):
+    help = "Recompute the capacity rollups of every rack, serverroom and datacentre."
+
+    def handle_noargs(self, **options):
+        count = rollups.rebuild()
+        if int(options.get('verbosity', 1)) > 0:
+            print "Rebuilt %d rollups." % count
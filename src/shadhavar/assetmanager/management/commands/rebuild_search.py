@@ -0,0 +1,13 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from assetmanager import search
+
+class Command(NoArgsCommand):
+    help = "Rebuild the inventory search index from scratch."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        count = search.rebuild()
+        if int(options.get('verbosity', 1)) > 0:
+            print "Indexed %d objects." % count
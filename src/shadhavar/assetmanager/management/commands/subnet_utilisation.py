@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from assetmanager import allocation
+from assetmanager.models import SubnetUsage
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--family', dest='family', type='int', default=4,
+                    help='Address family, 4 or 6.'),
+        make_option('--vlan', action='store_true', dest='vlan', default=False,
+                    help='Per VLAN instead of per subnet.'),
+        make_option('--rebuild', action='store_true', dest='rebuild', default=False,
+                    help='Recount the used addresses of every subnet first.'),
+    )
+    help = "Show how many addresses of every subnet or VLAN are used."
+
+    def handle_noargs(self, **options):
+        family = options['family']
+        if options['rebuild']:
+            allocation.mark_stale(SubnetUsage.objects.filter(family=family))
+        if options['vlan']:
+            rows = allocation.vlan_utilisation(family)
+            print '%6s %8s %12s %12s %7s' % ('vlan', 'subnets', 'used', 'size', 'used %')
+        else:
+            rows = allocation.utilisation(family=family)
+            print '%6s %12s %12s %7s' % ('subnet', 'used', 'size', 'used %')
+        for key, row in sorted(rows.items()):
+            if options['vlan']:
+                print '%6s %8d %12d %12d %6.1f%%' % (key, len(row['subnets']), row['used'], row['size'], row['ratio'] * 100)
+            else:
+                print '%6s %12d %12d %6.1f%%' % (key, row['used'], row['size'], row['ratio'] * 100)
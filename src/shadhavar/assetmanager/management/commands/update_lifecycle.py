@@ -0,0 +1,23 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from assetmanager import lifecycle
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--full', action='store_true', dest='full', default=False,
+                    help='Look at every device and disk instead of what changed since the last run.'),
+    )
+    help = "Make today's report of devices and disks reaching their end date soon."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        snapshot = lifecycle.update(full=options.get('full'))
+        if int(options.get('verbosity', 1)) > 0:
+            counts = json.loads(snapshot.report)['counts']
+            for kind in ('device', 'harddisk'):
+                print "%ss ending within %s days: %s" % (kind, ', '.join(str(limit) for limit in lifecycle.BUCKETS),
+                                                        ', '.join(str(counts[kind][str(limit)]) for limit in lifecycle.BUCKETS))
@@ -0,0 +1,13 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from assetmanager import maintenance
+
+class Command(NoArgsCommand):
+    help = "Set the maintainance flag of every device from today's maintenance windows."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        count = maintenance.refresh()
+        if int(options.get('verbosity', 1)) > 0:
+            print "%d devices are under maintenance." % count
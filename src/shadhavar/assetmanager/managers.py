@@ -0,0 +1,112 @@
+from django.db import models
+
+class DeviceQuerySet(models.query.QuerySet):
+    """
+    QuerySet for the Device hierarchy that knows how to turn plain Device
+    rows into instances of their concrete subclass.
+
+    Instead of probing every child table for every row, the rows are
+    handled in chunks and each child table is asked once per chunk which
+    of the primary keys it holds, so resolving N devices costs
+    1 + (N / chunk_size) * len(subclasses) queries.
+    """
+    chunk_size = 1000
+
+    def subclasses(self):
+        return device_subclasses(self.model)
+
+    def typed(self, chunk_size=None):
+        """
+        Yield every object of this queryset as an instance of its concrete
+        Device subclass. Rows without a child row stay plain Devices.
+        """
+        chunk_size = chunk_size or self.chunk_size
+        chunk = []
+        for device in self.iterator():
+            chunk.append(device)
+            if len(chunk) >= chunk_size:
+                for obj in self.downcast(chunk):
+                    yield obj
+                chunk = []
+        for obj in self.downcast(chunk):
+            yield obj
+
+    def downcast(self, devices):
+        """
+        Return the given Device instances as their concrete subclass, in
+        the same order. Issues one query per subclass.
+        """
+        if not devices:
+            return []
+        by_pk = dict((device.pk, device) for device in devices)
+        typed = {}
+        for model in self.subclasses():
+            link = model._meta.get_ancestor_link(self.model)
+            attnames = [f.attname for f in model._meta.local_fields]
+            rows = model._default_manager.using(self.db).filter(**{'%s__in' % link.name: by_pk.keys()}).values(*attnames)
+            for row in rows:
+                device = by_pk[row[link.attname]]
+                typed[device.pk] = _build(model, device, link, row)
+        return [typed.get(device.pk, device) for device in devices]
+
+class SelectRelatedManager(models.Manager):
+    """
+    Manager that always follows the relations listed in `related`, so the
+    __unicode__ chains (device -> rack -> serverroom) don't cost a query per
+    row in listings and FK dropdowns.
+
+    `related` is a class attribute because Django instantiates subclasses of
+    the default manager without arguments for reverse relations.
+    """
+    use_for_related_fields = True
+    related = ()
+
+    def get_query_set(self):
+        qs = super(SelectRelatedManager, self).get_query_set()
+        if self.related:
+            qs = qs.select_related(*self.related)
+        return qs
+
+class RackManager(SelectRelatedManager):
+    related = ('serverroom',)
+
+class RackedDeviceManager(SelectRelatedManager):
+    related = ('rack__serverroom',)
+
+class DevicePartManager(SelectRelatedManager):
+    related = ('parent__rack__serverroom',)
+
+class DeviceManager(RackedDeviceManager):
+    def get_query_set(self):
+        qs = DeviceQuerySet(self.model, using=self._db)
+        return qs.select_related(*self.related)
+
+    def typed(self, chunk_size=None):
+        return self.get_query_set().typed(chunk_size)
+
+    def downcast(self, devices):
+        return self.get_query_set().downcast(devices)
+
+def device_subclasses(model):
+    """
+    The models that inherit directly from model through multi-table
+    inheritance, ordered by name so the query order is stable.
+    """
+    subclasses = [rel.model for rel in model._meta.get_all_related_objects()
+                  if rel.field.rel.parent_link and rel.field.rel.to is model]
+    subclasses.sort(key=lambda m: m._meta.object_name)
+    return subclasses
+
+def _build(model, device, link, row):
+    values = dict((f.attname, device.__dict__[f.attname])
+                  for f in device._meta.fields if f.attname in device.__dict__)
+    values.update(row)
+    obj = model(**values)
+    # keep whatever select_related already fetched for the parent row
+    for key, value in device.__dict__.iteritems():
+        if key.endswith('_cache'):
+            obj.__dict__.setdefault(key, value)
+    setattr(obj, link.get_cache_name(), device)
+    obj._state.db = device._state.db
+    obj._state.adding = False
+    return obj
@@ -0,0 +1,283 @@
+"""
+Request metrics, kept in process and shown in the Prometheus text
+format at /metrics.
+
+MetricsMiddleware times every request and counts it per view. A sample
+of the requests, ASSETMANAGER_METRICS_SAMPLE (0.1) of them, is looked at
+closer: every query it makes is timed through a wrapper around the
+database cursors, and every cache.get() and get_many() is counted as hits
+and misses. From the queries of a sampled request come:
+
+    duplicates      the same statement with the same parameters run
+                    again, which a cache or select_related would save
+    repeats         one statement run with different parameters at least
+                    ASSETMANAGER_METRICS_REPEAT (10) times, the N + 1
+                    pattern of a list rendering a __unicode__ that
+                    follows a foreign key
+
+The statements that repeat are counted per view (at most MAX_STATEMENTS
+of them, cut to STATEMENT_LENGTH characters) so the endpoint shows where
+they come from. Views are labelled by their function, with the model for
+the admin, the generic views and the API.
+
+Everything is per process: every worker of a server has its own
+numbers, which the scraper adds up.
+"""
+
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connections
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERIES = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+MAX_STATEMENTS = 100
+STATEMENT_LENGTH = 200
+PREFIX = 'shadhavar_'
+
+# name -> (type, help, buckets)
+METRICS = {
+    'requests_total': ('counter', 'Requests by view and status code.', None),
+    'request_seconds': ('histogram', 'Wall time of a request.', SECONDS),
+    'sampled_requests_total': ('counter', 'Requests whose queries and cache use were recorded.', None),
+    'request_queries': ('histogram', 'Queries per sampled request.', QUERIES),
+    'request_query_seconds': ('histogram', 'Time spent in queries per sampled request.', SECONDS),
+    'duplicate_queries_total': ('counter', 'Queries of sampled requests that repeated an earlier query exactly.', None),
+    'repeated_query_requests_total': ('counter', 'Sampled requests that ran one statement with different parameters many times.', None),
+    'repeated_statements_total': ('counter', 'Runs of statements that a sampled request repeated many times.', None),
+    'cache_requests_total': ('counter', 'Cache lookups of sampled requests, by result.', None),
+}
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry(object):
+    """
+    Counters and histograms by name and labels.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.values = dict((name, {}) for name in METRICS)
+
+    def inc(self, name, labels, amount=1):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.values[name]
+            values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.values[name]
+            if key not in values:
+                values[key] = Histogram(METRICS[name][2])
+            values[key].observe(value)
+
+    def get(self, name, **labels):
+        return self.values[name].get(tuple(sorted(labels.items())))
+
+    def render(self):
+        """
+        Everything in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for name in sorted(self.values):
+                kind, text, buckets = METRICS[name]
+                lines.append('# HELP %s%s %s' % (PREFIX, name, text))
+                lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+                for key, value in sorted(self.values[name].items()):
+                    if kind == 'counter':
+                        lines.append('%s%s%s %s' % (PREFIX, name, _labels(key), value))
+                        continue
+                    total = 0
+                    for bound, count in zip(list(buckets) + ['+Inf'], value.counts):
+                        total += count
+                        lines.append('%s%s_bucket%s %d' % (PREFIX, name, _labels(key + (('le', str(bound)),)), total))
+                    lines.append('%s%s_sum%s %s' % (PREFIX, name, _labels(key), repr(value.sum)))
+                    lines.append('%s%s_count%s %d' % (PREFIX, name, _labels(key), value.count))
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(key):
+    if not key:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in key)
+
+registry = Registry()
+
+class Sample(object):
+    """
+    The queries and cache lookups of one sampled request.
+    """
+    def __init__(self):
+        self.queries = []
+        self.hits = 0
+        self.misses = 0
+
+class TimedCursor(object):
+    def __init__(self, cursor, sample):
+        self.cursor = cursor
+        self.sample = sample
+
+    def execute(self, sql, params=()):
+        started = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.sample.queries.append((sql, repr(params), time.time() - started))
+
+    def executemany(self, sql, param_list):
+        started = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.sample.queries.append((sql, None, time.time() - started))
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+_local = threading.local()
+_cache_instrumented = set()
+
+def current():
+    return getattr(_local, 'sample', None)
+
+def instrument_cache(cache):
+    """
+    Count the lookups of cache made by sampled requests. Other requests
+    only pay for a lookup of the current sample.
+    """
+    if id(cache) in _cache_instrumented:
+        return
+    _cache_instrumented.add(id(cache))
+    missing = object()
+    get, get_many = cache.get, cache.get_many
+
+    def counted_get(key, default=None):
+        value = get(key, missing)
+        sample = current()
+        if sample is not None:
+            if value is missing:
+                sample.misses += 1
+            else:
+                sample.hits += 1
+        return default if value is missing else value
+
+    def counted_get_many(keys):
+        keys = list(keys)
+        found = get_many(keys)
+        sample = current()
+        if sample is not None:
+            sample.hits += len(found)
+            sample.misses += len(keys) - len(found)
+        return found
+
+    cache.get, cache.get_many = counted_get, counted_get_many
+
+def start():
+    """
+    Record the queries and cache lookups of this thread until stop().
+    """
+    sample = _local.sample = Sample()
+    for connection in connections.all():
+        original = connection.cursor
+        connection.cursor = lambda original=original: TimedCursor(original(), sample)
+    return sample
+
+def stop():
+    sample = current()
+    if sample is not None:
+        for connection in connections.all():
+            connection.__dict__.pop('cursor', None)
+        _local.sample = None
+    return sample
+
+def sampled():
+    return random.random() < getattr(settings, 'ASSETMANAGER_METRICS_SAMPLE', 0.1)
+
+def analyse(queries, repeat):
+    """
+    (number of exact duplicates, {statement: runs} of the statements run
+    at least repeat times) of [(sql, params, seconds)].
+    """
+    exact, statements = {}, {}
+    for sql, params, seconds in queries:
+        if params is not None:
+            exact[(sql, params)] = exact.get((sql, params), 0) + 1
+        statements[sql] = statements.get(sql, 0) + 1
+    duplicates = sum(n - 1 for n in exact.values())
+    return duplicates, dict((sql, n) for sql, n in statements.items() if n >= repeat)
+
+def record(view, status, seconds, sample=None):
+    registry.inc('requests_total', {'view': view, 'status': str(status)})
+    registry.observe('request_seconds', {'view': view}, seconds)
+    if sample is None:
+        return
+    labels = {'view': view}
+    registry.inc('sampled_requests_total', labels)
+    registry.observe('request_queries', labels, len(sample.queries))
+    registry.observe('request_query_seconds', labels, sum(query[2] for query in sample.queries))
+    duplicates, repeated = analyse(sample.queries, getattr(settings, 'ASSETMANAGER_METRICS_REPEAT', 10))
+    if duplicates:
+        registry.inc('duplicate_queries_total', labels, duplicates)
+    if repeated:
+        registry.inc('repeated_query_requests_total', labels)
+        for sql, n in repeated.items():
+            statement = {'view': view, 'statement': sql[:STATEMENT_LENGTH]}
+            if registry.get('repeated_statements_total', **statement) is not None or \
+                    len(registry.values['repeated_statements_total']) < MAX_STATEMENTS:
+                registry.inc('repeated_statements_total', statement, n)
+    if sample.hits:
+        registry.inc('cache_requests_total', {'view': view, 'result': 'hit'}, sample.hits)
+    if sample.misses:
+        registry.inc('cache_requests_total', {'view': view, 'result': 'miss'}, sample.misses)
+
+def undecorated(func):
+    # decorators like condition() that don't copy the name of the view
+    # keep it in their closure as func
+    code = getattr(func, 'func_code', None)
+    while code is not None and 'func' in code.co_freevars and func.__module__.startswith('django.views.decorators.'):
+        func = func.func_closure[code.co_freevars.index('func')].cell_contents
+        code = getattr(func, 'func_code', None)
+    return func
+
+def label(view_func, view_kwargs, path):
+    """
+    The name a view is counted under: module.function, and the model
+    for the admin, the generic views and the API.
+    """
+    view_func = undecorated(view_func)
+    name = '%s.%s' % (getattr(view_func, '__module__', None), getattr(view_func, '__name__', type(view_func).__name__))
+    model = view_kwargs.get('model') or getattr(view_kwargs.get('queryset'), 'model', None)
+    if model is not None:
+        return '%s:%s' % (name, model._meta.object_name.lower())
+    if view_kwargs.get('resource'):
+        from assetmanager.api import RESOURCES
+        return '%s:%s' % (name, view_kwargs['resource'] in RESOURCES and view_kwargs['resource'] or 'unknown')
+    if name.startswith('django.contrib.admin.options.'):
+        parts = path.strip('/').split('/')
+        if len(parts) >= 3:
+            return '%s:%s.%s' % (name, parts[1], parts[2])
+    return name
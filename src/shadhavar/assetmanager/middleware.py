@@ -0,0 +1,46 @@
+import time
+
+from assetmanager import audit, metrics
+
+class AuditMiddleware(object):
+    """
+    Collect the audit log entries of a request, attributed to its user,
+    and write them in one go when the response goes out. A view that
+    raised only gets the entries of what it committed.
+    """
+    def process_request(self, request):
+        user = getattr(request, 'user', None)
+        audit.begin(user.pk if user is not None and user.is_authenticated() else None)
+
+    def process_exception(self, request, exception):
+        audit.end(failed=True)
+
+    def process_response(self, request, response):
+        audit.end()
+        return response
+
+class MetricsMiddleware(object):
+    """
+    Time every request and record the queries and cache lookups of a
+    sample of them, see assetmanager.metrics. Put it first in
+    MIDDLEWARE_CLASSES so the other middleware is measured as well.
+    """
+    def __init__(self):
+        from django.core.cache import cache
+        metrics.instrument_cache(cache)
+
+    def process_request(self, request):
+        request._metrics_started = time.time()
+        request._metrics_view = 'unresolved'
+        if metrics.sampled():
+            metrics.start()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = metrics.label(view_func, view_kwargs, request.path)
+
+    def process_response(self, request, response):
+        sample = metrics.stop()
+        started = getattr(request, '_metrics_started', None)
+        if started is not None:
+            metrics.record(request._metrics_view, response.status_code, time.time() - started, sample)
+        return response
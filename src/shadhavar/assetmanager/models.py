@@ -17,7 +17,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from assetmanager.ipaddr import validate_ipv6
+from assetmanager.managers import DeviceManager, RackManager, RackedDeviceManager, DevicePartManager
 
 class Datacentre(models.Model):
     class Meta:
@@ -65,9 +68,20 @@ class Rack(models.Model):
     serverroom = models.ForeignKey(Serverroom, verbose_name="the room this rack is located")
     rack = models.ForeignKey('self', related_name='parent_rack', verbose_name="the rack this rack is in", blank=True, null=True) # recursive relationship
     comments = models.TextField(blank=True)
+    path = models.CharField(max_length=255, blank=True, editable=False, db_index=True) # '/top/.../self/', see racktree
+
+    objects = RackManager()
+
+    def clean(self):
+        assetmanager.racktree.check(self)
 
     def __unicode__(self):
-        text = u'rack({0},{1})'.format(unicode(self.serverroom), self.row)
+        room = None
+        if not hasattr(self, '_serverroom_cache'):
+            room = assetmanager.locations.name('serverroom', self.serverroom_id)
+        if room is None:
+            room = unicode(self.serverroom)
+        text = u'rack({0},{1})'.format(room, self.row)
         return text
 
 class Device(models.Model):
@@ -78,15 +92,26 @@ class Device(models.Model):
     name = models.CharField(max_length=255)
     height = models.PositiveIntegerField(blank=True, null=True) #in units
     position = models.PositiveIntegerField(blank=True, null=True) # from bottom
-    brand = models.CharField(max_length=255, blank=True)
+    brand = models.CharField(max_length=255, blank=True, db_index=True)
     brandType = models.CharField(max_length=255, blank=True)
     serialnr = models.CharField(max_length=255, blank=True)
-    os = models.CharField(max_length=255, blank=True)
+    os = models.CharField(max_length=255, blank=True, db_index=True)
     startdate = models.DateField(blank=True, null=True)
     enddate = models.DateField(blank=True, null=True) #r.i.p
-    maintainance = models.BooleanField()
+    maintainance = models.BooleanField(editable=False, db_index=True) # derived from the Maintenance windows, see maintenance
+    draw = models.PositiveIntegerField(blank=True, null=True) # nominal, in VA
     comments = models.TextField(blank=True)
 
+    objects = DeviceManager()
+
+    def downcast(self):
+        """
+        Return this device as an instance of its concrete subclass.
+        """
+        if type(self) is not Device:
+            return self
+        return Device.objects.downcast([self])[0]
+
     def __unicode__(self):
         text = u'device({0}, {1}, {2})'.format(unicode(self.rack), self.position, self.os)
         return text
@@ -108,6 +133,8 @@ class Router(Device):
     cpu = models.CharField(max_length=255, blank=True)
     ram = models.PositiveIntegerField(blank=True, null=True) # in megabytes
 
+    objects = RackedDeviceManager()
+
     def __unicode__(self):
         text = u'router({0}, {1}, {2})'.format(unicode(self.rack), self.position, self.os)
         return text
@@ -121,6 +148,7 @@ class Server(Device):
     ram = models.PositiveIntegerField(blank=True, null=True) # in megabytes
     gpu = models.CharField(max_length=255, blank=True)
 
+    objects = RackedDeviceManager()
 
     def __unicode__(self):
         text = u'server({0}, {1}, {2})'.format(unicode(self.rack), self.position, self.os)
@@ -138,6 +166,8 @@ class Switch(Device):
     kind = models.CharField(max_length=1, choices=KIND_CHOICES, blank=True)
     poe = models.BooleanField() #power of ethernet
 
+    objects = RackedDeviceManager()
+
     def __unicode__(self):
         text = u'switch({0}, {1}, {2})'.format(unicode(self.rack), self.position, self.os)
         return text
@@ -156,6 +186,8 @@ class KVM(Device):
     remote = models.CharField(max_length=1, choices=REMOTE_CHOICES)
     maxdevices = models.PositiveIntegerField(blank=True, null=True)
 
+    objects = RackedDeviceManager()
+
     def __unicode__(self):
         text = u'KVM({0}, {1}, {2})'.format(unicode(self.rack), self.position, self.os)
         return text
@@ -182,6 +214,8 @@ class UPS(Device):
     monitoring = models.CharField(max_length=1, choices=MONITORING_CHOICES)
     management = models.CharField(max_length=1, choices=MANAGEMENT_CHOICES)
 
+    objects = RackedDeviceManager()
+
     def __unicode__(self):
         text = u'UPS({0}, {1}, {2})'.format(unicode(self.rack), self.position, self.os)
         return text
@@ -190,6 +224,8 @@ class Other(Device):
 
     functions = models.ManyToManyField(DeviceFunction)
 
+    objects = RackedDeviceManager()
+
     def __unicode__(self):
         text = u'other({0}, {1}, {2})'.format(unicode(self.rack), self.position, self.os)
         return text
@@ -214,6 +250,8 @@ class PDU(Device):
     monitoring = models.CharField(max_length=1, choices=MONITORING_CHOICES)
     management = models.CharField(max_length=1, choices=MANAGEMENT_CHOICES)
 
+    objects = RackedDeviceManager()
+
     def __unicode__(self):
         text = u'PDU({0}, {1}, {2})'.format(unicode(self.rack), self.position, self.os)
         return text
@@ -241,6 +279,8 @@ class DiskArray(Device):
     connection = models.CharField(max_length=1, choices=CONNECTION_CHOICES)
     conntectTo = models.ForeignKey(Server, verbose_name="the server this diskarray is conntected to", blank=True, null=True)
 
+    objects = RackedDeviceManager()
+
 class VM(Device):
     class Meta:
         verbose_name_plural = "VMs"
@@ -251,6 +291,8 @@ class VM(Device):
     cpu = models.CharField(max_length=255, blank=True)
     ram = models.PositiveIntegerField(blank=True, null=True) # in megabytes
 
+    objects = RackedDeviceManager()
+
     def __unicode__(self):
         text = u'VM({0}, {1}, {2})'.format(unicode(self.rack), self.position, self.os)
         return text
@@ -262,9 +304,17 @@ class Subnet(models.Model):
     networkaddr4 = models.IPAddressField(null=True, blank=True)
     subnetaddr4 = models.IPAddressField(null=True, blank=True)
     broadcast4 = models.IPAddressField(null=True, blank=True)
-    networkaddr6 = models.IPAddressField(null=True, blank=True)
-    subnetaddr6 = models.IPAddressField(null=True, blank=True)
-    lastip6 = models.IPAddressField(null=True, blank=True)
+    networkaddr6 = models.CharField(max_length=39, null=True, blank=True, validators=[validate_ipv6])
+    subnetaddr6 = models.CharField(max_length=39, null=True, blank=True) # netmask or prefix length
+    lastip6 = models.CharField(max_length=39, null=True, blank=True, validators=[validate_ipv6])
+
+    # packed copies of the above, maintained by assetmanager.ipam
+    first4 = models.CharField(max_length=8, null=True, blank=True, editable=False, db_index=True)
+    last4 = models.CharField(max_length=8, null=True, blank=True, editable=False, db_index=True)
+    prefixlen4 = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
+    first6 = models.CharField(max_length=32, null=True, blank=True, editable=False, db_index=True)
+    last6 = models.CharField(max_length=32, null=True, blank=True, editable=False, db_index=True)
+    prefixlen6 = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
 
     def __unicode__(self):
         text = 'subnet({0}, {1}, {2}, {3}, {4}, {5})'.format(unicode(self.networkaddr4), unicode(self.subnetaddr4), unicode(self.broadcast4), unicode(self.networkaddr6), unicode(self.subnetaddr6), unicode(self.lastip6))
@@ -288,14 +338,18 @@ class Networkinterface(models.Model):
     kind = models.ForeignKey(NetworkHardInterface, verbose_name="the official type of the hardware port")
     name = models.CharField(max_length=255)
     ip4 = models.IPAddressField(null=True, blank=True)
-    ip6 = models.IPAddressField(null=True, blank=True)
+    ip6 = models.CharField(max_length=39, null=True, blank=True, validators=[validate_ipv6])
     gateway4 = models.IPAddressField(null=True, blank=True)
-    gateway6 = models.IPAddressField(null=True, blank=True)
+    gateway6 = models.CharField(max_length=39, null=True, blank=True, validators=[validate_ipv6])
     mac = models.CharField(max_length=255, blank=True)
-    vlan = models.PositiveIntegerField(null=True) 
+    vlan = models.PositiveIntegerField(null=True, db_index=True)
     management = models.BooleanField() #is this a management port?
     connectedTo = models.ForeignKey('self', related_name='Connected_to', verbose_name="the networkinterface  is connected too", blank=True, null=True) # recursive relationship
 
+    # packed copies of ip4 and ip6, maintained by assetmanager.ipam
+    packed4 = models.CharField(max_length=8, null=True, blank=True, editable=False, db_index=True)
+    packed6 = models.CharField(max_length=32, null=True, blank=True, editable=False, db_index=True)
+
     def __unicode__(self):
         return unicode(self.name)
 
@@ -319,7 +373,7 @@ class RaidArray(models.Model):
 
     name = models.CharField(max_length=255)
     Size = models.FloatField(null=True)
-    raidType = models.CharField(max_length=1, choices=RAID_CHOICES)
+    raidType = models.CharField(max_length=2, choices=RAID_CHOICES)
 
 class Harddisk(models.Model):
     IDE_CHOICES = (
@@ -342,6 +396,8 @@ class Harddisk(models.Model):
     brandType = models.CharField(max_length=255, blank=True)
     serialnr = models.CharField(max_length=255, blank=True)
 
+    objects = DevicePartManager()
+
     def __unicode__(self):
         text = u'Harddisk({0}, {1}, {2})'.format(unicode(self.parent), self.size, self.serialnr)
         return text
@@ -355,6 +411,8 @@ class Partition(models.Model):
     size = models.FloatField(null=True)
     lvm = models.BooleanField()
 
+    objects = DevicePartManager()
+
     def __unicode__(self):
         text = u'Partition({0}, {1})'.format(unicode(self.parent), self.size)
         return text
@@ -363,5 +421,245 @@ class Maintenance(models.Model):
     target = models.ForeignKey(Device, verbose_name="the device under maintenance")
     reason = models.CharField(max_length=255, blank=True)
     scheduled = models.BooleanField()
-    start_date = models.DateField()
-    end_date = models.DateField(blank=True, null=True)
+    start_date = models.DateField(db_index=True)
+    end_date = models.DateField(blank=True, null=True, db_index=True)
+
+class RackOccupancy(models.Model):
+    """
+    The occupied units of a rack, kept up to date by assetmanager.occupancy
+    whenever a rack or a device in it changes.
+    """
+    class Meta:
+        verbose_name_plural = "RackOccupancies"
+
+    rack = models.OneToOneField(Rack, primary_key=True, related_name='occupancy')
+    height = models.PositiveIntegerField()
+    bitmap = models.TextField(blank=True) # hex, bit n is unit n+1 from the bottom
+    used = models.PositiveIntegerField()
+    largest_free = models.PositiveIntegerField(db_index=True) # longest run of free units
+    conflict = models.BooleanField(db_index=True) # overlapping devices or devices sticking out of the rack
+
+    def __unicode__(self):
+        return u'occupancy({0}, {1}/{2})'.format(self.rack_id, self.used, self.height)
+
+class Rollup(models.Model):
+    """
+    A materialised total of one metric for a rack, serverroom or
+    datacentre, kept up to date by assetmanager.rollups.
+    """
+    SCOPE_CHOICES = (
+        ('rack', 'rack'),
+        ('serverroom', 'serverroom'),
+        ('datacentre', 'datacentre'),
+    )
+
+    class Meta:
+        verbose_name_plural = "Rollups"
+        unique_together = (('scope', 'scope_id', 'metric'),)
+
+    scope = models.CharField(max_length=10, choices=SCOPE_CHOICES)
+    scope_id = models.PositiveIntegerField()
+    metric = models.CharField(max_length=32)
+    value = models.FloatField(default=0)
+
+    def __unicode__(self):
+        return u'rollup({0}, {1}, {2}={3})'.format(self.scope, self.scope_id, self.metric, self.value)
+
+class SearchEntry(models.Model):
+    """
+    The words of one searchable object and the facets it is counted under,
+    kept up to date by assetmanager.search.
+    """
+    class Meta:
+        verbose_name_plural = "SearchEntries"
+        unique_together = (('kind', 'object_id'),)
+
+    kind = models.CharField(max_length=32) # model of the indexed object
+    object_id = models.PositiveIntegerField()
+    label = models.CharField(max_length=255)
+    text = models.TextField()
+    type = models.CharField(max_length=32, db_index=True) # concrete device type, or the model
+    device_id = models.PositiveIntegerField(null=True, db_index=True)
+    rack_id = models.PositiveIntegerField(null=True, db_index=True)
+    serverroom_id = models.PositiveIntegerField(null=True, db_index=True)
+    datacentre_id = models.PositiveIntegerField(null=True, db_index=True)
+    os = models.CharField(max_length=255, blank=True, db_index=True)
+
+    def __unicode__(self):
+        return u'search({0}, {1})'.format(self.kind, self.object_id)
+
+class Change(models.Model):
+    """
+    One entry of the append-only audit log written by assetmanager.audit.
+    Only the changed fields are kept, see audit.encode for the format.
+    """
+    ACTION_CHOICES = (
+        ('c', 'created'),
+        ('u', 'updated'),
+        ('d', 'deleted'),
+    )
+
+    class Meta:
+        verbose_name_plural = "Changes"
+
+    content_type = models.ForeignKey(ContentType) # all device types log as Device
+    object_id = models.PositiveIntegerField()
+    action = models.CharField(max_length=1, choices=ACTION_CHOICES)
+    timestamp = models.DateTimeField(db_index=True)
+    user_id = models.PositiveIntegerField(null=True, blank=True) # no foreign key, the log outlives users
+    rack_id = models.PositiveIntegerField(null=True, blank=True, db_index=True) # rack a device left with this change
+    diff = models.TextField(blank=True)
+
+    def __unicode__(self):
+        return u'change({0}, {1}, {2}, {3})'.format(self.content_type_id, self.object_id, self.action, self.timestamp)
+
+class ArrayCapacity(models.Model):
+    """
+    The capacity of a RAID array derived from its disks and level, kept up
+    to date by assetmanager.storage whenever one of them changes.
+    """
+    class Meta:
+        verbose_name_plural = "ArrayCapacities"
+
+    array = models.OneToOneField(RaidArray, primary_key=True, related_name='capacity')
+    device = models.ForeignKey(Device, null=True, related_name='array_capacities') # holding most of the disks
+    server = models.ForeignKey(Server, null=True, related_name='storage') # the device, or the server a DiskArray is connected to
+    disks = models.PositiveIntegerField(default=0)
+    raw = models.FloatField(default=0) # in gigabytes, like Harddisk.size
+    usable = models.FloatField(default=0)
+    valid = models.BooleanField() # enough disks for the level
+
+    def __unicode__(self):
+        return u'capacity({0}, {1}/{2})'.format(self.array_id, self.usable, self.raw)
+
+class HostLoad(models.Model):
+    """
+    What the VMs on a server take of its RAM and cores, kept up to date
+    by assetmanager.placement whenever the server or one of its VMs
+    changes.
+    """
+    class Meta:
+        verbose_name_plural = "HostLoads"
+
+    server = models.OneToOneField(Server, primary_key=True, related_name='load')
+    ram = models.PositiveIntegerField(default=0) # of the server, in megabytes
+    cores = models.PositiveIntegerField(default=0) # of the server, 0 if its cpu doesn't say
+    vms = models.PositiveIntegerField(default=0)
+    vm_ram = models.PositiveIntegerField(default=0)
+    vm_cores = models.PositiveIntegerField(default=0)
+    free_ram = models.IntegerField(default=0, db_index=True) # ram - vm_ram, negative when overcommitted
+
+    def __unicode__(self):
+        return u'load({0}, {1}/{2})'.format(self.server_id, self.vm_ram, self.ram)
+
+class LifecycleReport(models.Model):
+    """
+    A snapshot of what reaches its end date soon, made by
+    assetmanager.lifecycle. state holds the entries the next run starts
+    from, report the JSON the lifecycle view serves.
+    """
+    class Meta:
+        verbose_name_plural = "LifecycleReports"
+
+    day = models.DateField(db_index=True)
+    generated = models.DateTimeField()
+    horizon = models.PositiveIntegerField() # days
+    last_change = models.PositiveIntegerField() # the last audit Change taken into account
+    state = models.TextField()
+    report = models.TextField()
+
+    def __unicode__(self):
+        return u'lifecycle({0}, {1})'.format(self.day, self.horizon)
+
+class SubnetUsage(models.Model):
+    """
+    The used addresses of one address family of a subnet: those of its
+    interfaces and the reserved ones. Kept by assetmanager.allocation,
+    which also hands out the free ones.
+    """
+    class Meta:
+        verbose_name_plural = "SubnetUsages"
+        unique_together = (('subnet', 'family'),)
+
+    subnet = models.ForeignKey(Subnet, related_name='usage')
+    family = models.PositiveSmallIntegerField() # 4 or 6
+    size = models.FloatField() # host addresses, a /64 doesn't fit an integer
+    used = models.PositiveIntegerField(default=0)
+    bitmap = models.TextField(blank=True) # hex, bit n is the n-th host address; empty for large subnets
+    hint = models.CharField(max_length=32, blank=True) # packed, the last address handed out
+    generation = models.PositiveIntegerField(default=0) # bumped by every change, for optimistic updates
+    stale = models.BooleanField() # to be rebuilt on its next use
+
+    def __unicode__(self):
+        return u'usage({0}, IPv{1}, {2}/{3})'.format(self.subnet_id, self.family, self.used, self.size)
+
+class AddressReservation(models.Model):
+    """
+    An address handed out by assetmanager.allocation, taken until it is
+    released.
+    """
+    class Meta:
+        verbose_name_plural = "AddressReservations"
+        unique_together = (('family', 'packed'),)
+
+    subnet = models.ForeignKey(Subnet, related_name='reservations')
+    family = models.PositiveSmallIntegerField() # 4 or 6
+    packed = models.CharField(max_length=32) # see assetmanager.ipaddr
+    address = models.CharField(max_length=39)
+    created = models.DateTimeField()
+    note = models.CharField(max_length=255, blank=True)
+
+    def __unicode__(self):
+        return unicode(self.address)
+
+class PowerConnection(models.Model):
+    """
+    A power input of a device plugged into an outlet of a UPS or PDU.
+    """
+    class Meta:
+        verbose_name_plural = "PowerConnections"
+        unique_together = (('source', 'outlet'),)
+
+    device = models.ForeignKey(Device, related_name='power_inputs')
+    source = models.ForeignKey(Device, related_name='power_outputs', verbose_name="the UPS or PDU feeding the device")
+    outlet = models.PositiveIntegerField(blank=True, null=True) # from 1
+
+    def clean(self):
+        assetmanager.power.validate(self)
+
+    def __unicode__(self):
+        return u'power({0} -> {1}:{2})'.format(self.source_id, self.device_id, self.outlet)
+
+class PowerLoad(models.Model):
+    """
+    What a UPS or PDU delivers: the draw of the devices plugged into it
+    and everything downstream of them, kept up to date by
+    assetmanager.power.
+    """
+    class Meta:
+        verbose_name_plural = "PowerLoads"
+
+    source = models.OneToOneField(Device, primary_key=True, related_name='power_load')
+    connections = models.PositiveIntegerField(default=0)
+    load = models.FloatField(default=0, db_index=True) # in VA
+    capacity = models.FloatField(null=True) # in VA, of a UPS
+
+    def __unicode__(self):
+        return u'load({0}, {1}/{2})'.format(self.source_id, self.load, self.capacity)
+
+# the index modules connect their signal handlers to the models above
+import assetmanager.occupancy
+import assetmanager.ipam
+import assetmanager.topology
+import assetmanager.rollups
+import assetmanager.locations
+import assetmanager.racktree
+import assetmanager.search
+import assetmanager.audit
+import assetmanager.maintenance
+import assetmanager.api
+import assetmanager.placement
+import assetmanager.storage
+import assetmanager.allocation
+import assetmanager.counts
+import assetmanager.power
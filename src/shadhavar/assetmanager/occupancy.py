@@ -0,0 +1,236 @@
+"""
+Rack occupancy index.
+
+Every rack has a RackOccupancy row holding a bitmap of its occupied units
+and a few numbers derived from it (units used, longest free run, whether
+devices overlap). The row of a rack is recomputed from that rack's devices
+only, whenever the rack or one of its devices is saved or deleted, so
+capacity questions about a whole room never have to load the devices.
+"""
+
+from django.db.models import Sum, Count
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from assetmanager.models import Rack, Device, RackOccupancy
+from assetmanager import snapshot
+from assetmanager.signals import bulk_inserted
+
+def build(height, placements):
+    """
+    Return (bitmap, conflict) for a rack of the given height holding
+    devices at the given (position, height) pairs. Positions count from 1
+    at the bottom; devices without a position or height take no space.
+    """
+    bitmap = 0
+    conflict = False
+    for position, size in placements:
+        if not position or not size:
+            continue
+        top = position + size - 1
+        if position < 1 or top > height:
+            conflict = True
+        low, top = max(position, 1), min(top, height)
+        if top < low:
+            continue
+        mask = ((1 << (top - low + 1)) - 1) << (low - 1)
+        if bitmap & mask:
+            conflict = True
+        bitmap |= mask
+    return bitmap, conflict
+
+def free_runs(bitmap, height):
+    """
+    Yield (position, length) for every run of free units, bottom up.
+    """
+    start = None
+    for unit in xrange(1, height + 1):
+        if bitmap >> (unit - 1) & 1:
+            if start is not None:
+                yield start, unit - start
+                start = None
+        elif start is None:
+            start = unit
+    if start is not None:
+        yield start, height + 1 - start
+
+def decode(occupancy):
+    return int(occupancy.bitmap or '0', 16)
+
+RETRIES = 50
+
+def _values(height, bitmap, conflict):
+    return dict(height=height, bitmap='%x' % bitmap, used=bin(bitmap).count('1'), conflict=conflict,
+                largest_free=max([length for position, length in free_runs(bitmap, height)] or [0]))
+
+def _store(rack_id, height, bitmap, conflict, create=True):
+    values = _values(height, bitmap, conflict)
+    if not RackOccupancy.objects.filter(rack=rack_id).update(**values) and create:
+        RackOccupancy.objects.create(rack_id=rack_id, **values)
+    return values
+
+def update_rack(rack_id, create=True):
+    """
+    Recompute the occupancy of a single rack from its devices. Without
+    create a missing occupancy row is left alone; it only goes missing
+    while the rack itself is being deleted.
+    """
+    try:
+        height = Rack.objects.filter(pk=rack_id).values_list('height', flat=True)[0]
+    except IndexError:
+        return None # the rack is being deleted
+    placements = Device.objects.filter(rack=rack_id).values_list('position', 'height')
+    bitmap, conflict = build(height, placements)
+    return _store(rack_id, height, bitmap, conflict, create)
+
+def add_device(rack_id, position, size):
+    """
+    Mark the units of a newly placed device as used without looking at the
+    other devices of the rack. The row is only written if it is still as
+    it was read; if another device was placed in between, it is read again.
+    """
+    for attempt in range(RETRIES):
+        rows = RackOccupancy.objects.filter(rack=rack_id).values_list('height', 'bitmap', 'conflict')
+        if not rows:
+            break
+        height, stored, conflict = rows[0]
+        bitmap, overlap = build(height, [(position, size)])
+        current = int(stored or '0', 16)
+        values = _values(height, current | bitmap, conflict or overlap or bool(current & bitmap))
+        if RackOccupancy.objects.filter(rack=rack_id, height=height, bitmap=stored, conflict=conflict).update(**values):
+            return values
+    return update_rack(rack_id)
+
+def rebuild(racks=None):
+    """
+    Recompute the occupancy of the given racks, or of every rack.
+    """
+    if racks is None:
+        racks = Rack.objects.values_list('pk', flat=True)
+    count = 0
+    for rack_id in racks:
+        update_rack(getattr(rack_id, 'pk', rack_id))
+        count += 1
+    return count
+
+def _scoped(qs, serverroom=None, datacentre=None):
+    if serverroom is not None:
+        qs = qs.filter(rack__serverroom=serverroom)
+    if datacentre is not None:
+        qs = qs.filter(rack__serverroom__datacentre=datacentre)
+    return qs
+
+def free_slots(size, serverroom=None, datacentre=None):
+    """
+    Yield (rack_id, position, length) for every free run of at least size
+    units, optionally limited to a serverroom or datacentre. Racks without
+    such a run are filtered out by the database.
+    """
+    qs = _scoped(RackOccupancy.objects.filter(largest_free__gte=size), serverroom, datacentre)
+    for rack_id, bitmap, height in qs.order_by('rack').values_list('rack', 'bitmap', 'height'):
+        for position, length in free_runs(int(bitmap or '0', 16), height):
+            if length >= size:
+                yield rack_id, position, length
+
+def find_slot(size, serverroom=None, datacentre=None):
+    """
+    Return (rack_id, position) of the smallest free run that fits size
+    units, or None when nothing fits.
+    """
+    best = None
+    for rack_id, position, length in free_slots(size, serverroom, datacentre):
+        if best is None or length < best[2]:
+            best = (rack_id, position, length)
+            if length == size:
+                break
+    return best and best[:2]
+
+def is_free(rack, position, size):
+    """
+    Whether units position .. position + size - 1 of the rack are free.
+    """
+    occupancy = RackOccupancy.objects.get(rack=rack)
+    if position < 1 or position + size - 1 > occupancy.height:
+        return False
+    mask = ((1 << size) - 1) << (position - 1)
+    return not decode(occupancy) & mask
+
+def conflicting_racks(serverroom=None, datacentre=None):
+    return _scoped(RackOccupancy.objects.filter(conflict=True), serverroom, datacentre).values_list('rack', flat=True)
+
+def overlapping_devices(rack):
+    """
+    Return (device_id, device_id) pairs of the devices in the rack that
+    share units, plus (device_id, None) for devices sticking out of it.
+    """
+    height = Rack.objects.filter(pk=getattr(rack, 'pk', rack)).values_list('height', flat=True)[0]
+    devices = Device.objects.filter(rack=rack, position__isnull=False, height__gt=0)
+    devices = sorted(devices.values_list('position', 'height', 'pk'))
+    pairs = []
+    for i, (position, size, pk) in enumerate(devices):
+        top = position + size - 1
+        if position < 1 or top > height:
+            pairs.append((pk, None))
+        for other_position, other_size, other_pk in devices[i + 1:]:
+            if other_position > top:
+                break
+            pairs.append((pk, other_pk))
+    return pairs
+
+def utilisation(serverroom=None, datacentre=None):
+    """
+    Return {rack_id: (used, height)}.
+    """
+    qs = _scoped(RackOccupancy.objects.all(), serverroom, datacentre)
+    return dict((rack_id, (used, height)) for rack_id, used, height in qs.values_list('rack', 'used', 'height'))
+
+def _rollup(qs, key):
+    totals = qs.values(key).annotate(used=Sum('used'), height=Sum('height'), racks=Count('rack')).order_by(key)
+    return dict((row[key], (row['used'], row['height'], row['racks'])) for row in totals)
+
+def row_utilisation(serverroom):
+    """
+    Return {row: (used, height, racks)} for the racks of a serverroom.
+    """
+    return _rollup(_scoped(RackOccupancy.objects.all(), serverroom), 'rack__row')
+
+def room_utilisation(datacentre=None):
+    """
+    Return {serverroom_id: (used, height, racks)}.
+    """
+    return _rollup(_scoped(RackOccupancy.objects.all(), datacentre=datacentre), 'rack__serverroom')
+
+def rack_saved(sender, instance, **kwargs):
+    update_rack(instance.pk)
+
+def device_pre_save(sender, instance, **kwargs):
+    instance._occupancy_old = None
+    old = snapshot.stored(sender, instance) or snapshot.stored(Device, instance)
+    if old:
+        instance._occupancy_old = (old['rack_id'], old['position'], old['height'])
+
+def device_saved(sender, instance, **kwargs):
+    old = getattr(instance, '_occupancy_old', None)
+    if old == (instance.rack_id, instance.position, instance.height):
+        return
+    if old is None:
+        add_device(instance.rack_id, instance.position, instance.height)
+        return
+    update_rack(instance.rack_id)
+    if old[0] != instance.rack_id:
+        update_rack(old[0])
+
+def device_deleted(sender, instance, **kwargs):
+    update_rack(instance.rack_id, create=False)
+
+def devices_inserted(sender, pks, **kwargs):
+    racks = set()
+    for i in range(0, len(pks), 500):
+        racks.update(Device.objects.filter(pk__in=pks[i:i + 500]).values_list('rack', flat=True))
+    rebuild(racks)
+
+post_save.connect(rack_saved, sender=Rack)
+for model in [Device] + Device.__subclasses__():
+    pre_save.connect(device_pre_save, sender=model)
+    post_save.connect(device_saved, sender=model)
+    post_delete.connect(device_deleted, sender=model)
+bulk_inserted.connect(devices_inserted, sender=Device)
@@ -0,0 +1,261 @@
+"""
+VM placement: how loaded every VM host is and where a VM fits best.
+
+Every server has a HostLoad row with its RAM and cores and the totals of
+the VMs running on it, recomputed for the servers involved whenever a
+server or VM is created or deleted, or changes its RAM, cpu or host. Cores are read from the free text cpu
+field: '8', '8 cores', '2x Xeon E5620 (8 cores)' or '4 vCPU'. A server
+whose cpu doesn't say is not limited on cores, a VM whose cpu doesn't
+say counts as one.
+
+Planning loads the HostLoad rows of a datacentre (or of everything) once
+into arrays of free RAM and cores, with the hosts sorted on free RAM,
+kept until a host changes in any process sharing the cache (only until
+the next request without a shared cache, see assetmanager.caches).
+Hosts are scored best fit: the host left with the least RAM after
+placing the VM comes first, found by bisecting the sorted hosts. A host
+is evacuated by placing its VMs largest first on the best fitting other
+host. Hosts under maintenance and hosts without RAM are never picked.
+The RAM and cores of a host may be overcommitted by the settings
+ASSETMANAGER_RAM_OVERCOMMIT (1.0) and ASSETMANAGER_CPU_OVERCOMMIT (4.0).
+"""
+
+import re
+from array import array
+from bisect import bisect_left, insort
+from datetime import date
+from itertools import islice
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from assetmanager.models import Device, HostLoad, Maintenance, Server, VM
+from assetmanager import caches, snapshot
+from assetmanager.bulk import insert
+from assetmanager.signals import bulk_inserted
+
+GENERATION_KEY = 'assetmanager.placement.generation'
+GENERATION_TIMEOUT = 30 * 24 * 3600
+UNLIMITED = 2 ** 31 - 1
+CHUNK_SIZE = 500
+
+_plans = {}
+
+CORES = re.compile(r'(\d+)\s*(?:-\s*)?(?:v?cpus?|cores?|threads?)\b', re.I)
+NUMBER = re.compile(r'^\s*(\d+)\s*$')
+
+def cores(text):
+    """
+    The number of cores in a cpu description, 0 if it doesn't say.
+    """
+    found = CORES.search(text or '') or NUMBER.match(text or '')
+    return found and int(found.group(1)) or 0
+
+def vm_cores(text):
+    return cores(text) or 1
+
+def refresh(server_ids):
+    """
+    Recompute the HostLoad rows of the given servers.
+    """
+    server_ids = sorted(set(pk for pk in server_ids if pk is not None))
+    for chunk in [server_ids[i:i + CHUNK_SIZE] for i in range(0, len(server_ids), CHUNK_SIZE)]:
+        loads = dict((pk, [ram or 0, cores(cpu), 0, 0, 0]) for pk, ram, cpu in
+                     Server.objects.filter(pk__in=chunk).values_list('pk', 'ram', 'cpu'))
+        for server, ram, cpu in VM.objects.filter(server__in=loads.keys()).values_list('server', 'ram', 'cpu'):
+            load = loads[server]
+            load[2] += 1
+            load[3] += ram or 0
+            load[4] += vm_cores(cpu)
+        HostLoad.objects.filter(pk__in=[pk for pk in chunk if pk not in loads]).delete()
+        stored = set(HostLoad.objects.filter(pk__in=loads.keys()).values_list('pk', flat=True))
+        new = []
+        for pk, (ram, server_cores, vms, vm_ram, used_cores) in loads.items():
+            values = dict(ram=ram, cores=server_cores, vms=vms, vm_ram=vm_ram, vm_cores=used_cores, free_ram=ram - vm_ram)
+            if pk in stored:
+                HostLoad.objects.filter(pk=pk).update(**values)
+            else:
+                values['server_id'] = pk
+                new.append(values)
+        insert(connection.cursor(), HostLoad, new)
+    transaction.commit_unless_managed()
+    invalidate()
+
+def rebuild():
+    """
+    Recompute the HostLoad row of every server.
+    """
+    HostLoad.objects.all().delete()
+    refresh(Server.objects.values_list('pk', flat=True))
+    return HostLoad.objects.count()
+
+def overcommitted():
+    """
+    The HostLoad rows of the servers whose VMs have more RAM than they do.
+    """
+    return HostLoad.objects.filter(free_ram__lt=0)
+
+class Placement(object):
+    """
+    The free RAM and cores of a set of hosts, to plan VM placements on.
+    Placing VMs only changes these arrays, never the database.
+    """
+    def __init__(self, rows, ram_ratio=1.0, cpu_ratio=4.0):
+        self.hosts = array('l')
+        self.free_ram = array('l')
+        self.free_cores = array('l')
+        self.order = []
+        for server, ram, server_cores, vm_ram, used_cores, maintenance in rows:
+            i = len(self.hosts)
+            self.hosts.append(server)
+            self.free_ram.append(int(ram * ram_ratio) - vm_ram)
+            self.free_cores.append(int(server_cores * cpu_ratio) - used_cores if server_cores else UNLIMITED)
+            if ram and not maintenance:
+                self.order.append((self.free_ram[i], i))
+        self.order.sort()
+        self.index = dict((host, i) for i, host in enumerate(self.hosts))
+
+    @classmethod
+    def load(cls, datacentre=None):
+        loads = HostLoad.objects.filter(ram__gt=0)
+        if datacentre is not None:
+            loads = loads.filter(server__rack__serverroom__datacentre=datacentre)
+        rows = loads.order_by('pk').values_list('server', 'ram', 'cores', 'vm_ram', 'vm_cores', 'server__maintainance')
+        return cls(rows.iterator(), getattr(settings, 'ASSETMANAGER_RAM_OVERCOMMIT', 1.0),
+                   getattr(settings, 'ASSETMANAGER_CPU_OVERCOMMIT', 4.0))
+
+    def copy(self):
+        other = Placement(())
+        other.hosts, other.index = self.hosts, self.index
+        other.free_ram, other.free_cores = array('l', self.free_ram), array('l', self.free_cores)
+        other.order = list(self.order)
+        return other
+
+    def best(self, ram, cores=1, n=5, exclude=()):
+        """
+        The n hosts a VM with ram megabytes and cores cores fits on best,
+        as [(host, free ram after, free cores after)].
+        """
+        exclude = set(self.index[host] for host in exclude if host in self.index)
+        result = []
+        for free, i in islice(self.order, bisect_left(self.order, (ram, -1)), None):
+            if self.free_cores[i] >= cores and i not in exclude:
+                left = self.free_cores[i] if self.free_cores[i] == UNLIMITED else self.free_cores[i] - cores
+                result.append((self.hosts[i], free - ram, left))
+                if len(result) == n:
+                    break
+        return result
+
+    def take(self, host, ram, cores=1):
+        """
+        Plan a VM with ram megabytes and cores cores on host.
+        """
+        i = self.index[host]
+        entry = (self.free_ram[i], i)
+        position = bisect_left(self.order, entry)
+        planned = position < len(self.order) and self.order[position] == entry
+        if planned:
+            del self.order[position]
+        self.free_ram[i] -= ram
+        if self.free_cores[i] != UNLIMITED:
+            self.free_cores[i] -= cores
+        if planned:
+            insort(self.order, (self.free_ram[i], i))
+
+    def evacuate(self, host):
+        """
+        Plan moving every VM off host: ([(vm, new host)], [vm that fits
+        nowhere]). The placement itself is left as it was.
+        """
+        plan = self.copy()
+        vms = VM.objects.filter(server=host).values_list('pk', 'ram', 'cpu')
+        moves, unplaced = [], []
+        for ram, needed, pk in sorted(((ram or 0, vm_cores(cpu), pk) for pk, ram, cpu in vms), reverse=True):
+            found = plan.best(ram, needed, 1, exclude=(host,))
+            if found:
+                plan.take(found[0][0], ram, needed)
+                moves.append((pk, found[0][0]))
+            else:
+                unplaced.append(pk)
+        return moves, unplaced
+
+def generation():
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        cache.add(GENERATION_KEY, uuid4().hex, GENERATION_TIMEOUT)
+        current = cache.get(GENERATION_KEY)
+    return current
+
+def invalidate(**kwargs):
+    """
+    Drop every loaded placement, in every process sharing the cache.
+    """
+    cache.set(GENERATION_KEY, uuid4().hex, GENERATION_TIMEOUT)
+    _plans.clear()
+
+def placement(datacentre=None):
+    """
+    The placement of a datacentre (or of everything), loaded once and
+    reused until a host, a VM or a maintenance window changes. The day is
+    part of the key as the maintainance flags change with it.
+    """
+    key = (datacentre, date.today())
+    current = generation()
+    cached = _plans.get(key)
+    if cached is None or cached[0] != current:
+        cached = _plans[key] = (current, Placement.load(datacentre))
+    return cached[1]
+
+def best_hosts(ram, cores=1, n=5, datacentre=None):
+    return placement(datacentre).best(ram, cores, n)
+
+def evacuate(host, datacentre=None):
+    return placement(datacentre).evacuate(getattr(host, 'pk', host))
+
+def vm_pre_save(sender, instance, raw, **kwargs):
+    instance._placement_old = None if raw else snapshot.stored(VM, instance)
+
+def vm_saved(sender, instance, **kwargs):
+    old = getattr(instance, '_placement_old', None)
+    if old is None:
+        refresh([instance.server_id])
+    elif (old['server_id'], old['ram'], old['cpu']) != (instance.server_id, instance.ram, instance.cpu):
+        refresh([instance.server_id, old['server_id']])
+
+def vm_deleted(sender, instance, **kwargs):
+    refresh([instance.server_id])
+
+def server_pre_save(sender, instance, **kwargs):
+    instance._placement_old = snapshot.stored(Server, instance)
+    if instance._placement_old is None:
+        old = snapshot.stored(Device, instance)
+        instance._placement_old = old and dict(old, ram=None, cpu=None)
+
+def server_changed(sender, instance, **kwargs):
+    old = getattr(instance, '_placement_old', None)
+    if old is None or (old['ram'], old['cpu']) != (instance.ram, instance.cpu):
+        refresh([instance.pk])
+    elif old['rack_id'] != instance.rack_id:
+        # plans per datacentre
+        invalidate()
+
+def inserted(sender, pks, **kwargs):
+    if sender is VM:
+        pks = [server for i in range(0, len(pks), CHUNK_SIZE)
+               for server in VM.objects.filter(pk__in=pks[i:i + CHUNK_SIZE]).values_list('server', flat=True)]
+    refresh(pks)
+
+pre_save.connect(vm_pre_save, sender=VM)
+post_save.connect(vm_saved, sender=VM)
+post_delete.connect(vm_deleted, sender=VM)
+pre_save.connect(server_pre_save, sender=Server)
+post_save.connect(server_changed, sender=Server)
+post_delete.connect(invalidate, sender=Server) # its HostLoad row goes with it
+bulk_inserted.connect(inserted, sender=VM)
+bulk_inserted.connect(inserted, sender=Server)
+post_save.connect(invalidate, sender=Maintenance)
+post_delete.connect(invalidate, sender=Maintenance)
+caches.per_request(invalidate)
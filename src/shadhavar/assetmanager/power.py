@@ -0,0 +1,398 @@
+"""
+The power chain: which outlet of which UPS or PDU every device is
+plugged into, what each source delivers, and what goes dark when one
+fails.
+
+A device's nominal draw (Device.draw) is split evenly over its power
+inputs, so a server with two power supplies on an A and a B feed puts
+half on each. A source delivers the share of everything plugged into it,
+and a PDU or UPS that is itself plugged into something passes its own
+draw plus everything it delivers up the chain. Every UPS and PDU has a
+PowerLoad row with that total, recomputed whenever a connection, a draw
+or a source changes: first for the sources involved, then level by level
+for the sources feeding those whose load changed, at most MAX_DEPTH
+levels up. Loads per rack, serverroom and datacentre are the draw rollup
+of assetmanager.rollups.
+
+Failure impact is answered by an in-memory graph of every connection,
+built from one query and kept per process until a connection, a draw or
+a capacity changes anywhere, like assetmanager.placement; without a cache
+shared by the processes (see assetmanager.caches) only until the next
+request starts. A source
+without inputs is taken to be on the mains. Only the devices downstream
+of the failed sources and the sources upstream of those are looked at,
+so the answer costs what the failure touches rather than the size of
+the room.
+"""
+
+import threading
+from collections import deque
+from uuid import uuid4
+from weakref import WeakValueDictionary
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+
+from assetmanager.models import Device, PDU, PowerConnection, PowerLoad, UPS
+from assetmanager import caches, snapshot
+from assetmanager.bulk import insert
+from assetmanager.signals import bulk_inserted
+
+GENERATION_KEY = 'assetmanager.power.generation'
+GENERATION_TIMEOUT = 30 * 24 * 3600
+CHUNK_SIZE = 500
+MAX_DEPTH = 16
+
+_chain = {}
+_state = threading.local()
+
+def chunks(values):
+    values = sorted(set(value for value in values if value is not None))
+    for i in range(0, len(values), CHUNK_SIZE):
+        yield values[i:i + CHUNK_SIZE]
+
+def is_source(pk):
+    return UPS.objects.filter(pk=pk).exists() or PDU.objects.filter(pk=pk).exists()
+
+def upstream(device_id, limit=MAX_DEPTH):
+    """
+    The sources device is fed by, at any depth up to limit levels.
+    """
+    found, level = set(), set([device_id])
+    for i in range(limit):
+        level = set(PowerConnection.objects.filter(device__in=level).values_list('source', flat=True)) - found
+        if not level:
+            break
+        found |= level
+    return found
+
+def validate(power):
+    """
+    Refuse a connection to something that isn't a UPS or PDU, to an
+    outlet the PDU doesn't have, or one that would make the device feed
+    itself.
+    """
+    if power.device_id is None or power.source_id is None:
+        return
+    if not is_source(power.source_id):
+        raise ValidationError(u'Devices can only be plugged into a UPS or a PDU.')
+    if power.outlet is not None:
+        outlets = PDU.objects.filter(pk=power.source_id).values_list('ammount', flat=True)
+        if outlets and (power.outlet < 1 or power.outlet > outlets[0]):
+            raise ValidationError(u'This PDU has outlets 1 to %d.' % outlets[0])
+    if power.source_id == power.device_id or power.device_id in upstream(power.source_id):
+        raise ValidationError(u'A device cannot be plugged into itself or into a source it feeds.')
+
+def _loads(chunk):
+    """
+    {source: (connections, load, capacity)} of the sources in chunk, from
+    the stored loads of the sources plugged into them.
+    """
+    capacities = dict(UPS.objects.filter(pk__in=chunk).values_list('pk', 'power'))
+    sources = set(capacities) | set(PDU.objects.filter(pk__in=chunk).values_list('pk', flat=True))
+    plugged = PowerConnection.objects.filter(source__in=sources).values_list('source', 'device', 'device__draw')
+    devices = set(row[1] for row in plugged)
+    inputs, below = {}, {}
+    for part in chunks(devices):
+        for row in PowerConnection.objects.filter(device__in=part).values('device').annotate(n=Count('pk')).order_by():
+            inputs[row['device']] = row['n']
+        below.update(PowerLoad.objects.filter(pk__in=part).values_list('pk', 'load'))
+    loads = dict((pk, [0, 0.0]) for pk in sources)
+    for source, device, draw in plugged:
+        loads[source][0] += 1
+        loads[source][1] += ((draw or 0) + below.get(device, 0.0)) / inputs[device]
+    return dict((pk, (n, load, capacities.get(pk))) for pk, (n, load) in loads.items())
+
+def deleting():
+    """
+    The devices this thread is deleting, {pk: instance}. An entry goes
+    with the post_delete of its device, or with the instance when the
+    delete failed half way.
+    """
+    if not hasattr(_state, 'deleting'):
+        _state.deleting = WeakValueDictionary()
+    return _state.deleting
+
+def refresh(source_ids):
+    """
+    Recompute the PowerLoad rows of the given sources and of the sources
+    upstream of those whose load changed.
+    """
+    pending = set(source_ids) - set(deleting())
+    for level in range(MAX_DEPTH):
+        changed = set()
+        for chunk in chunks(pending):
+            loads = _loads(chunk)
+            PowerLoad.objects.filter(pk__in=[pk for pk in chunk if pk not in loads]).delete()
+            stored = dict((row[0], row[1:]) for row in
+                          PowerLoad.objects.filter(pk__in=loads.keys()).values_list('pk', 'connections', 'load', 'capacity'))
+            new = []
+            for pk, (connections, load, capacity) in loads.items():
+                values = dict(connections=connections, load=load, capacity=capacity)
+                if pk not in stored:
+                    values['source_id'] = pk
+                    new.append(values)
+                elif stored[pk] != (connections, load, capacity):
+                    PowerLoad.objects.filter(pk=pk).update(**values)
+                if abs(load - (pk in stored and stored[pk][1] or 0.0)) > 1e-9:
+                    changed.add(pk)
+            if new:
+                insert(connection.cursor(), PowerLoad, new)
+        pending = set()
+        for chunk in chunks(changed):
+            pending.update(PowerConnection.objects.filter(device__in=chunk).values_list('source', flat=True))
+        pending -= set(deleting())
+        if not pending:
+            break
+    transaction.commit_unless_managed()
+    invalidate()
+
+def rebuild():
+    """
+    Recompute the PowerLoad row of every UPS and PDU.
+    """
+    PowerLoad.objects.all().delete()
+    refresh(list(UPS.objects.values_list('pk', flat=True)) + list(PDU.objects.values_list('pk', flat=True)))
+    return PowerLoad.objects.count()
+
+def compute():
+    """
+    {source: (connections, load, capacity)} of every UPS and PDU, from
+    scratch.
+    """
+    chain = PowerChain.load()
+    return dict((pk, (len(chain.outputs.get(pk, ())), chain.loads.get(pk, 0.0), chain.capacity.get(pk)))
+                for pk in chain.sources)
+
+def check(tolerance=1e-6):
+    """
+    [(source, stored, computed)] for every UPS and PDU whose stored load
+    differs from a fresh computation, both as (connections, load,
+    capacity).
+    """
+    fresh = compute()
+    current = dict((row[0], row[1:]) for row in PowerLoad.objects.values_list('pk', 'connections', 'load', 'capacity'))
+    problems = []
+    for pk in sorted(set(fresh) | set(current)):
+        a, b = current.get(pk), fresh.get(pk)
+        if a is None or b is None or a[0] != b[0] or a[2] != b[2] or abs(a[1] - b[1]) > tolerance:
+            problems.append((pk, a, b))
+    return problems
+
+def loads(ids=None):
+    """
+    {source: (connections, load, capacity)} as stored, optionally only
+    for ids.
+    """
+    rows = PowerLoad.objects.all()
+    if ids is not None:
+        rows = rows.filter(pk__in=[getattr(obj, 'pk', obj) for obj in ids])
+    return dict((row[0], row[1:]) for row in rows.values_list('pk', 'connections', 'load', 'capacity').iterator())
+
+def overloaded():
+    """
+    The PowerLoad rows of the UPSes delivering more than they are rated
+    for.
+    """
+    return PowerLoad.objects.filter(load__gt=F('capacity'))
+
+class PowerChain(object):
+    """
+    Devices are the nodes, every connection an edge from a source to the
+    device plugged into it. A device plugged in twice into one source has
+    two edges.
+    """
+    def __init__(self):
+        self.inputs = {} # device -> [source], one per connection
+        self.outputs = {} # source -> [device], one per connection
+        self.draw = {}
+        self.capacity = {}
+        self.sources = set()
+        self.loads = {}
+
+    @classmethod
+    def load(cls):
+        chain = cls()
+        for device, source, draw in PowerConnection.objects.values_list('device', 'source', 'device__draw').iterator():
+            chain.inputs.setdefault(device, []).append(source)
+            chain.outputs.setdefault(source, []).append(device)
+            chain.draw[device] = draw or 0
+        chain.capacity = dict(UPS.objects.values_list('pk', 'power').iterator())
+        chain.sources = set(chain.capacity) | set(PDU.objects.values_list('pk', flat=True).iterator())
+        chain.loads = chain.compute(chain.sources)
+        return chain
+
+    def order(self, sources):
+        """
+        The given sources, every one after the sources it feeds.
+        """
+        order, seen = [], set()
+        for start in sources:
+            if start in seen:
+                continue
+            seen.add(start)
+            stack = [(start, iter(self.outputs.get(start, ())))]
+            while stack:
+                for child in stack[-1][1]:
+                    if child in sources and child not in seen:
+                        seen.add(child)
+                        stack.append((child, iter(self.outputs.get(child, ()))))
+                        break
+                else:
+                    order.append(stack.pop()[0])
+        return order
+
+    def compute(self, sources, live=None, dark=()):
+        """
+        {source: load} of the given sources, taking the load of any other
+        source from self.loads. live maps devices to their powered inputs
+        where they aren't all powered, dark devices draw nothing.
+        """
+        live = live or {}
+        loads = {}
+        for source in self.order(sources):
+            total = 0.0
+            if source not in dark:
+                for device in self.outputs.get(source, ()):
+                    if device not in dark:
+                        below = loads.get(device, self.loads.get(device, 0.0))
+                        total += (self.draw.get(device, 0) + below) / live.get(device, len(self.inputs[device]))
+            loads[source] = total
+        return loads
+
+    def impact(self, failed):
+        """
+        What failing the given sources does: {'dark': devices left without
+        power, 'degraded': devices that lost some of their inputs,
+        'loads': {source: (load before, load after)} of the sources whose
+        load changes, 'overloaded': sources delivering more than their
+        capacity afterwards}.
+        """
+        failed = set(failed)
+        dark, live = set(failed), {}
+        queue = deque(failed)
+        while queue:
+            for device in self.outputs.get(queue.popleft(), ()):
+                live[device] = live.get(device, len(self.inputs[device])) - 1
+                if not live[device] and device not in dark:
+                    dark.add(device)
+                    queue.append(device)
+        degraded = set(device for device in live if device not in dark)
+        affected = set(source for source in dark if source in self.sources)
+        stack = list(dark | degraded)
+        while stack:
+            for source in self.inputs.get(stack.pop(), ()):
+                if source not in affected:
+                    affected.add(source)
+                    stack.append(source)
+        after = self.compute(affected, live, dark)
+        changed = dict((pk, (self.loads.get(pk, 0.0), load)) for pk, load in after.items()
+                       if abs(load - self.loads.get(pk, 0.0)) > 1e-9)
+        return {
+            'dark': sorted(dark - failed),
+            'degraded': sorted(degraded),
+            'loads': changed,
+            'overloaded': sorted(pk for pk, load in after.items()
+                                 if self.capacity.get(pk) is not None and load > self.capacity[pk]),
+        }
+
+def generation():
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        cache.add(GENERATION_KEY, uuid4().hex, GENERATION_TIMEOUT)
+        current = cache.get(GENERATION_KEY)
+    return current
+
+def invalidate(**kwargs):
+    """
+    Drop the loaded power chain, in every process sharing the cache.
+    """
+    cache.set(GENERATION_KEY, uuid4().hex, GENERATION_TIMEOUT)
+    _chain.clear()
+
+def chain():
+    """
+    The power chain, loaded once and reused until a connection, a draw or
+    a capacity changes.
+    """
+    current = generation()
+    if _chain.get('generation') != current:
+        _chain.update(generation=current, chain=PowerChain.load())
+    return _chain['chain']
+
+def impact(failed):
+    """
+    What goes dark if the given UPSes or PDUs (one or a list, objects or
+    primary keys) fail, see PowerChain.impact.
+    """
+    if not isinstance(failed, (list, tuple, set)):
+        failed = [failed]
+    return chain().impact(getattr(source, 'pk', source) for source in failed)
+
+def sources_of(device_ids):
+    return PowerConnection.objects.filter(device__in=[pk for pk in device_ids if pk is not None]).values_list('source', flat=True)
+
+def connection_pre_save(sender, instance, raw, **kwargs):
+    instance._power_old = None
+    if instance.pk is not None and not raw:
+        old = PowerConnection.objects.filter(pk=instance.pk).values_list('device', 'source')
+        instance._power_old = old and old[0] or None
+
+def connection_saved(sender, instance, **kwargs):
+    # the other inputs of the device carry a different share now
+    device, source = getattr(instance, '_power_old', None) or (None, None)
+    refresh([instance.source_id, source] + list(sources_of([instance.device_id, device])))
+
+def connection_deleted(sender, instance, **kwargs):
+    if instance.device_id in deleting() or instance.source_id in deleting():
+        return
+    refresh([instance.source_id] + list(sources_of([instance.device_id])))
+
+def device_pre_save(sender, instance, raw, **kwargs):
+    old = snapshot.stored(sender, instance) or snapshot.stored(Device, instance)
+    instance._power_draw = old and old['draw']
+
+def device_saved(sender, instance, **kwargs):
+    pks = []
+    if sender in (UPS, PDU):
+        pks.append(instance.pk)
+    if instance.draw != getattr(instance, '_power_draw', None):
+        pks.extend(sources_of([instance.pk]))
+    if pks:
+        refresh(pks)
+
+def device_pre_delete(sender, instance, **kwargs):
+    # The cascade deletes the connections one by one; the sources of the
+    # device and of the devices it feeds are refreshed once it is done.
+    deleting()[instance.pk] = instance
+    fed = PowerConnection.objects.filter(source=instance.pk).values_list('device', flat=True)
+    instance._power_sources = list(sources_of([instance.pk] + list(fed)))
+
+def device_deleted(sender, instance, **kwargs):
+    deleting().pop(instance.pk, None)
+    refresh(getattr(instance, '_power_sources', ()))
+
+def inserted(sender, pks, **kwargs):
+    if sender is PowerConnection:
+        for chunk in chunks(pks):
+            devices = PowerConnection.objects.filter(pk__in=chunk).values_list('device', flat=True)
+            refresh(list(PowerConnection.objects.filter(pk__in=chunk).values_list('source', flat=True)) +
+                    list(sources_of(set(devices))))
+    else:
+        refresh(pks)
+
+pre_save.connect(connection_pre_save, sender=PowerConnection)
+post_save.connect(connection_saved, sender=PowerConnection)
+post_delete.connect(connection_deleted, sender=PowerConnection)
+for model in [Device] + Device.__subclasses__():
+    pre_save.connect(device_pre_save, sender=model)
+    post_save.connect(device_saved, sender=model)
+pre_delete.connect(device_pre_delete, sender=Device)
+post_delete.connect(device_deleted, sender=Device)
+bulk_inserted.connect(inserted, sender=PowerConnection)
+bulk_inserted.connect(inserted, sender=UPS)
+bulk_inserted.connect(inserted, sender=PDU)
+caches.per_request(invalidate)
@@ -0,0 +1,143 @@
+"""
+Materialised paths for racks mounted in racks (blade chassis and the like).
+
+Every rack stores the ids from its top-level rack down to itself as
+'/1/5/9/' in Rack.path, so the racks below a rack are a single prefix
+match on an indexed column and the racks above it can be read straight
+off the path. The paths are kept up to date on save; a rack moved to
+another parent takes its whole subtree with it. `manage.py
+rebuild_rackpaths` fills them for existing databases.
+"""
+
+from django.core.exceptions import ValidationError
+from django.db.models.signals import pre_save, post_save
+
+from assetmanager.models import Rack, Device
+
+def segment(pk):
+    return '/%d/' % pk
+
+def ids(path):
+    """
+    The rack ids on a path, top-level rack first.
+    """
+    return [int(id) for id in path.strip('/').split('/') if id]
+
+def path_of(rack_id):
+    """
+    The stored path of a rack, or, if it has none yet, the path worked out
+    by walking up its parents until one that has.
+    """
+    chain = []
+    prefix = '/'
+    current = rack_id
+    while current is not None:
+        if current in chain:
+            raise ValidationError(u'Rack %d is mounted in itself.' % current)
+        parent, path = Rack.objects.filter(pk=current).values_list('rack', 'path')[0]
+        if path:
+            prefix = path
+            break
+        chain.append(current)
+        current = parent
+    return prefix + ''.join('%d/' % id for id in reversed(chain))
+
+def _path(rack):
+    return rack.path or path_of(rack.pk)
+
+def check(rack):
+    """
+    Refuse a parent that would mount the rack inside itself.
+    """
+    if rack.rack_id is None:
+        return
+    if rack.pk is not None and (rack.rack_id == rack.pk or segment(rack.pk) in path_of(rack.rack_id)):
+        raise ValidationError(u'A rack cannot be mounted in itself or in a rack inside it.')
+
+def subtree(rack, include_self=True):
+    """
+    The racks inside rack, at any depth.
+    """
+    racks = Rack.objects.filter(path__startswith=_path(rack))
+    if not include_self:
+        racks = racks.exclude(pk=rack.pk)
+    return racks
+
+def ancestors(rack):
+    """
+    The racks rack is mounted in, nearest first.
+    """
+    above = ids(_path(rack))[:-1]
+    by_pk = Rack.objects.in_bulk(above)
+    return [by_pk[pk] for pk in reversed(above) if pk in by_pk]
+
+def top(rack):
+    return ids(_path(rack))[0]
+
+def devices(rack):
+    """
+    Every device in rack or in a rack inside it.
+    """
+    return Device.objects.filter(rack__path__startswith=_path(rack))
+
+def rebuild(racks=None):
+    """
+    Recompute the stored paths from the parent links. Returns the number of
+    racks updated and the ids of racks found mounted in a loop, which are
+    given a path that stops where the loop closes.
+    """
+    parents = dict(Rack.objects.values_list('pk', 'rack'))
+    stored = dict(Rack.objects.values_list('pk', 'path'))
+    updated = 0
+    cycles = []
+    for pk in (racks if racks is not None else parents):
+        chain = []
+        seen = set()
+        current = pk
+        while current is not None and current not in seen:
+            seen.add(current)
+            chain.append(current)
+            current = parents.get(current)
+        if current is not None:
+            cycles.append(pk)
+        path = '/' + ''.join('%d/' % id for id in reversed(chain))
+        if stored.get(pk) != path:
+            Rack.objects.filter(pk=pk).update(path=path)
+            updated += 1
+    return updated, cycles
+
+def _own_path(rack):
+    prefix = path_of(rack.rack_id) if rack.rack_id is not None else '/'
+    return prefix + '%d/' % rack.pk
+
+def rack_pre_save(sender, instance, raw, **kwargs):
+    instance._racktree_old = None
+    if instance.pk is None:
+        return
+    if raw:
+        # fixtures may hold a rack before the one it is mounted in, those
+        # are left for rebuild_rackpaths
+        try:
+            instance.path = _own_path(instance)
+        except (IndexError, ValidationError):
+            instance.path = ''
+        return
+    check(instance)
+    old = Rack.objects.filter(pk=instance.pk).values_list('path', flat=True)
+    instance._racktree_old = old[0] if old else None
+    instance.path = _own_path(instance)
+
+def rack_saved(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if not instance.path:
+        instance.path = _own_path(instance)
+        Rack.objects.filter(pk=instance.pk).update(path=instance.path)
+    old = instance._racktree_old
+    if old and old != instance.path:
+        below = Rack.objects.filter(path__startswith=old).exclude(pk=instance.pk).values_list('pk', 'path')
+        for pk, path in list(below):
+            Rack.objects.filter(pk=pk).update(path=instance.path + path[len(old):])
+
+pre_save.connect(rack_pre_save, sender=Rack)
+post_save.connect(rack_saved, sender=Rack)
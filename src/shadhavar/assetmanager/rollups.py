@@ -0,0 +1,300 @@
+"""
+Materialised capacity totals per rack, serverroom and datacentre.
+
+The Rollup table holds one row per (scope, id, metric). Saving or deleting
+a device or hard disk adds the difference it makes to the rows of its
+rack, room and datacentre, so reading the totals never touches the device
+tables. rebuild() recomputes everything with one aggregate query per
+model and check() compares the stored totals with a fresh computation.
+
+Metrics:
+    devices             number of devices
+    draw                nominal power draw of devices, in VA
+    count.<type>        number of devices of each Device subclass
+    ram                 RAM of servers and routers, in megabytes
+    vm_ram              RAM of virtual machines, in megabytes
+    ups_va              UPS power, in VA
+    pdu_outlets         PDU outlets
+    disks, disk         number and size (gigabytes) of hard disks
+"""
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+
+from assetmanager.models import *
+from assetmanager import snapshot
+from assetmanager.signals import bulk_inserted
+
+SCOPES = ('rack', 'serverroom', 'datacentre')
+
+def _specs():
+    # model -> (lookup of its rack, {metric: field to sum, None to count})
+    specs = {
+        Device: ('rack', {'devices': None, 'draw': 'draw'}),
+        Harddisk: ('parent__rack', {'disks': None, 'disk': 'size'}),
+    }
+    summed = {
+        Router: {'ram': 'ram'},
+        Server: {'ram': 'ram'},
+        VM: {'vm_ram': 'ram'},
+        UPS: {'ups_va': 'power'},
+        PDU: {'pdu_outlets': 'ammount'},
+    }
+    for model in Device.__subclasses__():
+        metrics = {'count.%s' % model._meta.object_name.lower(): None}
+        metrics.update(summed.get(model, {}))
+        specs[model] = ('rack', metrics)
+    return specs
+
+SPECS = _specs()
+
+def contributions(model, values):
+    """
+    What one object of model adds to the totals, values holding its fields.
+    """
+    totals = {}
+    for metric, field in SPECS[model][1].items():
+        totals[metric] = field is None and 1 or (values.get(field) or 0)
+    return totals
+
+def locate(rack_id):
+    """
+    Return [(scope, id), ...] for a rack, its serverroom and datacentre.
+    """
+    if rack_id is None:
+        return []
+    rows = Rack.objects.filter(pk=rack_id).values_list('serverroom', 'serverroom__datacentre')
+    if not rows:
+        return []
+    room, datacentre = rows[0]
+    return [('rack', rack_id), ('serverroom', room), ('datacentre', datacentre)]
+
+def apply(location, totals, sign=1):
+    """
+    Add totals (times sign) to the rows of every scope in location. Rows
+    are only created for positive amounts, so subtracting from a scope
+    that is being deleted can't leave rows behind.
+    """
+    for scope, scope_id in location:
+        for metric, value in totals.items():
+            value = value * sign
+            if not value:
+                continue
+            rows = Rollup.objects.filter(scope=scope, scope_id=scope_id, metric=metric)
+            if not rows.update(value=F('value') + value) and value > 0:
+                Rollup.objects.create(scope=scope, scope_id=scope_id, metric=metric, value=value)
+
+def _fields(model):
+    return [field for field in SPECS[model][1].values() if field]
+
+def _merge(*parts):
+    totals = {}
+    for part in parts:
+        for metric, value in part.items():
+            totals[metric] = totals.get(metric, 0) + value
+    return totals
+
+def _rack_of(model, obj):
+    if model is Harddisk:
+        if obj.parent_id is None:
+            return None
+        return Device.objects.filter(pk=obj.parent_id).values_list('rack', flat=True)[0]
+    return obj.rack_id
+
+def _values(model, obj):
+    return dict((field, getattr(obj, field)) for field in _fields(model))
+
+def _state(model, obj):
+    """
+    (rack id, contributions) of obj as model, including what it adds as a
+    Device when model is a Device subclass.
+    """
+    totals = contributions(model, _values(model, obj))
+    if model not in (Device, Harddisk):
+        totals = _merge(totals, contributions(Device, _values(Device, obj)))
+    return _rack_of(model, obj), totals
+
+def _stored_state(model, instance):
+    """
+    (rack id, contributions) of the stored row, None if there is none. A
+    subclass row is often saved after its Device row (fixtures, raw saves),
+    in which case only the Device part counts as stored.
+    """
+    if model is Harddisk:
+        rows = Harddisk.objects.filter(pk=instance.pk).values('parent__rack', *_fields(Harddisk))
+        return rows and (rows[0]['parent__rack'], contributions(Harddisk, rows[0])) or None
+    row = snapshot.stored(model, instance)
+    if row is None:
+        if model is not Device:
+            return _stored_state(Device, instance)
+        return None
+    totals = contributions(model, row)
+    if model is not Device:
+        totals = _merge(totals, contributions(Device, row))
+    return row['rack_id'], totals
+
+def pre_save_handler(sender, instance, raw=False, **kwargs):
+    instance._rollup_old = instance.pk is not None and _stored_state(sender, instance) or None
+
+def post_save_handler(sender, instance, raw=False, **kwargs):
+    old = getattr(instance, '_rollup_old', None)
+    if raw and sender not in (Device, Harddisk):
+        # a raw save of a subclass row (loaddata) knows nothing of its Device part
+        instance = sender._default_manager.get(pk=instance.pk)
+    rack_id, totals = _state(sender, instance)
+    if old is not None and sender is Device and old[0] != rack_id:
+        # when a plain Device save changes the location whatever its
+        # subclass row adds has to move as well
+        typed = instance.downcast()
+        if type(typed) is not Device:
+            typed_totals = _state(type(typed), typed)[1]
+            old = (old[0], _merge(typed_totals, dict((k, -v) for k, v in totals.items()), old[1]))
+            totals = typed_totals
+    if old is not None and old[0] == rack_id:
+        apply(locate(rack_id), _merge(totals, dict((k, -v) for k, v in old[1].items())))
+        return
+    if old is not None:
+        apply(locate(old[0]), old[1], -1)
+        if sender is not Harddisk:
+            # the disks of the device moved along with it
+            disks = aggregate(Harddisk, Harddisk.objects.filter(parent=instance.pk)).get(rack_id, {})
+            totals = _merge(totals, disks)
+            apply(locate(old[0]), disks, -1)
+    apply(locate(rack_id), totals)
+
+def pre_delete_handler(sender, instance, **kwargs):
+    # Deleting a device sends a signal for its subclass and for Device, so
+    # each only takes back its own part. Everything is looked up before
+    # the cascade removes the rows it depends on.
+    values = dict((field, getattr(instance, field)) for field in _fields(sender))
+    instance._rollup_old = (locate(_rack_of(sender, instance)), contributions(sender, values))
+
+def post_delete_handler(sender, instance, **kwargs):
+    location, totals = instance._rollup_old
+    apply(location, totals, -1)
+
+def location_pre_save(sender, instance, **kwargs):
+    old = snapshot.stored(sender, instance)
+    instance._rollup_parent = old and old[sender is Rack and 'serverroom_id' or 'datacentre_id']
+
+def location_saved(sender, instance, **kwargs):
+    """
+    Move the totals of a rack or serverroom that moved to another room or
+    datacentre.
+    """
+    old = getattr(instance, '_rollup_parent', None)
+    if sender is Rack:
+        new, scope = instance.serverroom_id, 'rack'
+    else:
+        new, scope = instance.datacentre_id, 'serverroom'
+    if old is None or old == new:
+        return
+    totals = dict(Rollup.objects.filter(scope=scope, scope_id=instance.pk).values_list('metric', 'value'))
+    apply(_parents(sender, old), totals, -1)
+    apply(_parents(sender, new), totals)
+
+def _parents(sender, parent_id):
+    if sender is Rack:
+        datacentre = Serverroom.objects.filter(pk=parent_id).values_list('datacentre', flat=True)[0]
+        return [('serverroom', parent_id), ('datacentre', datacentre)]
+    return [('datacentre', parent_id)]
+
+def location_deleted(sender, instance, **kwargs):
+    Rollup.objects.filter(scope=sender._meta.object_name.lower(), scope_id=instance.pk).delete()
+
+def aggregate(model, qs=None):
+    """
+    Return {rack id: {metric: total}} for the objects of model in qs.
+    """
+    rack_lookup, metrics = SPECS[model]
+    if qs is None:
+        qs = model._default_manager.all()
+    annotations = {}
+    for metric, field in metrics.items():
+        annotations[metric] = field is None and Count('pk') or Sum(field)
+    rows = qs.filter(**{rack_lookup + '__isnull': False}).values(rack_lookup).annotate(**annotations).order_by()
+    totals = {}
+    for row in rows:
+        rack_id = row.pop(rack_lookup)
+        totals[rack_id] = dict((metric, value or 0) for metric, value in row.items())
+    return totals
+
+def compute():
+    """
+    Compute every total from scratch: {(scope, id, metric): value}.
+    """
+    racks = dict((pk, (room, datacentre)) for pk, room, datacentre in
+                 Rack.objects.values_list('pk', 'serverroom', 'serverroom__datacentre'))
+    totals = {}
+    for model in SPECS:
+        for rack_id, metrics in aggregate(model).items():
+            room, datacentre = racks[rack_id]
+            for scope, scope_id in (('rack', rack_id), ('serverroom', room), ('datacentre', datacentre)):
+                for metric, value in metrics.items():
+                    key = (scope, scope_id, metric)
+                    totals[key] = totals.get(key, 0) + value
+    return totals
+
+def stored():
+    return dict(((scope, scope_id, metric), value) for scope, scope_id, metric, value in
+                Rollup.objects.values_list('scope', 'scope_id', 'metric', 'value').iterator())
+
+@transaction.commit_on_success
+def rebuild():
+    """
+    Replace every stored total with a fresh computation.
+    """
+    totals = compute()
+    Rollup.objects.all().delete()
+    for (scope, scope_id, metric), value in totals.iteritems():
+        if value:
+            Rollup.objects.create(scope=scope, scope_id=scope_id, metric=metric, value=value)
+    return len(totals)
+
+def check(tolerance=1e-6):
+    """
+    Return [(scope, id, metric, stored, computed)] for every total that
+    differs from a fresh computation.
+    """
+    fresh, current = compute(), stored()
+    problems = []
+    for key in sorted(set(fresh) | set(current)):
+        if abs(fresh.get(key, 0) - current.get(key, 0)) > tolerance:
+            problems.append(key + (current.get(key), fresh.get(key)))
+    return problems
+
+def rollup(scope, obj):
+    """
+    The totals of one rack, serverroom or datacentre: {metric: value}.
+    """
+    return dict(Rollup.objects.filter(scope=scope, scope_id=getattr(obj, 'pk', obj)).values_list('metric', 'value'))
+
+def rollups(scope, ids=None):
+    """
+    The totals of many racks, serverrooms or datacentres: {id: {metric: value}}.
+    """
+    qs = Rollup.objects.filter(scope=scope)
+    if ids is not None:
+        qs = qs.filter(scope_id__in=[getattr(obj, 'pk', obj) for obj in ids])
+    totals = {}
+    for scope_id, metric, value in qs.values_list('scope_id', 'metric', 'value').iterator():
+        totals.setdefault(scope_id, {})[metric] = value
+    return totals
+
+def inserted(sender, pks, **kwargs):
+    for i in range(0, len(pks), 500):
+        for rack_id, totals in aggregate(sender, sender._default_manager.filter(pk__in=pks[i:i + 500])).items():
+            apply(locate(rack_id), totals)
+
+for model in SPECS:
+    pre_save.connect(pre_save_handler, sender=model)
+    post_save.connect(post_save_handler, sender=model)
+    pre_delete.connect(pre_delete_handler, sender=model)
+    post_delete.connect(post_delete_handler, sender=model)
+    bulk_inserted.connect(inserted, sender=model)
+for model in (Rack, Serverroom):
+    pre_save.connect(location_pre_save, sender=model)
+    post_save.connect(location_saved, sender=model)
+for model in (Rack, Serverroom, Datacentre):
+    post_delete.connect(location_deleted, sender=model)
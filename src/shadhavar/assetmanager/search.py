@@ -0,0 +1,418 @@
+"""
+Inventory search over every device type, network interface, hard disk and
+device function.
+
+Every searchable object has one SearchEntry row holding its words and the
+facets it is counted under: type, datacentre, serverroom and os. The rows
+are kept up to date by the signal handlers below and matched with the
+full text index of the database, an FTS4 table on SQLite and a GIN index
+on PostgreSQL, both created by the files in assetmanager/sql. Other
+databases, and SQLite builds without FTS4, fall back to an inverted index
+each process holds in memory. Writes then log the entries they touch in
+a ring of CHANGE_SLOTS cache keys, and each process re-reads just those;
+it loads everything again after a rebuild or when it has fallen more
+than the ring behind.
+
+Every word of a query matches as a prefix and all of them must match.
+Separators are dropped, so '00:1a:2b' finds a MAC address and 'web01'
+finds 'web-01'.
+"""
+
+import heapq
+import re
+from array import array
+from bisect import bisect_left, insort
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, models
+from django.db.models import Count
+from django.db.models.signals import post_save, post_delete
+
+from assetmanager import locations
+from assetmanager.bulk import insert
+from assetmanager.models import Device, DeviceFunction, Networkinterface, Harddisk, Rack, Serverroom, SearchEntry
+from assetmanager.signals import bulk_inserted
+
+FACETS = {'type': 'type', 'datacentre': 'datacentre_id', 'serverroom': 'serverroom_id', 'os': 'os'}
+HIT_FIELDS = ('id', 'kind', 'object_id', 'label', 'type', 'device_id', 'rack_id', 'serverroom_id', 'datacentre_id', 'os')
+FTS_TABLE = 'assetmanager_searchentry_fts'
+GENERATION_KEY = 'assetmanager.search.generation'
+GENERATION_TIMEOUT = 30 * 24 * 3600
+CHANGES_KEY = 'assetmanager.search.changes.%s'
+CHANGE_KEY = 'assetmanager.search.change.%s.%d'
+CHANGE_SLOTS = 100
+
+_separators = re.compile(r'[\W_]+', re.UNICODE)
+
+def words(value):
+    """
+    The words of a field value: its alphanumeric runs and, when there is
+    more than one, all of them run together.
+    """
+    parts = [part for part in _separators.split(unicode(value).lower()) if part]
+    if len(parts) > 1:
+        parts.append(u''.join(parts))
+    return parts
+
+def terms(query):
+    """
+    The prefixes a query matches: each whitespace separated part with its
+    separators dropped.
+    """
+    result = []
+    for part in query.split():
+        term = u''.join(_separators.split(part.lower()))
+        if term and term not in result:
+            result.append(term)
+    return result
+
+def text_fields(model):
+    return [f.attname for f in model._meta.fields
+            if isinstance(f, (models.CharField, models.TextField, models.IPAddressField))
+            and f.editable and not f.choices]
+
+def document(obj):
+    seen = set()
+    result = []
+    for attname in text_fields(type(obj)):
+        value = getattr(obj, attname)
+        if value:
+            for word in words(value):
+                if word not in seen:
+                    seen.add(word)
+                    result.append(word)
+    return u' '.join(result)
+
+def place(rack_id):
+    """
+    The (serverroom, datacentre) of a rack, from the location tree.
+    """
+    tree = locations.tree()
+    rack = tree.node((locations.RACK, rack_id))
+    if rack is None:
+        return None, None
+    room = tree.node((locations.SERVERROOM, rack['serverroom']))
+    return rack['serverroom'], room and room['parent'][1]
+
+def entry(obj, device=None):
+    """
+    The SearchEntry fields for obj. device holds the rack_id and os of the
+    device obj belongs to, when obj is not a device itself.
+    """
+    values = {'object_id': obj.pk, 'text': document(obj), 'os': ''}
+    if isinstance(obj, Device):
+        values.update(kind='device', type=obj._meta.object_name.lower(), label=obj.name,
+                      device_id=obj.pk, rack_id=obj.rack_id, os=obj.os)
+    else:
+        values.update(kind=obj._meta.object_name.lower(), type=obj._meta.object_name.lower(),
+                      label=unicode(getattr(obj, 'name', '') or getattr(obj, 'serialnr', '') or obj.pk))
+        if device is not None:
+            values.update(device_id=device['id'], rack_id=device['rack'], os=device['os'])
+    values['serverroom_id'], values['datacentre_id'] = place(values.get('rack_id'))
+    return values
+
+def owner(obj):
+    if isinstance(obj, Networkinterface):
+        return obj.device_id
+    if isinstance(obj, Harddisk):
+        return obj.parent_id
+
+def devices(ids):
+    return dict((row['id'], row) for row in Device.objects.filter(pk__in=list(ids)).values('id', 'rack', 'os'))
+
+def store(values):
+    found = SearchEntry.objects.filter(kind=values['kind'], object_id=values['object_id'])
+    if not found.update(**values):
+        SearchEntry.objects.create(**values)
+    entries_changed(values['kind'], [values['object_id']])
+
+def remove(kind, pk):
+    SearchEntry.objects.filter(kind=kind, object_id=pk).delete()
+    entries_changed(kind, [pk])
+
+def index(obj):
+    device = None
+    if owner(obj) is not None:
+        device = devices([owner(obj)]).get(owner(obj))
+    store(entry(obj, device))
+
+def index_bulk(model, pks, chunk_size=500):
+    """
+    Index the objects of model with the given primary keys, a chunk at a
+    time with one delete and one executemany insert per chunk.
+    """
+    kind = 'device' if issubclass(model, Device) else model._meta.object_name.lower()
+    cursor = connection.cursor()
+    for i in range(0, len(pks), chunk_size):
+        chunk = pks[i:i + chunk_size]
+        objs = list(model._default_manager.filter(pk__in=chunk))
+        owners = devices(set(owner(obj) for obj in objs) - set([None]))
+        SearchEntry.objects.filter(kind=kind, object_id__in=[obj.pk for obj in objs]).delete()
+        insert(cursor, SearchEntry, [entry(obj, owners.get(owner(obj))) for obj in objs], pk=False)
+        entries_changed(kind, list(chunk))
+
+def rebuild():
+    """
+    Index everything from scratch. Returns the number of entries.
+    """
+    SearchEntry.objects.all().delete()
+    plain = set(Device.objects.values_list('pk', flat=True))
+    for model in Device.objects.all().subclasses():
+        pks = list(model._default_manager.values_list('pk', flat=True))
+        plain.difference_update(pks)
+        index_bulk(model, pks)
+    for model in (Device, Networkinterface, Harddisk, DeviceFunction):
+        pks = sorted(plain) if model is Device else list(model._default_manager.values_list('pk', flat=True))
+        index_bulk(model, pks)
+    changed()
+    return SearchEntry.objects.count()
+
+class SQLEngine(object):
+    """
+    Matches with a WHERE clause on SearchEntry and counts the facets with
+    GROUP BY, all in the database. Subclasses give the where clause and
+    the match method that turns the terms into its parameter.
+    """
+    def search(self, terms, filters, limit):
+        entries = SearchEntry.objects.filter(**filters).extra(where=[self.where], params=[self.match(terms)])
+        # one GROUP BY over every facet at once, split up per facet below
+        facets = dict((facet, {}) for facet in FACETS)
+        for row in entries.values(*FACETS.values()).annotate(count=Count('id')).order_by():
+            for facet, column in FACETS.items():
+                facets[facet][row[column]] = facets[facet].get(row[column], 0) + row['count']
+        hits = list(entries.order_by('label', 'id').values(*HIT_FIELDS)[:limit])
+        return sum(facets['type'].values()), hits, facets
+
+class SQLiteEngine(SQLEngine):
+    where = 'assetmanager_searchentry.id IN (SELECT docid FROM %s WHERE %s MATCH %%s)' % (FTS_TABLE, FTS_TABLE)
+
+    def match(self, terms):
+        return u' '.join(u'%s*' % term for term in terms)
+
+class PostgresEngine(SQLEngine):
+    where = "to_tsvector('simple', assetmanager_searchentry.text) @@ to_tsquery('simple', %s)"
+
+    def match(self, terms):
+        return u' & '.join(u'%s:*' % term for term in terms)
+
+class MemoryEngine(object):
+    """
+    A sorted word list and a posting list of entry ids per word, loaded
+    from SearchEntry. Prefixes are found by bisecting the word list.
+    """
+    def __init__(self):
+        self.generation = None
+
+    def load(self):
+        self.entries = {}
+        self.texts = {}
+        self.keys = {}
+        postings = {}
+        for row in SearchEntry.objects.order_by('id').values('text', *HIT_FIELDS).iterator():
+            text = self.texts[row['id']] = row.pop('text')
+            for word in text.split():
+                postings.setdefault(word, array('l')).append(row['id'])
+            self.entries[row['id']] = row
+            self.keys[row['kind'], row['object_id']] = row['id']
+        self.words = sorted(postings)
+        self.postings = postings
+
+    def add(self, row):
+        text = self.texts[row['id']] = row.pop('text')
+        for word in text.split():
+            if word not in self.postings:
+                self.postings[word] = array('l')
+                insort(self.words, word)
+            self.postings[word].append(row['id'])
+        self.entries[row['id']] = row
+        self.keys[row['kind'], row['object_id']] = row['id']
+
+    def drop(self, id):
+        row = self.entries.pop(id)
+        del self.keys[row['kind'], row['object_id']]
+        for word in self.texts.pop(id).split():
+            posting = self.postings[word]
+            posting.remove(id)
+            if not posting:
+                del self.postings[word]
+                del self.words[bisect_left(self.words, word)]
+
+    def apply(self, change):
+        if change[0] == 'entries':
+            kind, object_ids = change[1:]
+            for object_id in object_ids:
+                if (kind, object_id) in self.keys:
+                    self.drop(self.keys[kind, object_id])
+            for row in SearchEntry.objects.filter(kind=kind, object_id__in=object_ids).values('text', *HIT_FIELDS):
+                self.add(row)
+        else:
+            # only the facets of these rows changed, their words did not
+            column, value = change[1:]
+            for row in SearchEntry.objects.filter(**{str(column): value}).values(*HIT_FIELDS):
+                if row['id'] in self.entries:
+                    self.entries[row['id']] = row
+
+    def ensure(self):
+        current = generation()
+        if current != self.generation:
+            # read the log position first, so changes made while loading are applied again
+            self.seen = cache.get(CHANGES_KEY % current, 0)
+            self.load()
+            self.generation = current
+        last = cache.get(CHANGES_KEY % current, 0)
+        if last - self.seen > CHANGE_SLOTS:
+            self.generation = None
+            return self.ensure()
+        for n in range(self.seen + 1, last + 1):
+            found = cache.get(CHANGE_KEY % (current, n % CHANGE_SLOTS))
+            if found is None or found[0] != n:
+                # evicted, or already overwritten by a later change
+                self.generation = None
+                return self.ensure()
+            self.apply(found[1])
+        self.seen = last
+
+    def prefixed(self, term):
+        ids = set()
+        i = bisect_left(self.words, term)
+        while i < len(self.words) and self.words[i].startswith(term):
+            ids.update(self.postings[self.words[i]])
+            i += 1
+        return ids
+
+    def search(self, terms, filters, limit):
+        self.ensure()
+        ids = None
+        for term in sorted(terms, key=len, reverse=True):
+            found = self.prefixed(term)
+            ids = found if ids is None else ids & found
+            if not ids:
+                break
+        rows = [self.entries[id] for id in ids or ()]
+        rows = [row for row in rows if all(row[field] == value for field, value in filters.items())]
+        facets = dict((facet, {}) for facet in FACETS)
+        for row in rows:
+            for facet, column in FACETS.items():
+                facets[facet][row[column]] = facets[facet].get(row[column], 0) + 1
+        hits = heapq.nsmallest(limit, rows, key=lambda row: (row['label'], row['id']))
+        return len(rows), [dict(row) for row in hits], facets
+
+ENGINES = {'sqlite': SQLiteEngine, 'postgres': PostgresEngine, 'memory': MemoryEngine}
+_engine = {}
+
+def engine():
+    """
+    The engine named by ASSETMANAGER_SEARCH_ENGINE, or else the best one
+    the database offers.
+    """
+    if 'engine' not in _engine:
+        name = getattr(settings, 'ASSETMANAGER_SEARCH_ENGINE', None)
+        if name is None:
+            backend = connection.settings_dict['ENGINE']
+            if backend.endswith('sqlite3') and FTS_TABLE in connection.introspection.table_names():
+                name = 'sqlite'
+            elif 'postgresql' in backend:
+                name = 'postgres'
+            else:
+                name = 'memory'
+        _engine['engine'] = ENGINES[name]()
+    return _engine['engine']
+
+def generation():
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        cache.add(GENERATION_KEY, uuid4().hex, GENERATION_TIMEOUT)
+        current = cache.get(GENERATION_KEY)
+    return current
+
+def changed():
+    """
+    Tell the in-memory indexes of every process to reload.
+    """
+    cache.set(GENERATION_KEY, uuid4().hex, GENERATION_TIMEOUT)
+
+def log(change):
+    if not isinstance(engine(), MemoryEngine):
+        return
+    current = generation()
+    key = CHANGES_KEY % current
+    cache.add(key, 0, GENERATION_TIMEOUT)
+    try:
+        n = cache.incr(key)
+    except ValueError:
+        # evicted in between, every process reloads anyway
+        return changed()
+    cache.set(CHANGE_KEY % (current, n % CHANGE_SLOTS), (n, change), GENERATION_TIMEOUT)
+
+def entries_changed(kind, object_ids):
+    """
+    Tell the in-memory indexes to re-read the entries of these objects.
+    """
+    log(('entries', kind, object_ids))
+
+def facets_changed(column, value):
+    """
+    Tell the in-memory indexes to re-read the facets of the entries whose
+    column has this value.
+    """
+    log(('facets', column, value))
+
+def search(query, limit=50, **filters):
+    """
+    Search the inventory. filters narrow the results by facet, e.g.
+    type='server' or datacentre=1. Returns a dict with the total number
+    of matches, the first limit entries ordered by label and, per facet,
+    the number of matches for each value.
+    """
+    found = terms(query)
+    filters = dict((FACETS[facet], value) for facet, value in filters.items() if value is not None)
+    if not found:
+        return {'total': 0, 'hits': [], 'facets': dict((facet, {}) for facet in FACETS)}
+    total, hits, facets = engine().search(found, filters, limit)
+    return {'total': total, 'hits': hits, 'facets': facets}
+
+def device_saved(sender, instance, raw, **kwargs):
+    if raw:
+        # fixtures save the child row without the fields of the parent
+        instance = sender._default_manager.get(pk=instance.pk)
+    elif sender is Device and type(instance) is Device:
+        instance = instance.downcast()
+    index(instance)
+    if SearchEntry.objects.filter(device_id=instance.pk).exclude(kind='device').update(
+            rack_id=instance.rack_id, os=instance.os, **dict(zip(('serverroom_id', 'datacentre_id'), place(instance.rack_id)))):
+        facets_changed('device_id', instance.pk)
+
+def device_deleted(sender, instance, **kwargs):
+    remove('device', instance.pk)
+
+def part_saved(sender, instance, **kwargs):
+    index(instance)
+
+def part_deleted(sender, instance, **kwargs):
+    remove(sender._meta.object_name.lower(), instance.pk)
+
+def rack_saved(sender, instance, **kwargs):
+    room, datacentre = place(instance.pk)
+    if SearchEntry.objects.filter(rack_id=instance.pk).update(serverroom_id=room, datacentre_id=datacentre):
+        facets_changed('rack_id', instance.pk)
+
+def serverroom_saved(sender, instance, **kwargs):
+    if SearchEntry.objects.filter(serverroom_id=instance.pk).update(datacentre_id=instance.datacentre_id):
+        facets_changed('serverroom_id', instance.pk)
+
+def inserted(sender, pks, **kwargs):
+    index_bulk(sender, pks)
+
+for model in Device.__subclasses__():
+    post_save.connect(device_saved, sender=model)
+    bulk_inserted.connect(inserted, sender=model)
+post_save.connect(device_saved, sender=Device)
+post_delete.connect(device_deleted, sender=Device)
+for model in (Networkinterface, Harddisk, DeviceFunction):
+    post_save.connect(part_saved, sender=model)
+    post_delete.connect(part_deleted, sender=model)
+    bulk_inserted.connect(inserted, sender=model)
+post_save.connect(rack_saved, sender=Rack)
+post_save.connect(serverroom_saved, sender=Serverroom)
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent after rows were inserted in bulk, bypassing save() and its signals,
+# so the derived indexes can catch up. pks lists the new primary keys.
+bulk_inserted = Signal(providing_args=['pks'])
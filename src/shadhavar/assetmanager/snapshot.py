@@ -0,0 +1,32 @@
+"""
+The stored row of an object that is being saved.
+
+Many modules compare what is saved with what was there before. They all
+ask stored() from their pre_save handlers, which reads the row once per
+save, with every concrete field of the sender, and keeps it on the
+instance until its next save.
+"""
+
+from django.db.models.signals import pre_save
+
+def fields(model):
+    return [f.attname for f in model._meta.fields]
+
+def stored(sender, instance):
+    """
+    The stored row of instance as sender, {attname: value}, or None if
+    there is none yet. Only meaningful before the row is written.
+    """
+    if instance.pk is None:
+        return None
+    rows = instance.__dict__.setdefault('_stored', {})
+    if sender not in rows:
+        found = list(sender._default_manager.filter(pk=instance.pk).values(*fields(sender)))
+        rows[sender] = found and found[0] or None
+    return rows[sender]
+
+def reset(sender, instance, **kwargs):
+    instance.__dict__.pop('_stored', None)
+
+# connected before any handler that uses stored(), which all import this module first
+pre_save.connect(reset)
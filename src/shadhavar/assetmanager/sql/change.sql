@@ -0,0 +1 @@
+CREATE INDEX assetmanager_change_object ON assetmanager_change (content_type_id, object_id, timestamp);
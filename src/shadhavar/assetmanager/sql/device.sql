@@ -0,0 +1 @@
+CREATE INDEX assetmanager_device_lifecycle ON assetmanager_device (enddate, rack_id);
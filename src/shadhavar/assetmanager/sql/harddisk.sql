@@ -0,0 +1 @@
+CREATE INDEX assetmanager_harddisk_lifecycle ON assetmanager_harddisk (enddate, array_id, parent_id);
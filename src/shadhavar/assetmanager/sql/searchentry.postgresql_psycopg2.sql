@@ -0,0 +1 @@
+CREATE INDEX assetmanager_searchentry_text_fts ON assetmanager_searchentry USING gin (to_tsvector('simple', text));
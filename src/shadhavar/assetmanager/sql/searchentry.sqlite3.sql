@@ -0,0 +1,4 @@
+CREATE VIRTUAL TABLE assetmanager_searchentry_fts USING fts4(text, prefix="2,3");
+CREATE TRIGGER assetmanager_searchentry_fts_insert AFTER INSERT ON assetmanager_searchentry BEGIN INSERT INTO assetmanager_searchentry_fts (docid, text) VALUES (new.id, new.text); END;
+CREATE TRIGGER assetmanager_searchentry_fts_update AFTER UPDATE OF text ON assetmanager_searchentry BEGIN UPDATE assetmanager_searchentry_fts SET text = new.text WHERE docid = old.id; END;
+CREATE TRIGGER assetmanager_searchentry_fts_delete AFTER DELETE ON assetmanager_searchentry BEGIN DELETE FROM assetmanager_searchentry_fts WHERE docid = old.id; END;
@@ -0,0 +1,180 @@
+"""
+Storage capacity of RAID arrays, and of the devices and servers they are
+in.
+
+Every RaidArray has an ArrayCapacity row derived from its member disks:
+the raw size (the sum of the disks) and the usable size for its level,
+computed from the smallest disk the way controllers do. The row also
+names the device holding the disks and the server the storage belongs
+to: that device itself, or the server a DiskArray is connected to. Rows
+are recomputed for the arrays involved whenever a disk, an array or a
+DiskArray connection changes, so totals per DiskArray, server, rack,
+serverroom or datacentre are a single aggregate query. Disks that are not
+in an array don't count.
+"""
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from assetmanager.models import ArrayCapacity, DiskArray, Harddisk, RaidArray, Server
+from assetmanager.bulk import insert
+from assetmanager.signals import bulk_inserted
+
+CHUNK_SIZE = 500
+
+def hamming(n):
+    # parity disks p of n in all, the least with 2 ** p >= n + 1
+    p = 1
+    while 2 ** p < n + 1:
+        p += 1
+    return n - p
+
+# raidType -> (least number of disks, number of disks worth of usable space)
+LEVELS = {
+    '0': (1, lambda n: n),
+    '1': (2, lambda n: 1),
+    '2': (3, hamming),
+    '3': (3, lambda n: n - 1),
+    '4': (3, lambda n: n - 1),
+    '5': (3, lambda n: n - 1),
+    '6': (4, lambda n: n - 2),
+    '7': (4, lambda n: n // 2), # 1+0
+    '8': (4, lambda n: n // 2), # 0+1
+    '9': (6, lambda n: n // 2 - 1), # 5+1, a mirrored RAID 5
+}
+JBOD = '10'
+
+def capacity(level, sizes):
+    """
+    (raw, usable, valid) of an array of the given level made of disks of
+    the given sizes.
+    """
+    sizes = [size or 0 for size in sizes]
+    raw = float(sum(sizes))
+    if level == JBOD:
+        return raw, raw, bool(sizes)
+    if level not in LEVELS or len(sizes) < LEVELS[level][0]:
+        return raw, 0.0, False
+    return raw, float(LEVELS[level][1](len(sizes)) * min(sizes)), True
+
+def chunks(values):
+    values = sorted(set(value for value in values if value is not None))
+    for i in range(0, len(values), CHUNK_SIZE):
+        yield values[i:i + CHUNK_SIZE]
+
+def refresh(array_ids):
+    """
+    Recompute the ArrayCapacity rows of the given arrays.
+    """
+    for chunk in chunks(array_ids):
+        levels = dict(RaidArray.objects.filter(pk__in=chunk).values_list('pk', 'raidType'))
+        ArrayCapacity.objects.filter(pk__in=[pk for pk in chunk if pk not in levels]).delete()
+        sizes, parents = {}, {}
+        for array, parent, size in Harddisk.objects.filter(array__in=levels.keys()).values_list('array', 'parent', 'size'):
+            sizes.setdefault(array, []).append(size)
+            counts = parents.setdefault(array, {})
+            if parent is not None:
+                counts[parent] = counts.get(parent, 0) + 1
+        devices = dict((array, max(counts, key=lambda pk: (counts[pk], -pk))) for array, counts in parents.items() if counts)
+        servers = set(Server.objects.filter(pk__in=devices.values()).values_list('pk', flat=True))
+        servers = dict((pk, pk) for pk in servers)
+        servers.update(DiskArray.objects.filter(pk__in=devices.values()).values_list('pk', 'conntectTo'))
+        stored = set(ArrayCapacity.objects.filter(pk__in=levels.keys()).values_list('pk', flat=True))
+        new = []
+        for array, level in levels.items():
+            raw, usable, valid = capacity(level, sizes.get(array, []))
+            device = devices.get(array)
+            values = dict(disks=len(sizes.get(array, [])), raw=raw, usable=usable, valid=valid)
+            if array in stored:
+                ArrayCapacity.objects.filter(pk=array).update(device=device, server=servers.get(device), **values)
+            else:
+                new.append(dict(array_id=array, device_id=device, server_id=servers.get(device), **values))
+        insert(connection.cursor(), ArrayCapacity, new)
+    transaction.commit_unless_managed()
+
+def rebuild():
+    """
+    Recompute the ArrayCapacity row of every array.
+    """
+    ArrayCapacity.objects.all().delete()
+    refresh(RaidArray.objects.values_list('pk', flat=True))
+    return ArrayCapacity.objects.count()
+
+def check():
+    """
+    [(array, stored, computed)] for every array whose stored capacity
+    differs from a fresh computation, both as (raw, usable, valid).
+    """
+    sizes = {}
+    for array, size in Harddisk.objects.exclude(array=None).values_list('array', 'size').iterator():
+        sizes.setdefault(array, []).append(size)
+    stored = dict((row[0], row[1:]) for row in ArrayCapacity.objects.values_list('pk', 'raw', 'usable', 'valid'))
+    problems = []
+    for array, level in RaidArray.objects.order_by('pk').values_list('pk', 'raidType'):
+        computed = capacity(level, sizes.get(array, []))
+        if stored.get(array) != computed:
+            problems.append((array, stored.get(array), computed))
+    return problems
+
+TOTALS = dict(arrays=Count('pk'), disks=Sum('disks'), raw=Sum('raw'), usable=Sum('usable'))
+
+def totals(group, ids=None):
+    """
+    {id: {'arrays', 'disks', 'raw', 'usable'}} of the storage per device,
+    server, rack, serverroom or datacentre, optionally only for ids.
+    """
+    lookup = {
+        'device': 'device',
+        'server': 'server',
+        'rack': 'device__rack',
+        'serverroom': 'device__rack__serverroom',
+        'datacentre': 'device__rack__serverroom__datacentre',
+    }[group]
+    rows = ArrayCapacity.objects.filter(**{'%s__isnull' % lookup: False})
+    if ids is not None:
+        rows = rows.filter(**{'%s__in' % lookup: [getattr(obj, 'pk', obj) for obj in ids]})
+    result = {}
+    for row in rows.values(lookup).annotate(**TOTALS).order_by():
+        result[row.pop(lookup)] = row
+    return result
+
+def device_capacity(device):
+    return totals('device', [device]).get(getattr(device, 'pk', device), {})
+
+def server_capacity(server):
+    """
+    The storage of a server: the arrays in it and on the DiskArrays
+    connected to it.
+    """
+    return totals('server', [server]).get(getattr(server, 'pk', server), {})
+
+def disk_pre_save(sender, instance, raw, **kwargs):
+    instance._storage_old = None
+    if instance.pk is not None and not raw:
+        old = Harddisk.objects.filter(pk=instance.pk).values_list('array', flat=True)
+        instance._storage_old = old and old[0] or None
+
+def disk_saved(sender, instance, **kwargs):
+    refresh([instance.array_id, getattr(instance, '_storage_old', None)])
+
+def disk_deleted(sender, instance, **kwargs):
+    refresh([instance.array_id])
+
+def array_saved(sender, instance, **kwargs):
+    refresh([instance.pk])
+
+def disks_inserted(sender, pks, **kwargs):
+    for i in range(0, len(pks), CHUNK_SIZE):
+        refresh(Harddisk.objects.filter(pk__in=pks[i:i + CHUNK_SIZE]).values_list('array', flat=True))
+
+def device_saved(sender, instance, **kwargs):
+    # a DiskArray connected to another server
+    refresh(ArrayCapacity.objects.filter(device=instance.pk).values_list('pk', flat=True))
+
+pre_save.connect(disk_pre_save, sender=Harddisk)
+post_save.connect(disk_saved, sender=Harddisk)
+post_delete.connect(disk_deleted, sender=Harddisk)
+bulk_inserted.connect(disks_inserted, sender=Harddisk)
+post_save.connect(array_saved, sender=RaidArray)
+post_save.connect(device_saved, sender=DiskArray)
@@ -5,7 +5,64 @@ unittest). These will both pass when you run "manage.py test".
 Replace these with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+from __future__ import absolute_import
+
+import gc
+import gzip
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+from StringIO import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.signals import request_started
+from django.db import connection, reset_queries, transaction
+from django.http import HttpRequest, HttpResponse
+from django.test import TestCase, TransactionTestCase
+
+from assetmanager.models import *
+from assetmanager import occupancy, ipaddr, ipam, exporter, topology, rollups, locations, racktree, search, audit, maintenance, api, lifecycle, placement, storage, benchmark, metrics, allocation, counts, power
+from assetmanager.importer import Importer
+import middleware
+
+class CaptureQueries(object):
+    """
+    Context manager that records the queries executed inside it, the test
+    runner turns DEBUG off so connection.queries stays empty otherwise.
+    Requests made through the test client would reset the log, so that is
+    switched off as well.
+    """
+    def __enter__(self):
+        self.debug = settings.DEBUG
+        settings.DEBUG = True
+        request_started.disconnect(reset_queries)
+        connection.queries = []
+        self.queries = connection.queries
+        return self
+
+    def __exit__(self, *exc_info):
+        request_started.connect(reset_queries)
+        settings.DEBUG = self.debug
+
+    def __len__(self):
+        return len(self.queries)
+
+def share_cache(test, shared=True):
+    """
+    Treat the cache as shared by every process, or not, until the end of
+    test; a test run is a single process either way.
+    """
+    missing = object()
+    old = getattr(settings, 'ASSETMANAGER_SHARED_CACHE', missing)
+    settings.ASSETMANAGER_SHARED_CACHE = shared
+    if old is missing:
+        test.addCleanup(delattr, settings, 'ASSETMANAGER_SHARED_CACHE')
+    else:
+        test.addCleanup(setattr, settings, 'ASSETMANAGER_SHARED_CACHE', old)
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -14,6 +71,1273 @@ class SimpleTest(TestCase):
         """
         self.failUnlessEqual(1 + 1, 2)
 
+class DeviceTypingTest(TestCase):
+    def test_typed_resolves_subclasses(self):
+        typed = dict((d.pk, type(d)) for d in Device.objects.typed())
+        self.failUnlessEqual(typed[1], DiskArray)
+        self.failUnlessEqual(typed[2], KVM)
+        self.failUnlessEqual(typed[6], Server)
+        self.failUnlessEqual(typed[9], VM)
+
+    def test_typed_query_count(self):
+        subclasses = len(Device.objects.all().subclasses())
+        with CaptureQueries() as queries:
+            devices = list(Device.objects.all().typed())
+        self.failUnlessEqual(len(queries), 1 + subclasses)
+        self.failUnless(all(type(d) is not Device for d in devices))
+
+    def test_typed_keeps_parent_fields(self):
+        server = Device.objects.filter(pk=6).select_related('rack').typed().next()
+        self.failUnlessEqual(server.name, 'Server 1')
+        self.failUnlessEqual(server.gpu, 'Nvidia')
+        with CaptureQueries() as queries:
+            server.rack
+            server.device_ptr
+        self.failUnlessEqual(len(queries), 0)
+
+    def test_downcast(self):
+        self.failUnlessEqual(type(Device.objects.get(pk=8).downcast()), UPS)
+
+class QueryBudgetTest(TestCase):
+    """
+    Listing devices must cost a fixed number of queries, however many rows
+    there are. The __unicode__ of every device walks rack -> serverroom, so a
+    missing select_related shows up here as 1,000+ queries.
+    """
+    devices = 1000
+
+    def setUp(self):
+        room = Serverroom.objects.get(pk=1)
+        racks = [Rack.objects.create(name='Rack %d' % i, height=42, kind='0', row=i, column=1, serverroom=room) for i in range(10)]
+        for i in range(self.devices):
+            rack = racks[i % len(racks)]
+            if i % 2:
+                device = Server.objects.create(rack=rack, name='Server %d' % i, position=i % 42, os='Linux')
+            else:
+                device = Switch.objects.create(rack=rack, name='Switch %d' % i, position=i % 42, kind='0')
+            if i % 10 == 0:
+                Harddisk.objects.create(parent=device, size=500.0, ide='1')
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        # the budgets hold with the shared cache of a deployment
+        share_cache(self)
+
+    def assertQueries(self, budget, func, *args, **kwargs):
+        with CaptureQueries() as queries:
+            result = func(*args, **kwargs)
+        self.failUnless(len(queries) <= budget, '%d queries, budget is %d' % (len(queries), budget))
+        return result
+
+    def test_device_listing(self):
+        names = self.assertQueries(1, lambda: [unicode(d) for d in Device.objects.all()])
+        self.failUnless(len(names) > self.devices)
+
+    def test_subclass_listing(self):
+        self.assertQueries(1, lambda: [unicode(s) for s in Server.objects.all()])
+        self.assertQueries(1, lambda: [unicode(s) for s in Switch.objects.all()])
+
+    def test_rack_listing(self):
+        self.assertQueries(1, lambda: [unicode(r) for r in Rack.objects.all()])
+        rack = Rack.objects.get(name='Rack 0')
+        self.assertQueries(1, lambda: [unicode(d) for d in rack.device_set.all()])
+
+    def test_part_listing(self):
+        self.assertQueries(1, lambda: [unicode(h) for h in Harddisk.objects.all()])
+
+    def test_admin_changelists(self):
+        for model in ('device', 'server', 'switch', 'rack', 'harddisk'):
+            response = self.assertQueries(10, self.client.get, '/admin/assetmanager/%s/' % model)
+            self.failUnlessEqual(response.status_code, 200)
+
+    def test_admin_dropdowns(self):
+        response = self.assertQueries(10, self.client.get, '/admin/assetmanager/harddisk/add/')
+        self.failUnlessEqual(response.status_code, 200)
+
+class OccupancyTest(TestCase):
+    def setUp(self):
+        self.room = Serverroom.objects.get(pk=1)
+        self.rack = Rack.objects.create(name='Rack A', height=10, kind='0', row=1, column=2, serverroom=self.room)
+        self.server = Server.objects.create(rack=self.rack, name='web', position=1, height=2)
+        Switch.objects.create(rack=self.rack, name='tor', position=10, height=1)
+
+    def test_incremental_update(self):
+        occupancy = RackOccupancy.objects.get(rack=self.rack)
+        self.failUnlessEqual((occupancy.used, occupancy.largest_free, occupancy.conflict), (3, 7, False))
+        self.server.position = 4
+        self.server.save()
+        occupancy = RackOccupancy.objects.get(rack=self.rack)
+        self.failUnlessEqual((occupancy.used, occupancy.largest_free), (3, 4))
+        self.server.delete()
+        self.failUnlessEqual(RackOccupancy.objects.get(rack=self.rack).used, 1)
+
+    def test_concurrent_add(self):
+        build = occupancy.build
+        def racing(height, placements):
+            # another worker places a device after this one read the row
+            occupancy.build = build
+            occupancy.add_device(self.rack.pk, 5, 1)
+            return build(height, placements)
+        occupancy.build = racing
+        try:
+            occupancy.add_device(self.rack.pk, 7, 2)
+        finally:
+            occupancy.build = build
+        self.failUnlessEqual(RackOccupancy.objects.get(rack=self.rack).used, 6)
+
+    def test_move_between_racks(self):
+        other = Rack.objects.create(name='Rack B', height=4, kind='0', row=1, column=3, serverroom=self.room)
+        self.server.rack = other
+        self.server.save()
+        self.failUnlessEqual(occupancy.utilisation(self.room)[self.rack.pk], (1, 10))
+        self.failUnlessEqual(occupancy.utilisation(self.room)[other.pk], (2, 4))
+
+    def test_free_slots(self):
+        self.failUnlessEqual(list(occupancy.free_slots(2, serverroom=self.room)), [(self.rack.pk, 3, 7)])
+        self.failUnlessEqual(occupancy.find_slot(8, datacentre=self.room.datacentre), None)
+        self.failUnless(occupancy.is_free(self.rack, 3, 7))
+        self.failIf(occupancy.is_free(self.rack, 2, 1))
+
+    def test_overlaps(self):
+        clash = Server.objects.create(rack=self.rack, name='db', position=2, height=2)
+        self.failUnless(self.rack.pk in occupancy.conflicting_racks(self.room))
+        self.failUnlessEqual(occupancy.overlapping_devices(self.rack), [(self.server.pk, clash.pk)])
+
+    def test_rollups(self):
+        self.failUnlessEqual(occupancy.row_utilisation(self.room)[1], (4, 11, 2))
+        self.failUnlessEqual(occupancy.room_utilisation()[self.room.pk], (4, 11, 2))
+
+class IpamTest(TestCase):
+    def setUp(self):
+        self.lan = Subnet.objects.create(networkaddr4='10.0.0.0', subnetaddr4='255.255.255.0',
+                                         networkaddr6='2001:db8::', subnetaddr6='64')
+        self.wide = Subnet.objects.create(networkaddr4='10.0.0.0', subnetaddr4='255.255.0.0')
+        self.other = Subnet.objects.create(networkaddr4='10.1.0.0', subnetaddr4='255.255.255.0')
+        device = Device.objects.get(pk=6)
+        kind = NetworkHardInterface.objects.get(pk=1)
+        for i, ip4 in enumerate(['10.0.0.1', '10.0.0.2', '10.0.0.4']):
+            Networkinterface.objects.create(device=device, subnet=self.lan, kind=kind, name='eth%d' % i,
+                                            ip4=ip4, ip6='2001:db8::%d' % (i + 1))
+
+    def test_packed_columns(self):
+        self.failUnlessEqual((self.lan.first4, self.lan.last4, self.lan.prefixlen4), ('0a000000', '0a0000ff', 24))
+        self.failUnlessEqual(self.lan.last6, '20010db800000000ffffffffffffffff')
+        self.failUnlessEqual(Networkinterface.objects.get(name='eth2').packed4, '0a000004')
+        self.failUnlessEqual([ipaddr.prefixlen(mask, 32) for mask in ('0', '/0', '0.0.0.0', '/32', '33')], [0, 0, 0, 32, None])
+        default = Subnet.objects.create(networkaddr4='0.0.0.0', subnetaddr4='/0')
+        self.failUnlessEqual((default.first4, default.last4, default.prefixlen4), ('00000000', 'ffffffff', 0))
+
+    def test_containment(self):
+        self.failUnlessEqual(list(ipam.containing('10.0.0.7')), [self.lan, self.wide])
+        self.failUnlessEqual(ipam.subnet_for('10.0.200.1'), self.wide)
+        self.failUnlessEqual(ipam.subnet_for('2001:db8::ffff'), self.lan)
+        self.failUnlessEqual(ipam.subnet_for('172.16.0.1'), None)
+
+    def test_overlap(self):
+        self.failUnlessEqual(list(ipam.overlapping(self.wide)), [self.lan])
+        self.failUnlessEqual(list(ipam.overlapping(self.other)), [])
+        self.failUnlessEqual(set(ipam.overlaps()), set([(self.wide.pk, self.lan.pk)]))
+
+    def test_next_free(self):
+        self.failUnlessEqual(ipam.next_free_address(self.lan), '10.0.0.3')
+        self.failUnlessEqual(ipam.next_free_address(self.lan, 6), '2001:db8::')
+        self.failUnlessEqual(ipam.free_addresses(self.lan).next(), '10.0.0.3')
+        self.failUnlessEqual(len(list(ipam.free_addresses(self.lan))), 254 - 3)
+
+class ImportTest(TestCase):
+    rows = [
+        {'type': 'server', 'name': 'import-1', 'serverroom': 'Serverroom 1', 'row': '1', 'column': '1', 'position': '1', 'height': '1', 'ram': '2048', 'functions': 'DeviceFunction 1'},
+        {'type': 'vm', 'name': 'import-2', 'rack': '1', 'server': 'import-1', 'ram': '512'},
+        {'type': 'networkinterface', 'device': 'import-1', 'subnet': '192.168.50.0/24', 'kind': 'NetworkHardInterface1', 'name': 'eth0', 'ip4': '192.168.50.7'},
+        {'type': 'harddisk', 'parent': 'import-1', 'size': '250', 'ide': '1', 'array': 'RaidArray1'},
+        {'type': 'partition', 'parent': 'import-2', 'name': '/', 'size': '20'},
+        {'type': 'harddisk', 'parent': 'nowhere', 'ide': '1'},
+        {'type': 'switch', 'name': 'import-3', 'serverroom': 'Serverroom 1', 'row': '9', 'column': '9'},
+    ]
+
+    def test_import(self):
+        importer = Importer(batch_size=2)
+        counts = importer.run(iter(self.rows))
+        self.failUnlessEqual(counts, {'server': 1, 'vm': 1, 'networkinterface': 1, 'harddisk': 1, 'partition': 1})
+        self.failUnlessEqual([line for line, message in importer.errors], [6, 7])
+        server = Server.objects.get(name='import-1')
+        self.failUnlessEqual(server.ram, 2048)
+        self.failUnlessEqual(list(server.functions.values_list('name', flat=True)), ['DeviceFunction 1'])
+        self.failUnlessEqual(VM.objects.get(name='import-2').server, server)
+        self.failUnlessEqual(type(Device.objects.get(name='import-2').downcast()), VM)
+        self.failUnlessEqual(ipam.interfaces_in(Subnet.objects.get(pk=1)).get().device_id, server.pk)
+        self.failUnlessEqual(Harddisk.objects.get(parent=server).array_id, 1)
+        self.failUnless(RackOccupancy.objects.get(rack=1).conflict)
+        self.failUnlessEqual(rollups.check(), [])
+
+    def test_dry_run(self):
+        importer = Importer(dry_run=True)
+        importer.run(iter(self.rows))
+        self.failUnlessEqual(len(importer.errors), 2)
+        self.failIf(Device.objects.filter(name__startswith='import-').exists())
+
+    def test_bad_references(self):
+        importer = Importer()
+        counts = importer.run(iter([
+            {'type': 'switch', 'name': 'import-sw', 'rack': '1', 'functions': 'DeviceFunction 1'},
+            {'type': 'device', 'name': 'import-a', 'rack': 'abc'},
+            {'type': 'device', 'name': 'import-b', 'rack': '99999'},
+            {'type': 'device', 'name': 'import-c', 'rack': '1'},
+        ]))
+        self.failUnlessEqual(counts, {'device': 1})
+        self.failUnlessEqual(importer.errors, [(1, u'a switch has no functions'), (2, u"unknown rack 'abc'"),
+                                               (3, u"unknown rack '99999'")])
+
+class ExportTest(TestCase):
+    def test_records(self):
+        records = list(exporter.records(chunk_size=4))
+        devices = [r for r in records if r['type'] not in ('networkinterface', 'harddisk', 'partition')]
+        self.failUnlessEqual([r['id'] for r in devices], range(1, 10))
+        self.failUnlessEqual(records[1]['type'], 'networkinterface')
+        self.failUnlessEqual(records[1]['device'], 'DiskArray 1')
+        vm = [r for r in devices if r['type'] == 'vm'][0]
+        self.failUnlessEqual((vm['server'], vm['functions'], vm['serverroom']), ('Server 1', 'DeviceFunction 1', 'Serverroom 1'))
+
+    def test_round_trip(self):
+        lines = ''.join(exporter.export('jsonl')[0]).splitlines()
+        rows = [json.loads(line) for line in lines]
+        for row in rows:
+            if row.get('name') and row['type'] not in ('networkinterface', 'partition', 'harddisk'):
+                row['name'] += ' copy'
+            for key in ('device', 'parent', 'server'):
+                if row.get(key):
+                    row[key] += ' copy'
+        importer = Importer()
+        importer.run(iter(rows))
+        self.failUnlessEqual(importer.errors, [])
+        self.failUnlessEqual(Device.objects.count(), 18)
+
+    def test_view(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.get('/assets/export.csv.gz')
+        self.failUnlessEqual(response['Content-Type'], 'application/x-gzip')
+        data = gzip.GzipFile(fileobj=StringIO(response.content)).read()
+        self.failUnless(data.startswith('type,id,'))
+        self.failUnlessEqual(len(data.splitlines()), 13)
+
+class TopologyTest(TestCase):
+    def setUp(self):
+        rack = Rack.objects.get(pk=1)
+        subnet = Subnet.objects.get(pk=1)
+        self.kind = NetworkHardInterface.objects.get(pk=1)
+        self.router = Router.objects.get(pk=5)
+        self.core = Switch.objects.get(pk=7)
+        self.edge = Switch.objects.create(rack=rack, name='edge', kind='0')
+        self.server = Server.objects.get(pk=6)
+        self.nic = self.link(self.server, 10, self.edge, 10)
+        self.uplink = self.link(self.edge, 10, self.core, 10)
+        self.link(self.core, 20, self.router, 20)
+
+    def link(self, a, vlan_a, b, vlan_b):
+        subnet = Subnet.objects.get(pk=1)
+        remote = Networkinterface.objects.create(device=b, subnet=subnet, kind=self.kind, name='to-%s' % a.name, vlan=vlan_b)
+        return Networkinterface.objects.create(device=a, subnet=subnet, kind=self.kind, name='to-%s' % b.name, vlan=vlan_a, connectedTo=remote)
+
+    def test_path(self):
+        graph = topology.topology(1)
+        hops = graph.path(self.server.pk, self.router.pk)
+        self.failUnlessEqual([hop[0] for hop in hops], [self.server.pk, self.edge.pk, self.core.pk])
+        self.failUnlessEqual(hops[0][1], self.nic.pk)
+        self.failUnlessEqual(graph.path(self.server.pk, 3), None)
+        self.failUnless(2 in graph.reachable(1)) # the KVM from the fixture
+
+    def test_blast_radius(self):
+        graph = topology.topology()
+        self.failUnlessEqual(graph.blast_radius(self.edge.pk), set([self.server.pk]))
+        self.failUnlessEqual(graph.blast_radius(self.core.pk), set([self.server.pk, self.edge.pk]))
+
+    def test_vlan_components(self):
+        components = topology.topology().vlan_components()
+        self.failUnlessEqual(components[10], [set([self.server.pk, self.edge.pk, self.core.pk])])
+        self.failUnlessEqual(components[20], [set([self.core.pk, self.router.pk])])
+
+    def test_invalidation(self):
+        graph = topology.topology()
+        self.failUnless(topology.topology() is graph)
+        self.uplink.delete()
+        graph = topology.topology()
+        self.failUnlessEqual(graph.path(self.server.pk, self.router.pk), None)
+        KVM.objects.get(pk=2).connections.add(self.edge)
+        self.failIf(topology.topology() is graph)
+
+    def test_process_local_cache(self):
+        share_cache(self, False)
+        graph = topology.topology(1)
+        self.failUnless(topology.topology(1) is graph)
+        request_started.send(sender=None)
+        self.failIf(topology.topology(1) is graph)
+
+    def test_invalidation_by_devices(self):
+        graph = topology.topology(1)
+        router = Router.objects.create(rack_id=1, name='r2')
+        self.failUnless(router.pk in topology.topology(1).routers)
+        graph = topology.topology(1)
+        self.edge.comments = 'unchanged topology'
+        self.edge.save()
+        self.failUnless(topology.topology(1) is graph)
+        room = Serverroom.objects.create(datacentre=Datacentre.objects.create(name='DC 2'), name='Room 2', floor=0, maxrows=1, maxcolumns=1)
+        self.edge.rack = Rack.objects.create(serverroom=room, name='R2', height=42)
+        self.edge.save()
+        self.failIf(self.edge.pk in topology.topology(1).adjacency)
+        router.delete()
+        self.failIf(router.pk in topology.topology(1).routers)
+        Importer().run(iter([{'type': 'router', 'rack': 1, 'name': 'imported-router'}]))
+        self.failUnless(Router.objects.get(name='imported-router').pk in topology.topology(1).routers)
+
+class RollupTest(TestCase):
+    def setUp(self):
+        self.room = Serverroom.objects.get(pk=1)
+        self.rack = Rack.objects.create(name='Rack R', height=42, kind='0', row=2, column=1, serverroom=self.room)
+
+    def assertConsistent(self):
+        self.failUnlessEqual(rollups.check(), [])
+
+    def test_fixture_is_consistent(self):
+        self.assertConsistent()
+        self.failUnlessEqual(rollups.rollup('datacentre', 1)['devices'], 9)
+
+    def test_incremental(self):
+        server = Server.objects.create(rack=self.rack, name='big', ram=1024)
+        Harddisk.objects.create(parent=server, size=300.0, ide='1')
+        VM.objects.create(rack=self.rack, name='guest', server=server, ram=256)
+        totals = rollups.rollup('rack', self.rack)
+        self.failUnlessEqual((totals['devices'], totals['count.server'], totals['ram'], totals['vm_ram'], totals['disk']), (2, 1, 1024, 256, 300))
+        server.ram = 2048
+        server.save()
+        self.failUnlessEqual(rollups.rollup('rack', self.rack)['ram'], 2048)
+        self.assertConsistent()
+
+    def test_moves(self):
+        server = Server.objects.create(rack=self.rack, name='big', ram=1024)
+        Harddisk.objects.create(parent=server, size=300.0, ide='1')
+        device = Device.objects.get(pk=server.pk)
+        device.rack = Rack.objects.get(pk=1)
+        device.save()
+        self.failIf(rollups.rollup('rack', self.rack).get('ram'))
+        self.assertConsistent()
+        other = Datacentre.objects.create(name='Datacentre 2')
+        room = Serverroom.objects.create(datacentre=other, name='Room 2', floor=0, maxrows=1, maxcolumns=1)
+        rack = Rack.objects.get(pk=1)
+        rack.serverroom = room
+        rack.save()
+        self.failUnlessEqual(rollups.rollup('datacentre', other)['ram'], 1024)
+        self.assertConsistent()
+        self.room.datacentre = other
+        self.room.save()
+        self.failIf(any(rollups.rollup('datacentre', 1).values()))
+        self.assertConsistent()
+
+    def test_deletes(self):
+        server = Server.objects.create(rack=self.rack, name='big', ram=1024)
+        Harddisk.objects.create(parent=server, size=300.0, ide='1')
+        Device.objects.get(pk=server.pk).delete()
+        self.assertConsistent()
+        Rack.objects.get(pk=1).delete()
+        self.assertConsistent()
+        self.failIf(Rollup.objects.filter(scope='rack', scope_id=1).exists())
+        self.failIf(RackOccupancy.objects.filter(rack=1).exists())
+
+    def test_import(self):
+        rows = []
+        for i in range(100):
+            rows.append({'type': i % 2 and 'server' or 'switch', 'rack': self.rack.pk, 'name': 'Imported %d' % i,
+                         'position': i % 42, 'ram': i % 2 and 1024 or None})
+            if i % 10 == 0:
+                rows.append({'type': 'harddisk', 'parent': rows[-1]['name'], 'size': 500.0, 'ide': '1'})
+        Importer().run(iter(rows))
+        totals = rollups.rollup('rack', self.rack)
+        self.failUnlessEqual((totals['devices'], totals['ram'], totals['disks']), (100, 50 * 1024, 10))
+        self.assertConsistent()
+
+    def test_rebuild(self):
+        Rollup.objects.all().delete()
+        self.failIfEqual(rollups.check(), [])
+        rollups.rebuild()
+        self.assertConsistent()
+        self.failUnlessEqual(rollups.rollups('serverroom')[1]['pdu_outlets'], 1000)
+
+class LocationTest(TransactionTestCase):
+    def setUp(self):
+        self.room = Serverroom.objects.get(pk=1)
+        self.outer = Rack.objects.create(name='Outer', height=42, kind='0', row=2, column=1, serverroom=self.room)
+        self.inner = Rack.objects.create(name='Blade', height=10, kind='2', serverroom=self.room, rack=self.outer)
+
+    def test_tree(self):
+        locations.tree()
+        with CaptureQueries() as queries:
+            tree = locations.tree()
+            self.failUnlessEqual(tree.ancestors(locations.key(self.inner)),
+                                 [('rack', self.outer.pk), ('serverroom', 1), ('datacentre', 1)])
+            self.failUnlessEqual(locations.descendants(self.room),
+                                 [('rack', 1), ('rack', self.outer.pk), ('rack', self.inner.pk)])
+            self.failUnlessEqual(locations.racks(self.outer), [self.outer.pk, self.inner.pk])
+            nested = tree.as_list()[0]['children'][0]['children'][1]
+            self.failUnlessEqual(nested['children'][0]['name'], 'Blade')
+            self.failUnlessEqual(unicode(Rack(row=3, serverroom_id=1)), 'rack(Serverroom 1,3)')
+        self.failUnlessEqual(len(queries), 0)
+
+    def test_cycles(self):
+        Rack.objects.filter(pk=self.outer.pk).update(rack=self.inner)
+        locations.invalidate()
+        tree = locations.tree()
+        self.failUnlessEqual(tree.descendants(('rack', self.outer.pk)), [('rack', self.inner.pk)])
+        self.failUnlessEqual(tree.ancestors(('rack', self.outer.pk)), [('rack', self.inner.pk)])
+
+    def test_invalidation_and_tiers(self):
+        locations.tree()
+        locations.reset_stats()
+        locations.tree()
+        locations._local.clear()
+        locations.tree()
+        self.failUnlessEqual(locations.stats, {'local_hits': 1, 'shared_hits': 1, 'misses': 0})
+        self.room.name = 'Hall A'
+        self.room.save()
+        self.failUnlessEqual(locations.name('serverroom', 1), 'Hall A')
+        self.failUnlessEqual(locations.stats['misses'], 1)
+        self.inner.delete()
+        self.failUnlessEqual(locations.racks(self.outer), [self.outer.pk])
+
+    def test_process_local_cache(self):
+        share_cache(self, False)
+        locations.tree()
+        locations.reset_stats()
+        locations.tree()
+        request_started.send(sender=None)
+        locations.tree()
+        self.failUnlessEqual(locations.stats, {'local_hits': 1, 'shared_hits': 0, 'misses': 1})
+        share_cache(self)
+        request_started.send(sender=None)
+        locations.tree()
+        self.failUnlessEqual(locations.stats['local_hits'], 2)
+
+    def test_rollback(self):
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            phantom = Rack.objects.create(name='Phantom', height=42, kind='0', serverroom=self.room)
+            self.failUnless(phantom.pk in locations.racks(self.room))
+            self.failUnless(phantom.pk in locations.racks(self.room))
+        finally:
+            transaction.rollback()
+            transaction.leave_transaction_management()
+        self.failIf(phantom.pk in locations.racks(self.room))
+        self.failIf(phantom.pk in locations.racks(self.room))
+
+class RackTreeTest(TestCase):
+    def setUp(self):
+        self.room = Serverroom.objects.get(pk=1)
+        self.top = Rack.objects.get(pk=1)
+        self.chassis = Rack.objects.create(name='Chassis', height=10, kind='2', serverroom=self.room, rack=self.top)
+        self.sleeve = Rack.objects.create(name='Sleeve', height=2, kind='2', serverroom=self.room, rack=self.chassis)
+        self.blade = Server.objects.create(rack=self.sleeve, name='blade')
+
+    def test_paths(self):
+        self.failUnlessEqual(Rack.objects.get(pk=self.sleeve.pk).path, '/1/%d/%d/' % (self.chassis.pk, self.sleeve.pk))
+        with CaptureQueries() as queries:
+            inside = set(racktree.devices(self.top).values_list('pk', flat=True))
+        self.failUnlessEqual(len(queries), 1)
+        self.failUnless(self.blade.pk in inside and 7 in inside)
+        self.failUnlessEqual([r.pk for r in racktree.ancestors(self.sleeve)], [self.chassis.pk, 1])
+        self.failUnlessEqual(set(racktree.subtree(self.chassis, include_self=False)), set([self.sleeve]))
+
+    def test_move_and_cycles(self):
+        other = Rack.objects.create(name='Other', height=42, kind='0', row=2, serverroom=self.room)
+        self.chassis.rack = other
+        self.chassis.save()
+        self.failUnlessEqual(Rack.objects.get(pk=self.sleeve.pk).path, '/%d/%d/%d/' % (other.pk, self.chassis.pk, self.sleeve.pk))
+        other.rack = self.sleeve
+        self.assertRaises(ValidationError, other.full_clean)
+        self.assertRaises(ValidationError, other.save)
+
+    def test_rebuild(self):
+        Rack.objects.update(path='')
+        Rack.objects.filter(pk=1).update(rack=self.sleeve)
+        updated, cycles = racktree.rebuild()
+        self.failUnlessEqual((updated, sorted(cycles)), (3, [1, self.chassis.pk, self.sleeve.pk]))
+        Rack.objects.filter(pk=1).update(rack=None)
+        racktree.rebuild()
+        self.failUnlessEqual(Rack.objects.get(pk=self.sleeve.pk).path, '/1/%d/%d/' % (self.chassis.pk, self.sleeve.pk))
+
+class AutoLogoutTest(TestCase):
+    def setUp(self):
+        User.objects.create_user('user', 'user@example.com', 'secret')
+        self.client.login(username='user', password='secret')
+
+    def session_writes(self, requests):
+        with CaptureQueries() as queries:
+            for i in range(requests):
+                self.failUnlessEqual(self.client.get('/accounts/password/done').status_code, 200)
+        return len([q for q in queries.queries if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')])
+
+    def age(self, minutes):
+        session = self.client.session
+        session['last_touch'] = datetime.now() - timedelta(minutes=minutes)
+        session.save()
+        cache.delete(middleware.TOUCH_KEY % session.session_key)
+
+    def test_session_written_once_per_granularity(self):
+        self.failUnlessEqual(self.session_writes(50), 1)
+        self.age(2)
+        self.failUnlessEqual(self.session_writes(10), 1)
+
+    def test_idle_logout(self):
+        self.client.get('/accounts/password/done')
+        self.age(settings.AUTO_LOGOUT_DELAY - 1)
+        self.failUnlessEqual(self.client.get('/accounts/password/done').status_code, 200)
+        self.age(settings.AUTO_LOGOUT_DELAY + 1)
+        self.client.get('/accounts/password/done')
+        self.failUnlessEqual(self.client.get('/accounts/password/done').status_code, 302)
+
+    def test_cache_touch_counts(self):
+        self.client.get('/accounts/password/done')
+        session = self.client.session
+        session['last_touch'] = datetime.now() - timedelta(minutes=settings.AUTO_LOGOUT_DELAY + 1)
+        session.save()
+        cache.set(middleware.TOUCH_KEY % session.session_key, datetime.now())
+        self.failUnlessEqual(self.client.get('/accounts/password/done').status_code, 200)
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.rack = Rack.objects.get(pk=1)
+        self.server = Server.objects.create(rack=self.rack, name='web-01', brand='Dell', brandType='R710', os='Debian', serialnr='SN4711')
+        kind = NetworkHardInterface.objects.get(pk=1)
+        self.nic = Networkinterface.objects.create(device=self.server, subnet=Subnet.objects.get(pk=1), kind=kind,
+                                                   name='eth0', mac='00:1A:2B:3C:4D:5E', ip4='192.168.50.10')
+        self.disk = Harddisk.objects.create(parent=self.server, size=300.0, ide='1', serialnr='WD-XYZ123')
+
+    def hits(self, query, **filters):
+        return [(hit['kind'], hit['object_id']) for hit in search.search(query, **filters)['hits']]
+
+    def test_search(self):
+        self.failUnlessEqual(self.hits('dell r71'), [('device', self.server.pk)])
+        self.failUnlessEqual(self.hits('web01'), [('device', self.server.pk)])
+        self.failUnlessEqual(self.hits('00:1a:2b'), [('networkinterface', self.nic.pk)])
+        self.failUnlessEqual(self.hits('192.168.50.10'), [('networkinterface', self.nic.pk)])
+        self.failUnlessEqual(self.hits('wd-xyz'), [('harddisk', self.disk.pk)])
+        self.failUnlessEqual(self.hits('dell nomatch'), [])
+
+    def test_facets(self):
+        Switch.objects.create(rack=self.rack, name='web-sw', kind='0', os='IOS')
+        result = search.search('web')
+        self.failUnlessEqual(result['total'], 2)
+        self.failUnlessEqual(result['facets']['type'], {'server': 1, 'switch': 1})
+        self.failUnlessEqual(result['facets']['datacentre'], {1: 2})
+        self.failUnlessEqual(self.hits('web', type='server', os='Debian'), [('device', self.server.pk)])
+        self.failUnlessEqual(search.search('eth0')['facets']['os'], {'Debian': 1})
+
+    def test_sync(self):
+        self.server.name = 'db-01'
+        self.server.os = 'FreeBSD'
+        self.server.save()
+        self.failUnlessEqual(self.hits('web01'), [])
+        self.failUnlessEqual(search.search('eth0')['facets']['os'], {'FreeBSD': 1})
+        room = Serverroom.objects.create(datacentre=Datacentre.objects.create(name='DC 2'), name='Room 2', floor=0, maxrows=1, maxcolumns=1)
+        self.rack.serverroom = room
+        self.rack.save()
+        self.failUnlessEqual(search.search('db01')['facets']['serverroom'], {room.pk: 1})
+        Device.objects.get(pk=self.server.pk).delete()
+        self.failUnlessEqual(search.search('db01 eth0 wd')['total'], 0)
+        self.failIf(SearchEntry.objects.filter(device_id=self.server.pk).exists())
+
+    def test_memory_engine(self):
+        memory = search.MemoryEngine()
+        for query in ('dell r71', '00:1a:2b', 'web', 's'):
+            terms = search.terms(query)
+            self.failUnlessEqual(memory.search(terms, {}, 50), search.engine().search(terms, {}, 50))
+
+    def test_memory_engine_changes(self):
+        sql = search.engine()
+        memory = search._engine['engine'] = search.MemoryEngine()
+        self.addCleanup(search._engine.clear)
+        memory.search(search.terms('web'), {}, 50)
+        loaded = memory.generation
+        self.server.name = 'db-01'
+        self.server.save()
+        self.disk.delete()
+        Switch.objects.create(rack=self.rack, name='web-sw', kind='0', os='IOS')
+        self.rack.serverroom = Serverroom.objects.create(datacentre=Datacentre.objects.create(name='DC 2'), name='Room 2',
+                                                         floor=0, maxrows=1, maxcolumns=1)
+        self.rack.save()
+        for query in ('web', 'db01', 'wd', 'eth0', 's'):
+            terms = search.terms(query)
+            self.failUnlessEqual(memory.search(terms, {}, 50), sql.search(terms, {}, 50))
+        self.failUnlessEqual(memory.generation, loaded)
+        search.rebuild()
+        memory.search(search.terms('web'), {}, 50)
+        self.failIfEqual(memory.generation, loaded)
+
+    def test_bulk_and_view(self):
+        Importer().run(iter([{'type': 'server', 'rack': 1, 'name': 'imported', 'serialnr': 'IMP-9'},
+                             {'type': 'harddisk', 'parent': 'imported', 'size': 100.0, 'ide': '1', 'serialnr': 'IMP-DISK'}]))
+        self.failUnlessEqual(search.search('imp')['facets']['type'], {'server': 1, 'harddisk': 1})
+        search.rebuild()
+        self.failUnlessEqual(search.search('imp')['total'], 2)
+        User.objects.create_user('user', 'user@example.com', 'secret')
+        self.client.login(username='user', password='secret')
+        result = json.loads(self.client.get('/assets/search', {'q': 'imp', 'datacentre': '1'}).content)
+        self.failUnlessEqual(result['total'], 2)
+        self.failUnlessEqual(result['names']['serverroom'], {'1': 'Serverroom 1'})
+        self.failUnlessEqual(self.client.get('/assets/search', {'q': 'imp', 'datacentre': 'abc'}).status_code, 400)
+        result = json.loads(self.client.get('/assets/search', {'q': 'imp', 'limit': '-5'}).content)
+        self.failUnlessEqual((result['total'], len(result['hits'])), (2, 1))
+
+class AuditTest(TestCase):
+    def setUp(self):
+        self.rack = Rack.objects.get(pk=1)
+        self.other = Rack.objects.create(name='Rack B', height=42, kind='0', row=2, column=1, serverroom_id=1)
+
+    def mark(self):
+        time.sleep(0.01)
+        when = datetime.now()
+        time.sleep(0.01)
+        return when
+
+    def test_diffs(self):
+        nic = Networkinterface.objects.get(pk=1)
+        nic.ip4 = '192.168.50.20'
+        nic.save()
+        change = audit.history(nic).reverse()[0]
+        self.failUnlessEqual((change.action, json.loads(change.diff)), ('u', {'ip4': ['', '192.168.50.20']}))
+        maintenance = Maintenance.objects.get(pk=1)
+        maintenance.end_date = date(2011, 1, 12)
+        maintenance.save()
+        self.failUnlessEqual(json.loads(audit.history(maintenance)[0].diff), {'end_date': ['2011-01-11', '2011-01-12']})
+        server = Server.objects.get(pk=6)
+        server.functions.add(DeviceFunction.objects.get(pk=1))
+        self.failUnlessEqual(json.loads(audit.history(server).reverse()[0].diff), {'functions': [[], [1]]})
+
+    def test_batched_per_request(self):
+        before = Change.objects.count()
+        audit.begin(user_id=42)
+        device = Switch.objects.create(rack=self.rack, name='sw', kind='0')
+        device.rack = self.other
+        device.save()
+        self.failUnlessEqual(Change.objects.count(), before)
+        audit.end()
+        changes = audit.history(device)
+        self.failUnlessEqual([(c.action, c.user_id, c.rack_id) for c in changes], [('c', 42, None), ('u', 42, 1)])
+
+    def test_failed_request(self):
+        from assetmanager.middleware import AuditMiddleware
+        before = Change.objects.count()
+        request = HttpRequest()
+        AuditMiddleware().process_request(request)
+        # the test case runs in a transaction, like a commit_on_success view
+        self.rack.name = 'renamed'
+        self.rack.save()
+        AuditMiddleware().process_exception(request, ValueError())
+        AuditMiddleware().process_response(request, HttpResponse())
+        self.failUnlessEqual(Change.objects.count(), before)
+
+    def test_point_in_time(self):
+        old = self.mark()
+        server = Server.objects.create(rack=self.rack, name='mover')
+        created = self.mark()
+        server.rack = self.other
+        server.save()
+        moved = self.mark()
+        Device.objects.get(pk=server.pk).delete()
+        names = lambda rack, when: [d.name for d in audit.rack_contents(rack, when) if d.pk >= server.pk]
+        self.failUnlessEqual(names(self.rack, old), [])
+        self.failUnlessEqual(names(self.rack, created), ['mover'])
+        self.failUnlessEqual(names(self.other, created), [])
+        self.failUnlessEqual(names(self.other, moved), ['mover'])
+        self.failUnlessEqual(names(self.other, datetime.now()), [])
+        self.failUnlessEqual(audit.as_of(Server, server.pk, created).rack_id, self.rack.pk)
+        self.failUnlessEqual(audit.history(server).filter(action='d').count(), 1)
+        # devices older than the log are rebuilt from their current row
+        self.failUnlessEqual(audit.as_of(Device.objects.get(pk=7), when=old).name, Device.objects.get(pk=7).name)
+
+    def test_maintenance_flag(self):
+        today = date.today()
+        window = Maintenance.objects.create(target_id=6, start_date=today, scheduled=True)
+        before = self.mark()
+        window.delete()
+        diffs = [json.loads(c.diff) for c in audit.history(Device.objects.get(pk=6)) if 'maintainance' in c.diff]
+        self.failUnlessEqual(diffs, [{'maintainance': [False, True]}, {'maintainance': [True, False]}])
+        self.failUnless(audit.as_of(Device, 6, before).maintainance)
+        Device.objects.filter(pk=3).update(maintainance=True)
+        maintenance.refresh()
+        self.failUnlessEqual(json.loads(audit.history(Device.objects.get(pk=3)).reverse()[0].diff),
+                             {'maintainance': [True, False]})
+
+    def test_import(self):
+        Importer().run(iter([{'type': 'device', 'rack': 1, 'name': 'plain'}, {'type': 'server', 'rack': 1, 'name': 'typed'}]))
+        for name in ('plain', 'typed'):
+            changes = audit.history(Device.objects.get(name=name))
+            self.failUnlessEqual([(c.action, json.loads(c.diff)['name']) for c in changes], [('c', name)])
+
+class MaintenanceTest(TestCase):
+    def setUp(self):
+        topology.invalidate()
+        self.switch = Switch.objects.get(pk=7)
+        self.server = Server.objects.get(pk=6)
+        kind = NetworkHardInterface.objects.get(pk=1)
+        remote = Networkinterface.objects.create(device=self.switch, subnet_id=1, kind=kind, name='port1', vlan=1)
+        Networkinterface.objects.create(device=self.server, subnet_id=1, kind=kind, name='eth0', vlan=1, connectedTo=remote)
+        self.other = Server.objects.create(rack_id=1, name='other')
+        Networkinterface.objects.create(device=self.other, subnet_id=1, kind=kind, name='eth0', vlan=1,
+            connectedTo=Networkinterface.objects.create(device=self.switch, subnet_id=1, kind=kind, name='port2', vlan=1))
+
+    def window(self, device, start, end=None):
+        return Maintenance.objects.create(target=device, start_date=start, end_date=end, scheduled=True)
+
+    def test_overlapping(self):
+        self.window(self.server, date(2011, 2, 1), date(2011, 2, 3))
+        self.window(self.other, date(2011, 3, 1))
+        days = lambda start, end=None: sorted(maintenance.under_maintenance(start, end).values_list('pk', flat=True))
+        self.failUnlessEqual(days(date(2011, 1, 10), date(2011, 2, 1)), [6, 7])
+        self.failUnlessEqual(days(date(2011, 2, 4), date(2011, 2, 28)), [])
+        self.failUnlessEqual(days(date(2020, 1, 1)), [self.other.pk])
+
+    def test_flag(self):
+        today = date.today()
+        window = self.window(self.server, today - timedelta(days=1), today + timedelta(days=1))
+        self.failUnless(Device.objects.get(pk=6).maintainance)
+        window.target = self.other
+        window.save()
+        self.failIf(Device.objects.get(pk=6).maintainance)
+        self.failUnless(Device.objects.get(pk=self.other.pk).maintainance)
+        window.delete()
+        self.failIf(Device.objects.get(pk=self.other.pk).maintainance)
+        Device.objects.filter(pk=3).update(maintainance=True)
+        self.window(self.server, today)
+        self.failUnlessEqual(maintenance.refresh(), 1)
+
+    def test_conflicts(self):
+        a = self.window(self.server, date(2011, 2, 1), date(2011, 2, 3))
+        b = self.window(self.other, date(2011, 2, 3), date(2011, 2, 5)) # same switch
+        c = self.window(VM.objects.get(pk=9), date(2011, 2, 2)) # guest of the server
+        self.window(Device.objects.get(pk=3), date(2011, 2, 1), date(2011, 2, 9)) # unrelated
+        e = self.window(self.server, date(2011, 2, 6), date(2011, 2, 7))
+        self.failUnlessEqual(sorted(maintenance.conflicts(1)), [(a.pk, b.pk), (a.pk, c.pk), (c.pk, e.pk)])
+        self.failUnlessEqual(maintenance.conflicts_with(self.switch, date(2011, 2, 5), date(2011, 2, 5)), [c, b])
+        self.failUnlessEqual(maintenance.conflicts_with(self.server, date(2011, 2, 2), date(2011, 2, 2), exclude=a), [c])
+
+class ApiTest(TestCase):
+    def setUp(self):
+        User.objects.create_user('user', 'user@example.com', 'secret')
+        self.client.login(username='user', password='secret')
+
+    def get(self, path, **params):
+        response = self.client.get(path, params)
+        self.failUnlessEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_pages(self):
+        ids = list(Device.objects.order_by('pk').values_list('pk', flat=True))
+        seen = []
+        page = self.get('/api/device/', limit=2, fields='name')
+        while True:
+            self.failUnless(all(sorted(obj) == ['id', 'name'] for obj in page['objects']))
+            seen.extend(obj['id'] for obj in page['objects'])
+            if page['next'] is None:
+                break
+            page = self.get(page['next'])
+        self.failUnlessEqual(seen, ids)
+        self.failUnlessEqual(self.get('/api/server/6/')['name'], Server.objects.get(pk=6).name)
+        self.failUnlessEqual(self.client.get('/api/device/', {'fields': 'nonsense'}).status_code, 400)
+        self.failUnlessEqual(self.client.get('/api/device/', {'embed': 'nonsense'}).status_code, 400)
+
+    def test_bad_parameters(self):
+        for path, params in (('/api/device/', {'height': 'abc'}), ('/api/device/', {'rack': 'abc'}),
+                             ('/api/maintenance/', {'start_date': 'notadate'}), ('/api/server/', {'embed': 'functions'}),
+                             ('/api/device/', {'after': 'x'})):
+            self.failUnlessEqual(self.client.get(path, params).status_code, 400)
+        self.failUnlessEqual(len(self.get('/api/device/', limit='-5')['objects']), 1)
+        self.failUnlessEqual(len(self.get('/api/device/', rack='1', maintainance='False')['objects']), 9)
+
+    def test_embed(self):
+        kind = NetworkHardInterface.objects.get(pk=1)
+        for device in Device.objects.all():
+            Networkinterface.objects.create(device=device, subnet_id=1, kind=kind, name='eth9', vlan=1)
+        self.get('/api/datacentre/') # the first request writes the session
+        with CaptureQueries() as queries:
+            page = self.get('/api/device/', embed='rack.serverroom,networkinterface_set', fields='name')
+        # the session, the user, the devices and one query per relation
+        self.failUnlessEqual(len(queries), 6)
+        for obj in page['objects']:
+            self.failUnlessEqual(obj['rack']['serverroom']['name'], Serverroom.objects.get(rack=obj['rack']['id']).name)
+            self.failUnlessEqual(sorted(nic['id'] for nic in obj['networkinterface_set']),
+                                 sorted(Networkinterface.objects.filter(device=obj['id']).values_list('pk', flat=True)))
+
+    def test_not_modified(self):
+        share_cache(self, False)
+        self.failIf(self.client.get('/api/rack/').has_header('ETag'))
+        share_cache(self)
+        response = self.client.get('/api/rack/', {'embed': 'serverroom'})
+        self.failUnless(response.has_header('Last-Modified'))
+        with CaptureQueries() as queries:
+            again = self.client.get('/api/rack/', {'embed': 'serverroom'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.failUnlessEqual(again.status_code, 304)
+        self.failUnlessEqual(len(queries), 2)
+        Serverroom.objects.get(pk=1).save()
+        self.failUnlessEqual(self.client.get('/api/rack/', {'embed': 'serverroom'},
+                                             HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        response = self.client.get('/api/device/1/')
+        Maintenance.objects.create(target_id=1, start_date=date.today(), scheduled=True)
+        self.failUnless(self.get('/api/device/1/')['maintainance'])
+        self.failUnlessEqual(self.client.get('/api/device/1/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+class LifecycleTest(TestCase):
+    def setUp(self):
+        self.today = date(2011, 6, 1)
+        self.server = Server.objects.get(pk=6)
+        self.array = RaidArray.objects.create(name='md0', raidType='1')
+        self.disks = [Harddisk.objects.create(parent=self.server, array=self.array, ide='1', size=500.0,
+                                              serialnr='LC%d' % i, enddate=self.today + timedelta(days=days))
+                      for i, days in enumerate((10, 40, 200))]
+
+    def day(self, days):
+        return self.today + timedelta(days=days)
+
+    def test_report(self):
+        self.server.enddate = self.day(75)
+        self.server.save()
+        report = json.loads(lifecycle.update(self.today).report)
+        self.failUnlessEqual(report['counts'], {'device': {'30': 0, '60': 0, '90': 1}, 'harddisk': {'30': 1, '60': 1, '90': 0}})
+        self.failUnlessEqual([disk['serialnr'] for disk in report['harddisks']], ['LC0', 'LC1'])
+        self.failUnlessEqual(report['devices'][0]['name'], self.server.name)
+        array = report['arrays'][0]
+        self.failUnlessEqual((array['name'], array['disks'], array['expiring'], array['devices']), ('md0', 3, 2, [6]))
+        self.failUnlessEqual(report['parents'][0]['expiring'], 2)
+        User.objects.create_user('user', 'user@example.com', 'secret')
+        self.client.login(username='user', password='secret')
+        self.failUnlessEqual(json.loads(self.client.get('/assets/lifecycle').content), report)
+        self.failUnlessEqual(json.loads(self.client.get('/assets/lifecycle', {'day': '2011-06-01'}).content), report)
+
+    def test_cached_report(self):
+        self.failUnlessEqual(lifecycle.report(), None)
+        snapshot = lifecycle.update(self.today)
+        self.failUnlessEqual(lifecycle.report(), snapshot.report)
+        # made by another process, which can't reach this one's cache
+        LifecycleReport.objects.create(day=self.day(1), generated=datetime.now(), horizon=lifecycle.HORIZON,
+                                       last_change=snapshot.last_change, state='', report='{}')
+        self.failUnlessEqual(lifecycle.report(), '{}')
+        self.failUnlessEqual(lifecycle.report(self.today), snapshot.report)
+
+    def test_incremental(self):
+        lifecycle.update(self.today)
+        disk = self.disks[1]
+        disk.enddate = self.day(300)
+        disk.save()
+        Harddisk.objects.create(parent=self.server, ide='1', serialnr='LC9', enddate=self.day(20))
+        Harddisk.objects.filter(pk=self.disks[2].pk).update(enddate=self.day(93))
+        with CaptureQueries() as queries:
+            report = json.loads(lifecycle.update(self.day(5)).report)
+        ranges = [q['sql'] for q in queries.queries if 'enddate" >=' in q['sql'] and ' IN ' not in q['sql']]
+        # the changed disks by id, and only the five days the window moved forward
+        self.failUnlessEqual(len(ranges), 2)
+        self.failUnless(all('>= 2011-08-31' in sql for sql in ranges))
+        self.failUnlessEqual([disk['serialnr'] for disk in report['harddisks']], ['LC0', 'LC9', 'LC2'])
+        full = json.loads(lifecycle.update(self.day(5), full=True).report)
+        self.failUnlessEqual(full, report)
+        self.failUnlessEqual(json.loads(lifecycle.update(self.day(15)).report)['harddisks'][0]['serialnr'], 'LC9')
+
+class PlacementTest(TestCase):
+    def setUp(self):
+        placement.invalidate()
+        self.hosts = [Server.objects.create(rack_id=1, name='host%d' % i, ram=ram, cpu=cpu)
+                      for i, (ram, cpu) in enumerate(((16384, '2x Xeon E5620 (8 cores)'), (32768, '16'), (8192, '')))]
+
+    def vm(self, host, ram, cpu=''):
+        return VM.objects.create(rack_id=1, name='guest', server=host, ram=ram, cpu=cpu)
+
+    def load(self, host):
+        load = HostLoad.objects.get(pk=host.pk)
+        return load.vms, load.vm_ram, load.vm_cores, load.free_ram
+
+    def test_cores(self):
+        self.failUnlessEqual([placement.cores(text) for text in ('8', '4 vCPU', '2x Xeon E5620 (8 cores)', 'Xeon E5620', '')],
+                             [8, 4, 8, 0, 0])
+
+    def test_loads(self):
+        a, b, c = self.hosts
+        self.failUnlessEqual(HostLoad.objects.get(pk=a.pk).cores, 8)
+        vm = self.vm(a, 4096, '2 vcpus')
+        self.vm(a, 8192)
+        self.failUnlessEqual(self.load(a), (2, 12288, 3, 4096))
+        vm.server = b
+        vm.save()
+        self.failUnlessEqual(self.load(a), (1, 8192, 1, 8192))
+        self.failUnlessEqual(self.load(b), (1, 4096, 2, 28672))
+        vm.delete()
+        self.failUnlessEqual(self.load(b), (0, 0, 0, 32768))
+        self.vm(c, 16384)
+        self.failUnlessEqual(list(placement.overcommitted().values_list('pk', flat=True)), [c.pk])
+        before = sorted(HostLoad.objects.values_list('pk', 'vms', 'vm_ram', 'vm_cores', 'free_ram'))
+        placement.rebuild()
+        self.failUnlessEqual(sorted(HostLoad.objects.values_list('pk', 'vms', 'vm_ram', 'vm_cores', 'free_ram')), before)
+
+    def test_server_edits(self):
+        a = self.hosts[0]
+        a.comments = 'rack 1, top'
+        with CaptureQueries() as queries:
+            a.save()
+        self.failIf([query for query in queries.queries if 'hostload' in query['sql']])
+        a.ram = 8192
+        a.save()
+        self.failUnlessEqual(HostLoad.objects.get(pk=a.pk).free_ram, 8192)
+        vm = self.vm(a, 1024)
+        vm.comments = 'web'
+        with CaptureQueries() as queries:
+            vm.save()
+        self.failIf([query for query in queries.queries if 'hostload' in query['sql']])
+        vm.server = self.hosts[1]
+        vm.save()
+        self.failUnlessEqual(HostLoad.objects.get(pk=a.pk).free_ram, 8192)
+        self.failUnlessEqual(HostLoad.objects.get(pk=self.hosts[1].pk).vms, 1)
+
+    def test_deleted_host(self):
+        c = self.hosts[2]
+        self.failUnlessEqual(placement.best_hosts(1024)[0][0], c.pk)
+        Device.objects.get(pk=c.pk).delete()
+        self.failIf(c.pk in [host for host, ram, cores in placement.best_hosts(1024)])
+
+    def test_process_local_cache(self):
+        share_cache(self, False)
+        plan = placement.placement()
+        self.failUnless(placement.placement() is plan)
+        request_started.send(sender=None)
+        self.failIf(placement.placement() is plan)
+
+    def test_best_and_evacuate(self):
+        a, b, c = self.hosts
+        self.vm(a, 9216)
+        self.failUnlessEqual([host for host, ram, cores in placement.best_hosts(6000)], [a.pk, c.pk, b.pk])
+        self.failUnlessEqual([host for host, ram, cores in placement.best_hosts(10000)], [b.pk])
+        # a has 8 cores, 32 with overcommit, b 64 and c doesn't say
+        self.failUnlessEqual([host for host, ram, cores in placement.best_hosts(1024, 40)], [c.pk, b.pk])
+        self.failUnlessEqual([host for host, ram, cores in placement.best_hosts(1024, 70)], [c.pk])
+        for ram in (20000, 6000, 4000):
+            self.vm(b, ram)
+        moves, unplaced = placement.evacuate(b)
+        self.failUnlessEqual([(VM.objects.get(pk=vm).ram, host) for vm, host in moves], [(6000, a.pk), (4000, c.pk)])
+        self.failUnlessEqual([VM.objects.get(pk=vm).ram for vm in unplaced], [20000])
+        # planning leaves the loaded placement alone
+        self.failUnlessEqual(placement.best_hosts(8000)[0][0], c.pk)
+
+class StorageTest(TestCase):
+    def setUp(self):
+        self.server = Server.objects.get(pk=6)
+        self.shelf = DiskArray.objects.get(pk=1)
+
+    def array(self, level, parent, sizes):
+        array = RaidArray.objects.create(name='md', raidType=level)
+        for size in sizes:
+            Harddisk.objects.create(parent=parent, array=array, ide='3', size=size)
+        return array
+
+    def capacity(self, array):
+        capacity = ArrayCapacity.objects.get(pk=array.pk)
+        return capacity.disks, capacity.raw, capacity.usable, capacity.valid
+
+    def test_levels(self):
+        self.failUnlessEqual(storage.capacity('5', [100, 100, 80]), (280.0, 160.0, True))
+        self.failUnlessEqual(storage.capacity('6', [100] * 3), (300.0, 0.0, False))
+        self.failUnlessEqual(storage.capacity('7', [100] * 6), (600.0, 300.0, True))
+        self.failUnlessEqual(storage.capacity('2', [100] * 7), (700.0, 400.0, True))
+        self.failUnlessEqual(storage.capacity('10', [100, 50]), (150.0, 150.0, True))
+        self.failUnlessEqual(RaidArray.objects.get(pk=RaidArray.objects.create(name='jbod', raidType='10').pk).raidType, '10')
+
+    def test_incremental(self):
+        mirror = self.array('1', self.server, [500, 500])
+        self.failUnlessEqual(self.capacity(mirror), (2, 1000.0, 500.0, True))
+        ArrayCapacity.objects.filter(pk=mirror.pk).delete()
+        storage.refresh([mirror.pk])
+        self.failUnlessEqual(ArrayCapacity.objects.get(pk=mirror.pk).server_id, self.server.pk)
+        disk = Harddisk.objects.create(parent=self.server, array=mirror, ide='3', size=300)
+        self.failUnlessEqual(self.capacity(mirror), (3, 1300.0, 300.0, True))
+        raid5 = self.array('5', self.shelf, [1000, 1000])
+        self.failUnlessEqual(self.capacity(raid5), (2, 2000.0, 0.0, False))
+        disk.array = raid5
+        disk.save()
+        self.failUnlessEqual(self.capacity(mirror), (2, 1000.0, 500.0, True))
+        self.failUnlessEqual(self.capacity(raid5), (3, 2300.0, 600.0, True))
+        mirror.raidType = '0'
+        mirror.save()
+        self.failUnlessEqual(self.capacity(mirror), (2, 1000.0, 1000.0, True))
+        disk.delete()
+        self.failUnlessEqual(self.capacity(raid5), (2, 2000.0, 0.0, False))
+        self.failUnlessEqual(storage.check(), [])
+
+    def test_totals(self):
+        self.array('1', self.server, [500, 500])
+        self.array('5', self.shelf, [1000, 1000, 1000])
+        self.failUnlessEqual(storage.device_capacity(self.shelf)['usable'], 2000.0)
+        self.failUnlessEqual(storage.server_capacity(self.server)['arrays'], 1)
+        self.shelf.conntectTo = self.server
+        self.shelf.save()
+        # the fixture array of the shelf is a RAID 5+1 of one disk, so unusable
+        self.failUnlessEqual(storage.server_capacity(self.server), {'arrays': 3, 'disks': 6, 'raw': 5024.0, 'usable': 2500.0})
+        self.failUnlessEqual(storage.totals('datacentre'), {1: {'arrays': 3, 'disks': 6, 'raw': 5024.0, 'usable': 2500.0}})
+
+class BenchmarkTest(TestCase):
+    SIZES = dict(seed=7, datacentres=1, rooms=1, racks=2, devices=4, blade_every=2, blades=2, vms=2)
+
+    def inventory(self, prefix):
+        devices = sorted((name[len(prefix):], rack.startswith(prefix)) for name, rack in
+                         Device.objects.filter(name__startswith=prefix + '-').values_list('name', 'rack__name'))
+        disks = sorted((parent[len(prefix):], size) for parent, size in
+                       Harddisk.objects.filter(parent__name__startswith=prefix + '-').values_list('parent__name', 'size'))
+        return devices, disks
+
+    def test_generate(self):
+        counts = benchmark.Generator(prefix='a', **self.SIZES).run()
+        self.failUnlessEqual(counts['rack'], 3)
+        self.failUnlessEqual(Device.objects.filter(name__startswith='a-').exclude(name__startswith='a-vm-').count(), 10)
+        self.failUnlessEqual(counts['vm'], VM.objects.filter(name__startswith='a-').count())
+        blade = Rack.objects.get(name='a-dc1-room1-rack2-blade')
+        self.failUnlessEqual((blade.kind, blade.rack.name), ('2', 'a-dc1-room1-rack2'))
+        self.failUnlessEqual(Server.objects.filter(rack=blade).count(), 2)
+        self.failUnless(Networkinterface.objects.filter(device__name__startswith='a-').exists())
+        self.failUnlessEqual(storage.check(), [])
+        self.failUnlessEqual(counts['powerconnection'], PowerConnection.objects.count())
+        self.failUnlessEqual(power.check(), [])
+        benchmark.Generator(prefix='b', **self.SIZES).run()
+        self.failUnlessEqual(self.inventory('a'), self.inventory('b'))
+
+    def test_run(self):
+        result = benchmark.run(runs=3, only=['changelist.server', 'dropdown.vm', 'save.rack'])
+        self.failUnlessEqual(sorted(result['scenarios']), ['changelist.server', 'dropdown.vm', 'save.rack'])
+        for name, scenario in result['scenarios'].items():
+            self.failUnlessEqual(scenario['errors'], {})
+            self.failUnless(scenario['latency_ms']['p50'] <= scenario['latency_ms']['p99'])
+            self.failUnless(scenario['queries']['min'] > 0)
+        self.failUnlessEqual(result['scenarios']['changelist.server']['status'], {'200': 3})
+        self.failUnlessEqual(json.loads(json.dumps(result))['inventory']['server'], 1)
+        self.failIf([row for row in benchmark.compare(result, result) if row[-1]])
+        slower = json.loads(json.dumps(result))
+        slower['scenarios']['save.rack']['queries']['p50'] += 1
+        self.failUnlessEqual([row[0] for row in benchmark.compare(result, slower) if row[-1]], ['save.rack'])
+
+    def test_read_only(self):
+        database = settings.DATABASES['default']
+        engine = database['ENGINE']
+        database['ENGINE'] = 'django.db.backends.postgresql_psycopg2'
+        try:
+            names = [name for name, action in benchmark.scenarios(None, 1)]
+        finally:
+            database['ENGINE'] = engine
+        self.failUnless('changelist.server' in names)
+        self.failIf([name for name in names if benchmark.writes(name)])
+        self.failUnless('save.rack' in [name for name, action in benchmark.scenarios(None, 1)])
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.failUnlessEqual([benchmark.percentile(values, p) for p in (50, 90, 99, 100)], [50, 90, 99, 100])
+        self.failUnlessEqual(benchmark.percentile([4], 99), 4)
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.sample = getattr(settings, 'ASSETMANAGER_METRICS_SAMPLE', 0.1)
+        self.ips = getattr(settings, 'ASSETMANAGER_METRICS_IPS', ())
+        settings.ASSETMANAGER_METRICS_SAMPLE = 1.0
+        settings.ASSETMANAGER_METRICS_IPS = ()
+        metrics.registry.reset()
+        User.objects.create_user('user', 'user@example.com', 'secret')
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def tearDown(self):
+        settings.ASSETMANAGER_METRICS_SAMPLE = self.sample
+        settings.ASSETMANAGER_METRICS_IPS = self.ips
+
+    def test_analyse(self):
+        queries = [('SELECT %s', repr((1,)), 0.001)] * 2 + [('SELECT %s', repr((n,)), 0.001) for n in range(2, 12)]
+        self.failUnlessEqual(metrics.analyse(queries, 10), (1, {'SELECT %s': 12}))
+        self.failUnlessEqual(metrics.analyse(queries[:5], 10), (1, {}))
+
+    def test_requests(self):
+        self.client.login(username='user', password='secret')
+        self.client.get('/assets/search?q=server')
+        self.client.get('/api/rack/')
+        view = {'view': 'assetmanager.api.collection:rack'}
+        self.failUnlessEqual(metrics.registry.get('requests_total', status='200', **view), 1)
+        self.failUnlessEqual(metrics.registry.get('sampled_requests_total', **view), 1)
+        self.failUnless(metrics.registry.get('request_queries', **view).sum > 0)
+        self.failUnless(metrics.registry.get('cache_requests_total', result='hit', **view) > 0)
+        self.failUnless(metrics.registry.get('request_seconds', view='assetmanager.views.search'))
+        self.client.login(username='admin', password='admin')
+        response = self.client.get('/metrics')
+        self.failUnlessEqual(response.status_code, 200)
+        self.failUnless('shadhavar_requests_total{status="200",view="assetmanager.api.collection:rack"} 1\n' in response.content)
+        self.failUnless('shadhavar_request_seconds_bucket{view="assetmanager.api.collection:rack",le="+Inf"} 1\n' in response.content)
+
+    def test_repeats(self):
+        sample = metrics.Sample()
+        sample.queries = [('SELECT name FROM rack WHERE id = %s', repr((n,)), 0.001) for n in range(20)]
+        metrics.record('list', 200, 0.1, sample)
+        self.failUnlessEqual(metrics.registry.get('repeated_query_requests_total', view='list'), 1)
+        self.failUnlessEqual(metrics.registry.get('repeated_statements_total', view='list',
+                                                  statement='SELECT name FROM rack WHERE id = %s'), 20)
+        self.failUnlessEqual(metrics.registry.get('duplicate_queries_total', view='list'), None)
+
+    def test_access(self):
+        self.failUnlessEqual(self.client.get('/metrics').status_code, 403)
+        self.client.login(username='user', password='secret')
+        self.failUnlessEqual(self.client.get('/metrics').status_code, 403)
+        settings.ASSETMANAGER_METRICS_IPS = ('192.0.2.1',)
+        self.client.logout()
+        self.failUnlessEqual(self.client.get('/metrics', REMOTE_ADDR='192.0.2.1').status_code, 200)
+        self.failUnlessEqual(self.client.get('/metrics').status_code, 403)
+        self.client.login(username='admin', password='admin')
+        self.failUnlessEqual(self.client.get('/metrics').status_code, 200)
+
+class AdminTest(TestCase):
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        cache.clear()
+
+    def test_changelists(self):
+        from django.contrib import admin
+        admin.autodiscover()
+        for model in admin.site._registry:
+            response = self.client.get('/admin/%s/%s/' % (model._meta.app_label, model._meta.object_name.lower()))
+            self.failUnlessEqual(response.status_code, 200, model)
+
+    def test_rack_filter(self):
+        response = self.client.get('/admin/assetmanager/device/')
+        self.failUnless('?rack__serverroom__id__exact=1' in response.content)
+        response = self.client.get('/admin/assetmanager/device/', {'rack__serverroom__id__exact': 1})
+        self.failUnlessEqual(response.context['cl'].result_count, Device.objects.filter(rack__serverroom=1).count())
+        self.failUnless('rack__id__exact=1' in response.content)
+        response = self.client.get('/admin/assetmanager/device/', {'rack__serverroom__id__exact': 1, 'rack__id__exact': 1})
+        self.failUnlessEqual(response.context['cl'].result_count, Device.objects.filter(rack=1).count())
+
+    def test_raw_id_widgets(self):
+        response = self.client.get('/admin/assetmanager/networkinterface/add/')
+        self.failUnless('class="vForeignKeyRawIdAdminField"' in response.content)
+        self.failIf('<select name="device"' in response.content)
+
+    def test_counts(self):
+        servers = Server.objects.all()
+        total = Server.objects.count()
+        self.failUnlessEqual(counts.count(servers), total)
+        with CaptureQueries() as queries:
+            self.failUnlessEqual(counts.count(Server.objects.all()), total)
+        self.failUnlessEqual(len(queries), 0)
+        self.failUnlessEqual(counts.count(Server.objects.filter(pk__in=[])), 0)
+        server = Server.objects.all()[0]
+        server.pk = server.id = None
+        server.save()
+        self.failUnlessEqual(counts.count(Server.objects.all()), total + 1)
+        estimate, counts.estimate = counts.estimate, lambda queryset: counts.ESTIMATE_ABOVE + 1
+        try:
+            self.failUnlessEqual(counts.count(Server.objects.all()), counts.ESTIMATE_ABOVE + 1)
+        finally:
+            counts.estimate = estimate
+
+class WorkerTest(TestCase):
+    urls = 'worker_urls'
+
+    def test_urls(self):
+        from django.core.urlresolvers import resolve, Resolver404
+        self.failUnlessEqual(resolve('/api/datacentre/', 'worker_urls')[2], {'resource': 'datacentre'})
+        self.failUnlessRaises(Resolver404, resolve, '/admin/', 'worker_urls')
+        self.failUnlessRaises(Resolver404, resolve, '/accounts/login/', 'worker_urls')
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.failUnlessEqual(self.client.get('/api/datacentre/').status_code, 200)
+
+    def test_startup(self):
+        import os
+        result = benchmark.startup(os.environ['DJANGO_SETTINGS_MODULE'], '/metrics', 1)
+        # anonymous, so refused, but only after the whole stack has loaded
+        self.failUnlessEqual(result['status'], {'403': 1})
+        self.failUnless(result['first_request_ms']['p50'] <= result['process_ms']['p50'])
+        self.failUnless(result['rss_mb']['p50'] > 0)
+
+class AllocationTest(TestCase):
+    def setUp(self):
+        self.lan = Subnet.objects.create(networkaddr4='10.9.0.0', subnetaddr4='255.255.255.248',
+                                         networkaddr6='2001:db8:9::', subnetaddr6='64')
+        self.device = Device.objects.get(pk=6)
+        self.kind = NetworkHardInterface.objects.get(pk=1)
+
+    def interface(self, ip4, vlan=None, subnet=None):
+        return Networkinterface.objects.create(device=self.device, subnet=subnet or self.lan, kind=self.kind,
+                                               name='eth', ip4=ip4, vlan=vlan)
+
+    def usage(self):
+        return SubnetUsage.objects.get(subnet=self.lan, family=4)
+
+    def test_allocate(self):
+        self.interface('10.9.0.2')
+        self.failUnlessEqual(allocation.allocate(self.lan), ['10.9.0.1'])
+        self.failUnlessEqual(allocation.allocate(self.lan, 2, note='web'), ['10.9.0.3', '10.9.0.4'])
+        self.failUnlessEqual(AddressReservation.objects.get(address='10.9.0.4').note, 'web')
+        self.interface('10.9.0.5')
+        self.failUnlessEqual(self.usage().used, 5)
+        self.failUnlessEqual(allocation.allocate(self.lan), ['10.9.0.6'])
+        self.failUnlessRaises(allocation.SubnetFull, allocation.allocate, self.lan)
+        self.failUnless(allocation.release('10.9.0.3'))
+        self.failUnlessEqual(allocation.allocate(self.lan), ['10.9.0.3'])
+        Networkinterface.objects.filter(ip4='10.9.0.2').delete()
+        self.failUnlessEqual(allocation.allocate(self.lan), ['10.9.0.2'])
+        self.failUnlessEqual(sorted(AddressReservation.objects.values_list('packed', flat=True)),
+                             ['0a090001', '0a090002', '0a090003', '0a090004', '0a090006'])
+
+    def test_optimistic(self):
+        allocation.allocate(self.lan)
+        # another worker allocated 10.9.0.2 since this one read the usage
+        usage = self.usage()
+        SubnetUsage.objects.filter(pk=usage.pk).update(generation=usage.generation + 1, bitmap='%x' % 0b11, used=2)
+        AddressReservation.objects.create(subnet=self.lan, family=4, packed='0a090002', address='10.9.0.2', created=datetime.now())
+        self.failUnlessEqual(allocation.allocate(self.lan), ['10.9.0.3'])
+        # an overlapping subnet reserved 10.9.0.4, which this bitmap doesn't show
+        AddressReservation.objects.create(subnet=self.lan, family=4, packed='0a090004', address='10.9.0.4', created=datetime.now())
+        self.failUnlessEqual(allocation.allocate(self.lan), ['10.9.0.5'])
+        self.failUnlessEqual(AddressReservation.objects.count(), 5)
+
+    def test_allocator(self):
+        self.interface('10.9.0.3')
+        allocator = allocation.Allocator(self.lan, note='batch', block_size=4)
+        self.failUnlessEqual([allocator.next() for i in range(2)], ['10.9.0.1', '10.9.0.2'])
+        self.failUnlessEqual(self.usage().used, 5)
+        allocator.close()
+        self.failUnlessEqual(sorted(allocation.allocate(self.lan, 3)), ['10.9.0.4', '10.9.0.5', '10.9.0.6'])
+        self.failUnlessEqual(sorted(AddressReservation.objects.filter(note='batch').values_list('address', flat=True)),
+                             ['10.9.0.1', '10.9.0.2'])
+        self.failUnlessRaises(allocation.SubnetFull, allocator.next)
+
+    def test_interface_takes_reservation(self):
+        address = allocation.allocate(self.lan)[0]
+        nic = self.interface(address)
+        self.failIf(AddressReservation.objects.filter(address=address).exists())
+        self.failUnlessEqual(self.usage().used, 1)
+        nic.delete()
+        self.failUnlessEqual(self.usage().used, 0)
+
+    def test_sparse(self):
+        Networkinterface.objects.create(device=self.device, subnet=self.lan, kind=self.kind, name='eth', ip6='2001:db8:9::1')
+        self.failUnlessEqual(allocation.allocate(self.lan, 2, family=6), ['2001:db8:9::', '2001:db8:9::2'])
+        usage = SubnetUsage.objects.get(subnet=self.lan, family=6)
+        self.failUnlessEqual((usage.used, usage.size, usage.bitmap), (3, 2.0 ** 64, ''))
+        self.failUnlessEqual(allocation.utilisation(Subnet.objects.filter(pk=self.lan.pk), 6)[self.lan.pk]['used'], 3)
+
+    def test_utilisation(self):
+        other = Subnet.objects.create(networkaddr4='10.8.0.0', subnetaddr4='255.255.255.0')
+        self.interface('10.9.0.1', vlan=10)
+        self.interface('10.8.0.1', vlan=10, subnet=other)
+        self.interface('10.8.0.2', vlan=20, subnet=other)
+        allocation.allocate(self.lan)
+        usage = allocation.utilisation(Subnet.objects.filter(pk__in=[self.lan.pk, other.pk]))
+        self.failUnlessEqual(usage[self.lan.pk], {'size': 6, 'used': 2, 'free': 4, 'ratio': 2 / 6.0})
+        self.failUnlessEqual(usage[other.pk]['used'], 2)
+        vlans = allocation.vlan_utilisation()
+        self.failUnlessEqual(vlans[10]['subnets'], sorted([self.lan.pk, other.pk]))
+        self.failUnlessEqual((vlans[10]['interfaces'], vlans[10]['used'], vlans[10]['size']), (2, 4, 260))
+        Importer().run([{'type': 'networkinterface', 'device': 'Server 1', 'subnet': str(other.pk),
+                         'kind': self.kind.kind, 'name': 'eth9', 'ip4': '10.8.0.3'}])
+        self.failUnless(SubnetUsage.objects.get(subnet=other, family=4).stale)
+        self.failUnlessEqual(allocation.utilisation(Subnet.objects.filter(pk=other.pk))[other.pk]['used'], 3)
+
 __test__ = {"doctest": """
 Another way to test that 1 + 1 is equal to 2.
 
@@ -21,3 +1345,105 @@ Another way to test that 1 + 1 is equal to 2.
 True
 """}
 
+class PowerTest(TestCase):
+    def setUp(self):
+        power.invalidate()
+        self.ups_a = UPS.objects.get(pk=8)
+        self.ups_b = UPS.objects.create(rack_id=1, name='UPS 2', power=2000, monitoring='0', management='0')
+        self.pdu_a = PDU.objects.get(pk=4)
+        self.pdu_b = PDU.objects.create(rack_id=1, name='PDU 2', ammount=8, monitoring='0', management='0', draw=10)
+        self.pdu_a.draw = 10
+        self.pdu_a.save()
+        self.server = Server.objects.get(pk=6)
+        self.server.draw = 400
+        self.server.save()
+        self.switch = Switch.objects.get(pk=7)
+        self.switch.draw = 100
+        self.switch.save()
+        self.plug(self.pdu_a, self.ups_a)
+        self.plug(self.pdu_b, self.ups_b)
+        self.plug(self.server, self.pdu_a, 1)
+        self.plug(self.server, self.pdu_b, 1)
+        self.switch_a = self.plug(self.switch, self.pdu_a, 2)
+
+    def plug(self, device, source, outlet=None):
+        connection = PowerConnection(device=device, source=source, outlet=outlet)
+        connection.full_clean()
+        connection.save()
+        return connection
+
+    def loads(self):
+        return dict((pk, load) for pk, (connections, load, capacity) in power.loads().items())
+
+    def test_loads(self):
+        self.failUnlessEqual(self.loads(), {self.ups_a.pk: 310, self.ups_b.pk: 210, self.pdu_a.pk: 300, self.pdu_b.pk: 200})
+        self.failUnlessEqual(PowerLoad.objects.get(pk=self.ups_a.pk).capacity, 1000)
+        self.server.draw = 600
+        self.server.save()
+        self.failUnlessEqual(self.loads(), {self.ups_a.pk: 410, self.ups_b.pk: 310, self.pdu_a.pk: 400, self.pdu_b.pk: 300})
+        self.switch_a.delete()
+        self.failUnlessEqual(self.loads()[self.ups_a.pk], 310)
+        self.ups_a.power = 300
+        self.ups_a.save()
+        self.failUnlessEqual(list(power.overloaded().values_list('pk', flat=True)), [self.ups_a.pk])
+        self.server.delete()
+        self.failUnlessEqual(self.loads(), {self.ups_a.pk: 10, self.ups_b.pk: 10, self.pdu_a.pk: 0, self.pdu_b.pk: 0})
+        self.failUnlessEqual(power.check(), [])
+        before = sorted(PowerLoad.objects.values_list('pk', 'connections', 'load', 'capacity'))
+        power.rebuild()
+        self.failUnlessEqual(sorted(PowerLoad.objects.values_list('pk', 'connections', 'load', 'capacity')), before)
+
+    def test_rollups(self):
+        self.failUnlessEqual(rollups.rollup('serverroom', 1)['draw'], 520)
+        self.server.draw = 250
+        self.server.save()
+        device = Device.objects.get(pk=self.switch.pk)
+        device.draw = 50
+        device.save()
+        self.failUnlessEqual(rollups.rollup('rack', 1)['draw'], 320)
+        self.failUnlessEqual(rollups.check(), [])
+
+    def test_impact(self):
+        result = power.impact(self.ups_a)
+        self.failUnlessEqual(result['dark'], sorted([self.pdu_a.pk, self.switch.pk]))
+        self.failUnlessEqual(result['degraded'], [self.server.pk])
+        self.failUnlessEqual(result['loads'], {self.ups_a.pk: (310, 0), self.pdu_a.pk: (300, 0),
+                                               self.pdu_b.pk: (200, 400), self.ups_b.pk: (210, 410)})
+        self.failUnlessEqual(result['overloaded'], [])
+        self.failUnlessEqual(power.impact([self.pdu_a, self.pdu_b])['dark'], sorted([self.server.pk, self.switch.pk]))
+        self.ups_b.power = 400
+        self.ups_b.save()
+        self.failUnlessEqual(power.impact(self.ups_a.pk)['overloaded'], [self.ups_b.pk])
+        # the chain is loaded once and reused until something changes
+        with CaptureQueries() as queries:
+            power.impact(self.ups_b)
+        self.failUnlessEqual(len(queries), 0)
+        share_cache(self, False)
+        chain = power.chain()
+        request_started.send(sender=None)
+        self.failIf(power.chain() is chain)
+
+    def test_failed_delete(self):
+        # a delete that fails after its pre_delete must not hold back
+        # later refreshes, in this thread or any other
+        server = Server.objects.get(pk=self.server.pk)
+        power.device_pre_delete(Device, server)
+        self.failUnless(self.server.pk in power.deleting())
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(self.server.pk in power.deleting()))
+        thread.start()
+        thread.join()
+        self.failUnlessEqual(seen, [False])
+        del server
+        gc.collect()
+        self.failIf(self.server.pk in power.deleting())
+        PowerConnection.objects.filter(device=self.server, source=self.pdu_a).get().delete()
+        self.failUnlessEqual(self.loads()[self.pdu_a.pk], 100)
+
+    def test_validate(self):
+        self.failUnlessRaises(ValidationError, self.plug, self.server, self.switch)
+        self.failUnlessRaises(ValidationError, self.plug, self.switch, self.pdu_b, 9)
+        self.failUnlessRaises(ValidationError, self.plug, self.ups_a, self.pdu_a)
+        self.failUnlessRaises(ValidationError, self.plug, self.pdu_b, self.pdu_b)
+        self.plug(self.switch, self.pdu_b, 8)
+        self.failUnlessEqual(self.loads()[self.pdu_a.pk], 250)
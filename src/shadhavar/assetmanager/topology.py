@@ -0,0 +1,233 @@
+"""
+Physical topology of a datacentre as an in-memory graph.
+
+The graph is built from two bulk queries, one over Networkinterface
+(connectedTo cables) and one over the KVM connections, and answers path,
+reachability, blast radius and per-VLAN component questions without
+touching the database again. Built graphs are kept per process and thrown
+away when an interface or KVM connection changes anywhere, when a router
+comes or goes, or when a device, rack or serverroom moves; the token
+marking the current state lives in the cache so every process sharing it
+sees it. Without a shared cache (see assetmanager.caches) a graph is only
+kept until the next request starts.
+"""
+
+from collections import deque
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+
+from assetmanager.models import Device, Networkinterface, KVM, Rack, Router, Serverroom
+from assetmanager import caches, snapshot
+from assetmanager.signals import bulk_inserted
+
+GENERATION_KEY = 'assetmanager.topology.generation'
+GENERATION_TIMEOUT = 30 * 24 * 3600
+
+class Topology(object):
+    """
+    Devices are the nodes; every cable between two interfaces and every
+    KVM connection is an undirected edge. A device forwards between all of
+    its interfaces.
+    """
+    def __init__(self):
+        self.adjacency = {} # device id -> [(device id, local interface id, remote interface id)]
+        self.interfaces = {} # interface id -> (device id, vlan)
+        self.cables = [] # (interface id, interface id)
+        self.routers = set()
+        self._memo = {}
+
+    @classmethod
+    def load(cls, datacentre=None):
+        graph = cls()
+        interfaces = Networkinterface.objects.all()
+        kvms = KVM.connections.through.objects.all()
+        routers = Router.objects.all()
+        if datacentre is not None:
+            interfaces = interfaces.filter(device__rack__serverroom__datacentre=datacentre)
+            kvms = kvms.filter(kvm__rack__serverroom__datacentre=datacentre)
+            routers = routers.filter(rack__serverroom__datacentre=datacentre)
+        cables = []
+        for pk, device, connected, vlan in interfaces.values_list('pk', 'device', 'connectedTo', 'vlan').iterator():
+            graph.interfaces[pk] = (device, vlan)
+            graph.adjacency.setdefault(device, [])
+            if connected is not None:
+                cables.append((pk, connected))
+        seen = set()
+        for local, remote in cables:
+            if remote not in graph.interfaces or (remote, local) in seen:
+                continue # cable leaving the datacentre, or the other end was already added
+            seen.add((local, remote))
+            graph.add_edge(graph.interfaces[local][0], graph.interfaces[remote][0], local, remote)
+        for kvm, device in kvms.values_list('kvm', 'device').iterator():
+            graph.add_edge(kvm, device)
+        graph.routers = set(routers.values_list('pk', flat=True))
+        return graph
+
+    def add_edge(self, a, b, interface_a=None, interface_b=None):
+        if interface_a is not None:
+            self.cables.append((interface_a, interface_b))
+        self.adjacency.setdefault(a, []).append((b, interface_a, interface_b))
+        self.adjacency.setdefault(b, []).append((a, interface_b, interface_a))
+
+    def device_of(self, interface):
+        return self.interfaces[interface][0]
+
+    def reachable(self, device, without=()):
+        """
+        The set of devices reachable from device, never passing through
+        the devices in without.
+        """
+        return self._search(set([device]), without)[0]
+
+    def _search(self, sources, without=()):
+        blocked = set(without)
+        parents = dict((source, None) for source in sources if source not in blocked)
+        queue = deque(parents)
+        while queue:
+            node = queue.popleft()
+            for neighbour, local, remote in self.adjacency.get(node, ()):
+                if neighbour not in parents and neighbour not in blocked:
+                    parents[neighbour] = (node, local, remote)
+                    queue.append(neighbour)
+        return set(parents), parents
+
+    def path(self, source, target):
+        """
+        The shortest path from device source to device target as a list of
+        (device, interface, next device, interface) hops, [] when they are
+        the same device and None when target can't be reached.
+        """
+        if source == target:
+            return []
+        found, parents = self._search(set([source]))
+        if target not in found:
+            return None
+        hops = []
+        node = target
+        while parents[node] is not None:
+            previous, local, remote = parents[node]
+            hops.append((previous, local, node, remote))
+            node = previous
+        hops.reverse()
+        return hops
+
+    def interface_path(self, source, target):
+        """
+        Shortest path between two interfaces, see path().
+        """
+        return self.path(self.device_of(source), self.device_of(target))
+
+    def blast_radius(self, device, roots=None):
+        """
+        The devices that can reach one of roots (the routers by default)
+        now but no longer could if device failed.
+        """
+        roots = set(roots is None and self.routers or roots)
+        key = ('reachable', frozenset(roots))
+        if key not in self._memo:
+            self._memo[key] = self._search(roots)[0]
+        before = self._memo[key]
+        after = self._search(roots - set([device]), without=[device])[0]
+        return before - after - set([device])
+
+    def vlan_components(self, vlan=None):
+        """
+        Return {vlan: [set of device ids, ...]}: the devices that can reach
+        each other over cables whose both ends are in that VLAN.
+        """
+        if 'vlans' not in self._memo:
+            self._memo['vlans'] = self._vlan_components()
+        components = self._memo['vlans']
+        if vlan is not None:
+            return {vlan: components.get(vlan, [])}
+        return components
+
+    def _vlan_components(self):
+        parent = {}
+
+        def find(node):
+            root = node
+            while parent[root] != root:
+                root = parent[root]
+            while parent[node] != root:
+                parent[node], node = root, parent[node]
+            return root
+
+        for device, interface_vlan in self.interfaces.itervalues():
+            if interface_vlan is not None:
+                parent[(interface_vlan, device)] = (interface_vlan, device)
+        interfaces = self.interfaces
+        for local, remote in self.cables:
+            local_device, local_vlan = interfaces[local]
+            remote_device, remote_vlan = interfaces[remote]
+            if local_vlan is not None and local_vlan == remote_vlan:
+                parent[find((local_vlan, local_device))] = find((local_vlan, remote_device))
+        groups = {}
+        for node in parent:
+            groups.setdefault(find(node), set()).add(node[1])
+        components = {}
+        for (component_vlan, device), members in groups.iteritems():
+            components.setdefault(component_vlan, []).append(members)
+        return components
+
+_graphs = {}
+
+def generation():
+    """
+    A token that changes whenever the topology does. If it fell out of the
+    cache a new one is made, which makes every process rebuild.
+    """
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        cache.add(GENERATION_KEY, uuid4().hex, GENERATION_TIMEOUT)
+        current = cache.get(GENERATION_KEY)
+    return current
+
+def invalidate(**kwargs):
+    """
+    Drop every built graph, in every process sharing the cache.
+    """
+    cache.set(GENERATION_KEY, uuid4().hex, GENERATION_TIMEOUT)
+    _graphs.clear()
+
+def topology(datacentre=None):
+    """
+    The topology of a datacentre (or of everything), built once and reused
+    until an interface or KVM connection changes.
+    """
+    key = getattr(datacentre, 'pk', datacentre)
+    current = generation()
+    cached = _graphs.get(key)
+    if cached is None or cached[0] != current:
+        cached = _graphs[key] = (current, Topology.load(key))
+    return cached[1]
+
+def connections_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate()
+
+def pre_save_handler(sender, instance, **kwargs):
+    # graphs per datacentre depend on where a device, rack or room is
+    field = {Rack: 'serverroom_id', Serverroom: 'datacentre_id'}.get(sender, 'rack_id')
+    old = snapshot.stored(sender, instance)
+    if old is None and issubclass(sender, Device):
+        old = snapshot.stored(Device, instance)
+    instance._topology_moved = old is not None and old[field] != getattr(instance, field)
+
+def saved(sender, instance, created, **kwargs):
+    if getattr(instance, '_topology_moved', False) or (created and sender is Router):
+        invalidate()
+
+post_save.connect(invalidate, sender=Networkinterface)
+post_delete.connect(invalidate, sender=Networkinterface)
+bulk_inserted.connect(invalidate, sender=Networkinterface)
+bulk_inserted.connect(invalidate, sender=Router)
+m2m_changed.connect(connections_changed, sender=KVM.connections.through)
+for model in [Device, Rack, Serverroom] + Device.__subclasses__():
+    pre_save.connect(pre_save_handler, sender=model)
+    post_save.connect(saved, sender=model)
+# a deleted device takes its KVM connections along without an m2m_changed
+post_delete.connect(invalidate, sender=Device)
+caches.per_request(invalidate)
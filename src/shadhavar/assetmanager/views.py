@@ -0,0 +1,72 @@
+import json
+
+from datetime import datetime
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+
+from assetmanager import exporter, lifecycle, locations, metrics as request_metrics
+from assetmanager import search as search_index
+
+def export(request, format, compress=None):
+    """
+    Stream the whole inventory as CSV or JSON lines, optionally gzipped.
+    The response body is generated while it is being sent.
+    """
+    stream, content_type = exporter.export(format, compress=bool(compress))
+    response = HttpResponse(stream, mimetype=content_type)
+    response['Content-Disposition'] = 'attachment; filename=inventory.%s%s' % (format, compress or '')
+    return response
+
+def search(request):
+    """
+    Search the inventory, e.g. /assets/search?q=dell+r710&type=server.
+    Answers JSON with the hits and the number of matches per facet value;
+    datacentre and serverroom facets are keyed by id and named in 'names'.
+    """
+    filters = {}
+    for facet in search_index.FACETS:
+        value = request.GET.get(facet)
+        if value and facet in ('datacentre', 'serverroom'):
+            try:
+                value = int(value)
+            except ValueError:
+                return HttpResponseBadRequest('%s must be an id' % facet)
+        if value:
+            filters[facet] = value
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 50)), 500))
+    except ValueError:
+        limit = 50
+    result = search_index.search(request.GET.get('q', ''), limit=limit, **filters)
+    result['names'] = {}
+    for kind in ('datacentre', 'serverroom'):
+        result['names'][kind] = dict((id, locations.name(kind, id)) for id in result['facets'][kind] if id is not None)
+    return HttpResponse(json.dumps(result), mimetype='application/json')
+
+def lifecycle_report(request):
+    """
+    The latest lifecycle report as JSON, or the one of ?day=YYYY-MM-DD.
+    The reports are made by `manage.py update_lifecycle`.
+    """
+    day = None
+    if request.GET.get('day'):
+        try:
+            day = datetime.strptime(request.GET['day'], '%Y-%m-%d').date()
+        except ValueError:
+            raise Http404
+    report = lifecycle.report(day)
+    if report is None:
+        raise Http404
+    return HttpResponse(report, mimetype='application/json')
+
+def metrics(request):
+    """
+    The request metrics of this process in the Prometheus text format,
+    for staff and for the addresses in ASSETMANAGER_METRICS_IPS (none by
+    default).
+    """
+    allowed = request.META.get('REMOTE_ADDR') in getattr(settings, 'ASSETMANAGER_METRICS_IPS', ())
+    if not allowed and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(request_metrics.registry.render(), mimetype='text/plain; version=0.0.4')
@@ -1,23 +1,39 @@
 from django.conf import settings
-from django.contrib.auth.views import login
 from django.contrib import auth
+from django.core.cache import cache
 from django.http import HttpResponseRedirect
 from datetime import datetime, timedelta
 
+TOUCH_KEY = 'shadhavar.touch.%s'
+
 class RequireLoginMiddleware(object):
     """
     Require Login middleware. If enabled, each Django-powered page will
     require authentication.
 
     If an anonymous user requests a page, he/she is redirected to the login
-    page set by REQUIRE_LOGIN_PATH or /accounts/login/ by default.
+    page set by REQUIRE_LOGIN_PATH or /accounts/login/ by default. The
+    paths in REQUIRE_LOGIN_EXEMPT (a scraped /metrics) are left alone.
+
+    Users idle for longer than AUTO_LOGOUT_DELAY minutes are logged out.
+    The time of their last request is kept in the cache on every request,
+    but only written to the session, and so to the database, once every
+    AUTO_LOGOUT_TOUCH_GRANULARITY seconds. The later of the two is used,
+    so if the cache loses it a user may be logged out at most that many
+    seconds early.
     """
     def __init__(self):
         self.require_login_path = getattr(settings, 'REQUIRE_LOGIN_PATH', '/accounts/login/')
+        self.exempt = getattr(settings, 'REQUIRE_LOGIN_EXEMPT', ())
+        self.delay = timedelta(0, settings.AUTO_LOGOUT_DELAY * 60, 0)
+        self.granularity = timedelta(0, getattr(settings, 'AUTO_LOGOUT_TOUCH_GRANULARITY', 60), 0)
 
     def process_request(self, request):
+        if request.path in self.exempt:
+            return
         if request.path != self.require_login_path and not request.path.startswith('/accounts/reset/') and request.user.is_anonymous():
             if request.POST:
+                from django.contrib.auth.views import login
                 return login(request)
             else:
                 return HttpResponseRedirect('%s?next=%s' % (self.require_login_path, request.path))
@@ -26,12 +42,15 @@ class RequireLoginMiddleware(object):
             #Can't log out if not logged in
             return
 
-        try:
-            if datetime.now() - request.session['last_touch'] > timedelta( 0, settings.AUTO_LOGOUT_DELAY * 60, 0):
-                auth.logout(request)
-                del request.session['last_touch']
-                return
-        except KeyError:
-            pass
+        now = datetime.now()
+        key = TOUCH_KEY % request.session.session_key
+        stored = request.session.get('last_touch')
+        touches = [touch for touch in (stored, cache.get(key)) if touch is not None]
+        if touches and now - max(touches) > self.delay:
+            auth.logout(request)
+            cache.delete(key)
+            return
 
-        request.session['last_touch'] = datetime.now()
+        cache.set(key, now, settings.AUTO_LOGOUT_DELAY * 60)
+        if stored is None or now - stored >= self.granularity:
+            request.session['last_touch'] = now
@@ -12,6 +12,20 @@ MANAGERS = ADMINS
 # Time (minutes) it takes before you will be automatically logged out
 AUTO_LOGOUT_DELAY = 5
 
+# Time (seconds) between writes of the last request time to the session,
+# keep it well below AUTO_LOGOUT_DELAY
+AUTO_LOGOUT_TOUCH_GRANULARITY = 60
+
+# Paths that don't need a login, the request metrics are scraped
+REQUIRE_LOGIN_EXEMPT = ('/metrics',)
+
+# Share of the requests whose queries and cache lookups are recorded, and
+# the scraper addresses allowed to read /metrics besides staff. Behind a
+# reverse proxy every client has the proxy's address, so only list
+# addresses that reach this server directly.
+ASSETMANAGER_METRICS_SAMPLE = 0.1
+ASSETMANAGER_METRICS_IPS = ()
+
 #EMAIL_HOST =
 #EMAIL_PORT =
 #EMAIL_HOST_USER =
@@ -29,6 +43,11 @@ DATABASES = {
     }
 }
 
+# Every process, the API workers and the management commands included,
+# has to use the same cache: the tokens in it tell the processes what
+# changed (see assetmanager.caches).
+CACHE_BACKEND = 'memcached://127.0.0.1:11211/'
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -77,10 +96,12 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'assetmanager.middleware.MetricsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'assetmanager.middleware.AuditMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'middleware.RequireLoginMiddleware',
 )
@@ -1,24 +1,22 @@
 from django.conf.urls.defaults import *
 
-# temporarily enable the admin interface
-from django.contrib import admin
-admin.autodiscover()
+# Views are named by string and the admin is included by module name, so
+# they are only imported when a request first needs them. worker_urls
+# takes the asset and API views from here.
 
-import django.contrib.auth.views
-urlpatterns = patterns('',
-    (r'^accounts/login/$', django.contrib.auth.views.login, {}, 'accounts_login'),
-    (r'^accounts/logout/$', django.contrib.auth.views.logout, {}, 'accounts_logout'),
-    (r'^accounts/reset/done/$', django.contrib.auth.views.password_reset_done, {}, 'accounts_reset_done'),
-    (r'^accounts/reset/complete/$', django.contrib.auth.views.password_reset_complete, {}, 'accounts_reset_complete'),
-    (r'^accounts/reset/confirm/(?P<uidb36>[0-9A-Za-z]+)-(?P<token>.+)/$', django.contrib.auth.views.password_reset_confirm, {}, 'accounts_reset_confirm'),
-    (r'^accounts/reset/$', django.contrib.auth.views.password_reset, {'post_reset_redirect': '/accounts/reset/done'}, 'accounts_reset'),
-    (r'^accounts/password/$', django.contrib.auth.views.password_change, {}, 'accounts_password_change'),
-    (r'^accounts/password/done$', django.contrib.auth.views.password_change_done, {}, 'accounts_password_change_done'),
+accounts = patterns('django.contrib.auth.views',
+    (r'^accounts/login/$', 'login', {}, 'accounts_login'),
+    (r'^accounts/logout/$', 'logout', {}, 'accounts_logout'),
+    (r'^accounts/reset/done/$', 'password_reset_done', {}, 'accounts_reset_done'),
+    (r'^accounts/reset/complete/$', 'password_reset_complete', {}, 'accounts_reset_complete'),
+    (r'^accounts/reset/confirm/(?P<uidb36>[0-9A-Za-z]+)-(?P<token>.+)/$', 'password_reset_confirm', {}, 'accounts_reset_confirm'),
+    (r'^accounts/reset/$', 'password_reset', {'post_reset_redirect': '/accounts/reset/done'}, 'accounts_reset'),
+    (r'^accounts/password/$', 'password_change', {}, 'accounts_password_change'),
+    (r'^accounts/password/done$', 'password_change_done', {}, 'accounts_password_change_done'),
 )
 
-import django.views.generic
 import assetmanager.models
-urlpatterns += patterns('django.views.generic',
+assets = patterns('django.views.generic',
     (r'^assets/datacentre/$', 'list_detail.object_list', {'queryset' : assetmanager.models.Datacentre.objects.all()}, 'datacentre_index'),
     (r'^assets/datacentre/(?P<object_id>[0-9]+)/$', 'list_detail.object_detail', {'queryset': assetmanager.models.Datacentre.objects.all()}, 'datacentre_detail'),
     (r'^assets/datacentre/add/$', 'create_update.create_object', {'model': assetmanager.models.Datacentre, 'post_save_redirect': '/assets/datacentre/'}, 'datacentre_add'),
@@ -32,7 +30,19 @@ urlpatterns += patterns('django.views.generic',
     (r'^assets/serverroom/delete/(?P<object_id>[0-9]+)/$', 'create_update.delete_object', {'model': assetmanager.models.Serverroom, 'post_delete_redirect': '/assets/serverroom/'}, 'serverroom_delete'),
 )
 
-urlpatterns += patterns('',
+assets += patterns('assetmanager.views',
+    (r'^assets/export\.(?P<format>csv|jsonl)(?P<compress>\.gz)?$', 'export', {}, 'inventory_export'),
+    (r'^assets/search$', 'search', {}, 'inventory_search'),
+    (r'^assets/lifecycle$', 'lifecycle_report', {}, 'lifecycle_report'),
+    (r'^metrics$', 'metrics', {}, 'metrics'),
+)
+
+assets += patterns('assetmanager.api',
+    (r'^api/(?P<resource>[a-z]+)/$', 'collection', {}, 'api_collection'),
+    (r'^api/(?P<resource>[a-z]+)/(?P<pk>[0-9]+)/$', 'detail', {}, 'api_detail'),
+)
+
+urlpatterns = accounts + assets + patterns('',
     (r'^admin/doc/', include('django.contrib.admindocs.urls')),
-    (r'^admin/', include(admin.site.urls)),
+    (r'^admin/', include('admin_urls', namespace='admin', app_name='admin')),
 )
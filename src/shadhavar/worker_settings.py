@@ -0,0 +1,31 @@
+# Settings of the API workers: the asset views and the API of urls.py
+# without the admin, admindocs, the accounts pages and the translation
+# machinery, for many short-lived processes. Users log in on the full
+# site, the workers share its sessions and its cache.
+
+from django.conf.global_settings import TEMPLATE_CONTEXT_PROCESSORS
+from settings import *
+
+USE_I18N = False
+USE_L10N = False
+
+ROOT_URLCONF = 'worker_urls'
+
+WORKER_UNUSED = (
+    'django.contrib.admin',
+    'django.contrib.admindocs',
+    'django.contrib.messages',
+    'django.contrib.sites',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.contrib.messages.context_processors.messages',
+    'django.core.context_processors.i18n',
+)
+
+INSTALLED_APPS = tuple(app for app in INSTALLED_APPS if app not in WORKER_UNUSED)
+MIDDLEWARE_CLASSES = tuple(name for name in MIDDLEWARE_CLASSES if name not in WORKER_UNUSED)
+TEMPLATE_CONTEXT_PROCESSORS = tuple(name for name in TEMPLATE_CONTEXT_PROCESSORS if name not in WORKER_UNUSED)
+
+# parse every template once per process
+TEMPLATE_LOADERS = (
+    ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+)
@@ -0,0 +1,7 @@
+# URLconf of the API workers (worker_settings): the asset views and the
+# API, no accounts pages and no admin.
+from django.conf.urls.defaults import *
+
+import urls
+
+urlpatterns = urls.assets